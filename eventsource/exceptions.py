@@ -60,3 +60,15 @@ class SequencedItemError(EventSourcingError):
 
 class TimeSequenceError(EventSourcingError):
     "Raised when a time sequence error occurs e.g. trying to save a timestamp that already exists."
+
+
+class BlobNotFoundError(KeyError, EventSourcingError):
+    "Raised when a blob store has no blob with a given key."
+
+
+class CompressionError(EventSourcingError):
+    "Raised when data can't be compressed or decompressed."
+
+
+class CodecError(EventSourcingError):
+    "Raised when data can't be encoded or decoded by a codec."
@@ -0,0 +1,155 @@
+import asyncio
+
+from eventsource.exceptions import SequencedItemError
+from eventsource.services.activerecord import AbstractActiveRecordStrategy
+
+
+class GroupCommitActiveRecordStrategy(AbstractActiveRecordStrategy):
+    """
+    Coalesces concurrent appends into batches written by one append of a wrapped strategy.
+
+    Appends that arrive within max_delay seconds of the first pending
+    append, or until max_batch_size items are pending, are written
+    together, so that a burst of commands costs one transaction and one
+    commit instead of one each. Each caller still waits for its own items
+    to be written. If the batch conflicts with stored items, and the
+    wrapped strategy's appends are atomic, each caller's items are
+    appended on their own, so that only the callers whose sequences
+    conflicted see the SequencedItemError. Otherwise part of the batch
+    may have been written, so every caller sees the error.
+
+    Reads are passed straight to the wrapped strategy.
+    """
+
+    def __init__(self, strategy, max_delay=0.002, max_batch_size=500):
+        assert isinstance(strategy, AbstractActiveRecordStrategy), strategy
+        super(GroupCommitActiveRecordStrategy, self).__init__(
+            active_record_class=strategy.active_record_class,
+            sequenced_item_class=strategy.sequenced_item_class,
+            notification_log=strategy.notification_log,
+        )
+        self.strategy = strategy
+        self.max_delay = max_delay
+        self.max_batch_size = max_batch_size
+        self._pending = []
+        self._pending_size = 0
+        self._flush_handle = None
+        self._commits = set()
+
+    async def append(self, sequenced_item_or_items):
+        if isinstance(sequenced_item_or_items, list):
+            items = sequenced_item_or_items
+        else:
+            items = [sequenced_item_or_items]
+
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        self._pending.append((items, future))
+        self._pending_size += len(items)
+        if self._pending_size >= self.max_batch_size:
+            self._start_commit()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.max_delay, self._start_commit)
+        await future
+
+    async def flush(self):
+        """
+        Writes pending appends now, and waits for all commits in progress.
+        """
+        if self._pending:
+            self._start_commit()
+        if self._commits:
+            await asyncio.wait(list(self._commits))
+
+    def _start_commit(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending, self._pending_size = self._pending, [], 0
+        if batch:
+            commit = asyncio.ensure_future(self._commit(batch))
+            self._commits.add(commit)
+            commit.add_done_callback(self._commits.discard)
+
+    async def _commit(self, batch):
+        # Items that repeat a position already pending in this batch
+        # can't be written, so those callers fail without a round trip.
+        accepted = []
+        keys = set()
+        for items, future in batch:
+            item_keys = {(item[0], item[1]) for item in items}
+            if len(item_keys) < len(items) or not item_keys.isdisjoint(keys):
+                try:
+                    self.raise_sequenced_item_error(items, "position already pending in group commit")
+                except SequencedItemError as e:
+                    self._set_exception(future, e)
+            else:
+                keys.update(item_keys)
+                accepted.append((items, future))
+        if not accepted:
+            return
+
+        try:
+            await self.strategy.append([item for items, _ in accepted for item in items])
+        except SequencedItemError as e:
+            if not self.strategy.atomic_append:
+                for _, future in accepted:
+                    self._set_exception(future, e)
+                return
+            # Nothing from the batch was written, so retry callers one by one.
+            for items, future in accepted:
+                try:
+                    await self.strategy.append(items)
+                except Exception as e:
+                    self._set_exception(future, e)
+                else:
+                    self._set_result(future)
+        except Exception as e:
+            for _, future in accepted:
+                self._set_exception(future, e)
+        else:
+            for _, future in accepted:
+                self._set_result(future)
+
+    @staticmethod
+    def _set_result(future):
+        if not future.done():
+            future.set_result(None)
+
+    @staticmethod
+    def _set_exception(future, e):
+        if not future.done():
+            future.set_exception(e)
+
+    async def get_item(self, sequence_id, eq):
+        return await self.strategy.get_item(sequence_id, eq)
+
+    async def get_items(self, sequence_id, gt=None, gte=None, lt=None, lte=None, limit=None,
+                        query_ascending=True, results_ascending=True):
+        return await self.strategy.get_items(sequence_id, gt=gt, gte=gte, lt=lt, lte=lte, limit=limit,
+                                             query_ascending=query_ascending,
+                                             results_ascending=results_ascending)
+
+    async def get_stream_head(self, sequence_id):
+        return await self.strategy.get_stream_head(sequence_id)
+
+    async def get_items_batch(self, sequence_ids, gt=None, limit=None, is_ascending=True):
+        return await self.strategy.get_items_batch(sequence_ids, gt=gt, limit=limit, is_ascending=is_ascending)
+
+    async def all_items(self):
+        return await self.strategy.all_items()
+
+    async def all_records(self, resume=None, limit=None, *args, **kwargs):
+        return await self.strategy.all_records(resume, limit, *args, **kwargs)
+
+    async def read_notifications(self, start, limit=None):
+        return await self.strategy.read_notifications(start, limit=limit)
+
+    async def delete_record(self, record):
+        await self.strategy.delete_record(record)
+
+    def from_active_record(self, record):
+        return self.strategy.from_active_record(record)
+
+    def get_resume_token(self, record):
+        return self.strategy.get_resume_token(record)
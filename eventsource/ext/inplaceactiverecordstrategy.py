@@ -1,52 +1,182 @@
+import time
+from bisect import bisect_left, bisect_right, insort
 from typing import List
 
-import six
 from eventsource.services.activerecord import AbstractActiveRecordStrategy
-from eventsource.services.sequenceditem import SequencedItem
+from eventsource.services.sequenceditem import Notification, StreamHead
 
 
 class InPlaceActiveRecordStrategy(AbstractActiveRecordStrategy):
-    dumb_store = []
+    """
+    Keeps sequenced items in memory, indexed by sequence ID.
+
+    Each sequence is held as a pair of parallel lists, one of positions
+    and one of items, both sorted by position. Point reads, range reads,
+    limits and descending reads are answered by bisecting the positions,
+    so they cost O(log n + k) rather than a scan of everything stored.
+    The sequence IDs are also kept sorted, so that scans can resume
+    from a (sequence_id, position) token. With the notification log
+    enabled, items are also kept in the order they were appended, and
+    the notifications of deleted items are left out when they are read.
+    """
+
+    atomic_append = True
 
     def __init__(self, *args, **kwargs):
         super(InPlaceActiveRecordStrategy, self).__init__(*args, **kwargs)
-        self.field_names = SequencedItem
+        self._sequences = {}
+        self._sequence_ids = []
+        self._notifications = []
+        self._updated_at = {}
 
     async def append(self, sequenced_item_or_items):
         if isinstance(sequenced_item_or_items, list):
-            records = sequenced_item_or_items
+            items = sequenced_item_or_items
         else:
-            records = [sequenced_item_or_items]
+            items = [sequenced_item_or_items]
+
+        # Check all the items before storing any of them, so
+        # that a conflicting batch leaves the store unchanged.
+        new_keys = set()
+        for item in items:
+            key = (item[0], item[1])
+            if key in new_keys or self._contains(*key):
+                self.raise_sequenced_item_error(item, "duplicate position")
+            new_keys.add(key)
+
+        for item in items:
+            if item[0] not in self._sequences:
+                self._sequences[item[0]] = ([], [])
+                insort(self._sequence_ids, item[0])
+            positions, stored_items = self._sequences[item[0]]
+            if not positions or item[1] > positions[-1]:
+                positions.append(item[1])
+                stored_items.append(item)
+            else:
+                i = bisect_left(positions, item[1])
+                positions.insert(i, item[1])
+                stored_items.insert(i, item)
 
-        self.dumb_store.extend(records)
+        now = time.time()
+        for item in items:
+            self._updated_at[item[0]] = now
+
+        if self.notification_log:
+            self._notifications.extend(items)
 
     async def get_item(self, sequence_id, eq):
-        return next(x for x in self.dumb_store if
-                    x[1] == eq
-                    and x[0] == sequence_id)
+        try:
+            positions, items = self._sequences[sequence_id]
+        except KeyError:
+            self.raise_index_error(eq)
+        i = bisect_left(positions, eq)
+        if i == len(positions) or positions[i] != eq:
+            self.raise_index_error(eq)
+        return items[i]
+
+    async def get_stream_head(self, sequence_id):
+        try:
+            _, items = self._sequences[sequence_id]
+        except KeyError:
+            return None
+        if items:
+            return StreamHead(sequence_id, items[-1][1], items[-1][2], self._updated_at[sequence_id])
 
     async def get_items(self, sequence_id, gt=None, gte=None, lt=None, lte=None, limit=None,
                         query_ascending=True, results_ascending=True):
         assert limit is None or limit >= 1, limit
-        events = sorted(filter(lambda x: x[0] == sequence_id, self.dumb_store),
-                        key=lambda x: x[1],
-                        reverse=not query_ascending)
-        return events
+        try:
+            positions, items = self._sequences[sequence_id]
+        except KeyError:
+            return []
+
+        start, stop = 0, len(positions)
+        if gt is not None:
+            start = max(start, bisect_right(positions, gt))
+        if gte is not None:
+            start = max(start, bisect_left(positions, gte))
+        if lt is not None:
+            stop = min(stop, bisect_left(positions, lt))
+        if lte is not None:
+            stop = min(stop, bisect_right(positions, lte))
+        if start >= stop:
+            return []
+
+        if limit is not None:
+            if query_ascending:
+                stop = min(stop, start + limit)
+            else:
+                start = max(start, stop - limit)
+
+        selected = items[start:stop]
+        if not results_ascending:
+            selected.reverse()
+        return selected
 
     async def all_items(self):
         """
         Returns all items across all sequences.
         """
-        return self.dumb_store
+        return [item for _, items in self._sequences.values() for item in items]
 
-    async def all_records(self, resume=None, *args, **kwargs) -> List:
+    async def all_records(self, resume=None, limit=None, *args, **kwargs) -> List:
         """
-        Returns all records in the table.
+        Returns records in the table, ordered by sequence ID and position.
         """
-        return self.dumb_store
+        if resume is None:
+            i, start = 0, 0
+        else:
+            resume_sequence_id, resume_position = resume
+            i = bisect_left(self._sequence_ids, resume_sequence_id)
+            if i < len(self._sequence_ids) and self._sequence_ids[i] == resume_sequence_id:
+                positions, _ = self._sequences[resume_sequence_id]
+                start = bisect_right(positions, resume_position)
+            else:
+                start = 0
+
+        records = []
+        while i < len(self._sequence_ids) and (limit is None or len(records) < limit):
+            _, items = self._sequences[self._sequence_ids[i]]
+            stop = None if limit is None else start + limit - len(records)
+            records.extend(items[start:stop])
+            i, start = i + 1, 0
+        return records
+
+    async def read_notifications(self, start, limit=None):
+        if not self.notification_log:
+            self.raise_notification_log_error()
+        assert start >= 1, start
+        stop = None if limit is None else start - 1 + limit
+        items = self._notifications[start - 1:stop]
+        return [Notification(start + i, item) for i, item in enumerate(items) if item is not None]
+
+    def from_active_record(self, record):
+        return record
 
     async def delete_record(self, record):
         """
-        Permanently removes record from table.
+        Permanently removes record from table, leaving a tombstone in place of its notification.
         """
-        pass
+        try:
+            positions, items = self._sequences[record[0]]
+        except KeyError:
+            return
+        i = bisect_left(positions, record[1])
+        if i < len(positions) and positions[i] == record[1]:
+            item = items[i]
+            del positions[i]
+            del items[i]
+            if self.notification_log:
+                # Notifications keep their numbers, so the item is replaced rather than removed.
+                for n in range(len(self._notifications) - 1, -1, -1):
+                    if self._notifications[n] is item:
+                        self._notifications[n] = None
+                        break
+
+    def _contains(self, sequence_id, position):
+        try:
+            positions, _ = self._sequences[sequence_id]
+        except KeyError:
+            return False
+        i = bisect_left(positions, position)
+        return i < len(positions) and positions[i] == position
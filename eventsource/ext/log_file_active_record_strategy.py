@@ -0,0 +1,394 @@
+import asyncio
+import mmap
+import os
+import struct
+import time
+import zlib
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from uuid import UUID
+
+from eventsource.exceptions import EventSourcingError, ProgrammingError
+from eventsource.services.activerecord import AbstractActiveRecordStrategy
+from eventsource.services.sequenceditem import Notification, StreamHead
+
+# Each frame is the length and CRC32 of its payload, then the payload.
+FRAME_HEADER = struct.Struct('>II')
+
+# Each payload starts with the kinds of the sequence ID and position,
+# and the lengths of the sequence ID and the topic. The sequence ID,
+# the position, the topic and the data follow, in that order.
+ITEM_HEADER = struct.Struct('>BBHH')
+POSITION_INT = struct.Struct('>q')
+POSITION_FLOAT = struct.Struct('>d')
+
+SEQUENCE_ID_UUID, SEQUENCE_ID_INT, SEQUENCE_ID_STR = 0, 1, 2
+POSITION_KIND_INT, POSITION_KIND_FLOAT = 0, 1
+
+# Locations are packed into one integer, with the segment
+# number above the offset of the frame within the segment.
+OFFSET_BITS = 40
+OFFSET_MASK = (1 << OFFSET_BITS) - 1
+
+LogRecord = namedtuple('LogRecord', ['resume', 'item'])
+
+
+class LogSegment(object):
+    """
+    One file of the log, mapped into memory for reading.
+    """
+
+    def __init__(self, path, number):
+        self.path = path
+        self.number = number
+        self.size = os.path.getsize(path) if os.path.exists(path) else 0
+        self._mmap = None
+
+    def buffer(self, end):
+        """
+        Returns a memory map of the segment that includes the bytes up to given end.
+        """
+        if self._mmap is None or len(self._mmap) < end:
+            with open(self.path, 'rb') as f:
+                buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            # Frames are decoded into new objects, so nothing refers to the old map.
+            self.close()
+            self._mmap = buffer
+        return self._mmap
+
+    def close(self):
+        """
+        Closes the memory map of the segment, if it is mapped.
+        """
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+
+class LogFileActiveRecordStrategy(AbstractActiveRecordStrategy):
+    """
+    Stores sequenced items in append-only segment files.
+
+    Items are written as length prefixed binary frames at the end of the
+    active segment. When the active segment reaches segment_size bytes it
+    is sealed, and a new segment is started. An index in memory holds, for
+    each sequence, the positions and the locations of its items, packed
+    into integer arrays, so stream reads go straight to each frame. The
+    topic of the last item of each sequence is also kept, so stream heads
+    are returned without reading the log. Frames
+    are decoded from memory maps of the segments, without reading the
+    files into intermediate buffers. Scans of all items read the segments
+    in order, which is as fast as reading the files.
+
+    The index is rebuilt by scanning the segments when the strategy is
+    constructed. A frame left incomplete at the end of the log by a crash
+    is truncated. Appended items are written by a dedicated I/O thread,
+    and are flushed, and if fsync is True synced, before append returns.
+
+    Items can't be deleted from the log.
+    """
+
+    def __init__(self, directory, segment_size=64 * 1024 * 1024, fsync=True, *args, **kwargs):
+        super(LogFileActiveRecordStrategy, self).__init__(*args, **kwargs)
+        self.directory = directory
+        self.segment_size = segment_size
+        self.fsync = fsync
+        self._sequences = {}
+        self._heads = {}
+        self._log = array('q')
+        self._segments = []
+        self._file = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='log-file-active-record')
+        self._append_lock = None
+        self._open()
+
+    def _segment_path(self, number):
+        return os.path.join(self.directory, '{:08d}.log'.format(number))
+
+    def _open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        numbers = sorted(int(name[:-4]) for name in os.listdir(self.directory)
+                         if name.endswith('.log') and name[:-4].isdigit())
+        for number in numbers:
+            segment = LogSegment(self._segment_path(number), number)
+            self._segments.append(segment)
+            end = 0
+            # When the items were appended isn't recorded, so the heads
+            # of sequences in a segment are dated by the segment file.
+            modified_at = os.path.getmtime(segment.path)
+            for offset, end, item in self._read_frames(segment, 0):
+                self._index(item[0], item[1], number << OFFSET_BITS | offset)
+                self._update_head(item, modified_at)
+            if end < segment.size:
+                if number != numbers[-1]:
+                    raise EventSourcingError("Corrupt frame at offset {} of sealed segment {}".format(end, segment.path))
+                # The last frame was not completely written.
+                with open(segment.path, 'r+b') as f:
+                    f.truncate(end)
+                segment.size = end
+        if not self._segments:
+            self._segments.append(LogSegment(self._segment_path(1), 1))
+        self._file = open(self._segments[-1].path, 'ab')
+
+    def close(self):
+        """
+        Closes the active segment and the memory maps of the segments, and stops the I/O thread.
+        """
+        if self._file is not None:
+            self._executor.submit(self._file.close).result()
+            self._file = None
+        self._executor.shutdown()
+        for segment in self._segments:
+            segment.close()
+
+    def _index(self, sequence_id, position, location):
+        try:
+            positions, locations = self._sequences[sequence_id]
+        except KeyError:
+            positions, locations = self._sequences[sequence_id] = ([], array('q'))
+        if not positions or position > positions[-1]:
+            positions.append(position)
+            locations.append(location)
+        else:
+            i = bisect_left(positions, position)
+            positions.insert(i, position)
+            locations.insert(i, location)
+        if self.notification_log:
+            self._log.append(location)
+
+    def _update_head(self, item, updated_at):
+        positions, _ = self._sequences[item[0]]
+        if item[1] == positions[-1]:
+            self._heads[item[0]] = (item[2], updated_at)
+
+    def _contains(self, sequence_id, position):
+        try:
+            positions, _ = self._sequences[sequence_id]
+        except KeyError:
+            return False
+        i = bisect_left(positions, position)
+        return i < len(positions) and positions[i] == position
+
+    async def append(self, sequenced_item_or_items):
+        if isinstance(sequenced_item_or_items, list):
+            items = sequenced_item_or_items
+        else:
+            items = [sequenced_item_or_items]
+
+        frames = [self.encode_frame(item) for item in items]
+        if self._append_lock is None:
+            self._append_lock = asyncio.Lock()
+        async with self._append_lock:
+            keys = set()
+            for item in items:
+                key = (item[0], item[1])
+                if key in keys or self._contains(*key):
+                    self.raise_sequenced_item_error(item, "duplicate position")
+                keys.add(key)
+
+            loop = asyncio.get_event_loop()
+            segment, offsets = await loop.run_in_executor(self._executor, self._write, frames)
+            now = time.time()
+            for item, offset in zip(items, offsets):
+                self._index(item[0], item[1], segment.number << OFFSET_BITS | offset)
+                self._update_head(item, now)
+
+    def _write(self, frames):
+        segment = self._segments[-1]
+        if segment.size >= self.segment_size:
+            segment = self._rotate()
+        offsets = []
+        size = segment.size
+        for frame in frames:
+            offsets.append(size)
+            self._file.write(frame)
+            size += len(frame)
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+        # Readers only see the frames once they are in the file.
+        segment.size = size
+        return segment, offsets
+
+    def _rotate(self):
+        """
+        Seals the active segment, and starts the next one.
+        """
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        number = self._segments[-1].number + 1
+        segment = LogSegment(self._segment_path(number), number)
+        self._file = open(segment.path, 'ab')
+        self._segments.append(segment)
+        return segment
+
+    def _segment(self, number):
+        # Segments are numbered consecutively from the first one.
+        return self._segments[number - self._segments[0].number]
+
+    def _read_location(self, location):
+        segment = self._segment(location >> OFFSET_BITS)
+        offset = location & OFFSET_MASK
+        length, _ = FRAME_HEADER.unpack_from(segment.buffer(offset + FRAME_HEADER.size), offset)
+        start = offset + FRAME_HEADER.size
+        return self.decode_item(segment.buffer(start + length), start, start + length)
+
+    def _read_frames(self, segment, offset, check=True):
+        """
+        Yields the offset, end and item of the frames of a segment, from given offset.
+        """
+        # The I/O thread grows the segment, so frames are read up to its size when they are mapped.
+        size = segment.size
+        if size == 0:
+            return
+        buffer = segment.buffer(size)
+        while offset + FRAME_HEADER.size <= size:
+            length, crc = FRAME_HEADER.unpack_from(buffer, offset)
+            start = offset + FRAME_HEADER.size
+            end = start + length
+            if end > size:
+                break
+            if check:
+                with memoryview(buffer) as view:
+                    if zlib.crc32(view[start:end]) != crc:
+                        break
+            yield offset, end, self.decode_item(buffer, start, end)
+            offset = end
+
+    async def get_item(self, sequence_id, eq):
+        try:
+            positions, locations = self._sequences[sequence_id]
+        except KeyError:
+            self.raise_index_error(eq)
+        i = bisect_left(positions, eq)
+        if i == len(positions) or positions[i] != eq:
+            self.raise_index_error(eq)
+        return self._read_location(locations[i])
+
+    async def get_stream_head(self, sequence_id):
+        try:
+            positions, _ = self._sequences[sequence_id]
+        except KeyError:
+            return None
+        topic, updated_at = self._heads[sequence_id]
+        return StreamHead(sequence_id, positions[-1], topic, updated_at)
+
+    async def get_items(self, sequence_id, gt=None, gte=None, lt=None, lte=None, limit=None,
+                        query_ascending=True, results_ascending=True):
+        assert limit is None or limit >= 1, limit
+        try:
+            positions, locations = self._sequences[sequence_id]
+        except KeyError:
+            return []
+
+        start, stop = 0, len(positions)
+        if gt is not None:
+            start = max(start, bisect_right(positions, gt))
+        if gte is not None:
+            start = max(start, bisect_left(positions, gte))
+        if lt is not None:
+            stop = min(stop, bisect_left(positions, lt))
+        if lte is not None:
+            stop = min(stop, bisect_right(positions, lte))
+        if start >= stop:
+            return []
+
+        if limit is not None:
+            if query_ascending:
+                stop = min(stop, start + limit)
+            else:
+                start = max(start, stop - limit)
+
+        items = [self._read_location(location) for location in locations[start:stop]]
+        if not results_ascending:
+            items.reverse()
+        return items
+
+    async def all_items(self):
+        return [item for segment in list(self._segments)
+                for _, _, item in self._read_frames(segment, 0, check=False)]
+
+    async def all_records(self, resume=None, limit=None, *args, **kwargs):
+        """
+        Returns records in the order they were appended.
+
+        Records are resumed from the segment number and offset of the next frame.
+        """
+        number, offset = resume or (self._segments[0].number, 0)
+        records = []
+        for segment in list(self._segments[number - self._segments[0].number:]):
+            for _, end, item in self._read_frames(segment, offset, check=False):
+                records.append(LogRecord((segment.number, end), item))
+                if limit is not None and len(records) == limit:
+                    return records
+            offset = 0
+        return records
+
+    def from_active_record(self, record):
+        return record.item
+
+    def get_resume_token(self, record):
+        return record.resume
+
+    async def read_notifications(self, start, limit=None):
+        if not self.notification_log:
+            self.raise_notification_log_error()
+        assert start >= 1, start
+        stop = None if limit is None else start - 1 + limit
+        locations = self._log[start - 1:stop]
+        return [Notification(start + i, self._read_location(location)) for i, location in enumerate(locations)]
+
+    async def delete_record(self, record):
+        raise ProgrammingError("Items can't be deleted from an append-only log")
+
+    def encode_frame(self, item):
+        sequence_id, position, topic, data = item[0], item[1], item[2], item[3]
+        if isinstance(sequence_id, UUID):
+            sequence_id_kind, sequence_id_bytes = SEQUENCE_ID_UUID, sequence_id.bytes
+        elif isinstance(sequence_id, int) and not isinstance(sequence_id, bool):
+            sequence_id_kind, sequence_id_bytes = SEQUENCE_ID_INT, POSITION_INT.pack(sequence_id)
+        elif isinstance(sequence_id, str):
+            sequence_id_kind, sequence_id_bytes = SEQUENCE_ID_STR, sequence_id.encode('utf8')
+        else:
+            raise TypeError("Unsupported sequence ID type: {}".format(type(sequence_id)))
+
+        if isinstance(position, float):
+            position_kind, position_bytes = POSITION_KIND_FLOAT, POSITION_FLOAT.pack(position)
+        else:
+            position_kind, position_bytes = POSITION_KIND_INT, POSITION_INT.pack(position)
+
+        topic_bytes = topic.encode('utf8')
+        payload = b''.join((
+            ITEM_HEADER.pack(sequence_id_kind, position_kind, len(sequence_id_bytes), len(topic_bytes)),
+            sequence_id_bytes,
+            position_bytes,
+            topic_bytes,
+            data.encode('utf8'),
+        ))
+        return FRAME_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+    def decode_item(self, buffer, start, end):
+        sequence_id_kind, position_kind, sequence_id_length, topic_length = ITEM_HEADER.unpack_from(buffer, start)
+        i = start + ITEM_HEADER.size
+        with memoryview(buffer) as view:
+            sequence_id_bytes = view[i:i + sequence_id_length]
+            if sequence_id_kind == SEQUENCE_ID_UUID:
+                sequence_id = UUID(bytes=bytes(sequence_id_bytes))
+            elif sequence_id_kind == SEQUENCE_ID_INT:
+                sequence_id, = POSITION_INT.unpack_from(sequence_id_bytes)
+            else:
+                sequence_id = str(sequence_id_bytes, 'utf8')
+            i += sequence_id_length
+
+            if position_kind == POSITION_KIND_FLOAT:
+                position, = POSITION_FLOAT.unpack_from(buffer, i)
+            else:
+                position, = POSITION_INT.unpack_from(buffer, i)
+            i += 8
+
+            topic = str(view[i:i + topic_length], 'utf8')
+            data = str(view[i + topic_length:end], 'utf8')
+        return self.sequenced_item_class(sequence_id, position, topic, data)
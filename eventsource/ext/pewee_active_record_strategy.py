@@ -1,85 +1,336 @@
+import operator
+import time
 from builtins import list
-from peewee_async import execute
+from functools import reduce
+
 from playhouse.postgres_ext import JSONField
 from peewee import *
-from eventsource.services.activerecord import AbstractActiveRecordStrategy
+from eventsource.services.activerecord import AbstractActiveRecordStrategy, TopicCache
+from eventsource.services.sequenceditem import Notification, StreamHead
+
+# Key of the transaction level advisory lock that serialises writers
+# of the notification log, so that notification IDs have no gaps.
+NOTIFICATION_LOG_LOCK_KEY = 0x6e6f7469
+
+# Moves the heads of streams forward, unless later positions are already
+# recorded. Formatted with a row of placeholders for each stream.
+UPSERT_STREAM_HEADS_SQL = (
+    'INSERT INTO es_int_streams (sequence_id, position, topic, updated_at) VALUES {} '
+    'ON CONFLICT (sequence_id) DO UPDATE SET '
+    'position = EXCLUDED.position, topic = EXCLUDED.topic, updated_at = EXCLUDED.updated_at '
+    'WHERE EXCLUDED.position > es_int_streams.position '
+    'RETURNING sequence_id'
+)
+
+# Moves the head of a stream back to its last item, if the head's item was deleted.
+REWIND_STREAM_HEAD_SQL = (
+    'UPDATE es_int_streams SET position = e.position, topic = e.topic, updated_at = %s '
+    'FROM (SELECT position, topic FROM es_int_events WHERE sequence_id = %s '
+    'ORDER BY position DESC LIMIT 1) e '
+    'WHERE es_int_streams.sequence_id = %s AND es_int_streams.position = %s '
+    'RETURNING es_int_streams.sequence_id'
+)
+
+REWIND_INTERNED_STREAM_HEAD_SQL = (
+    'UPDATE es_int_streams SET position = e.position, topic = e.topic, updated_at = %s '
+    'FROM (SELECT i.position, t.topic FROM es_int_interned_events i JOIN es_int_topics t ON t.topic_id = i.topic '
+    'WHERE i.sequence_id = %s ORDER BY i.position DESC LIMIT 1) e '
+    'WHERE es_int_streams.sequence_id = %s AND es_int_streams.position = %s '
+    'RETURNING es_int_streams.sequence_id'
+)
+
+# Removes the head of a stream whose items have all been deleted.
+DELETE_STREAM_HEAD_SQL = (
+    'DELETE FROM es_int_streams WHERE sequence_id = %s AND position = %s '
+    'RETURNING sequence_id'
+)
+
+# Fills in the heads of streams stored before there was a streams table.
+BACKFILL_STREAM_HEADS_SQL = (
+    'INSERT INTO es_int_streams (sequence_id, position, topic, updated_at) '
+    'SELECT DISTINCT ON (sequence_id) sequence_id, position, topic, %s FROM es_int_events '
+    'ORDER BY sequence_id, position DESC'
+)
+
+BACKFILL_INTERNED_STREAM_HEADS_SQL = (
+    'INSERT INTO es_int_streams (sequence_id, position, topic, updated_at) '
+    'SELECT DISTINCT ON (e.sequence_id) e.sequence_id, e.position, t.topic, %s FROM es_int_interned_events e '
+    'JOIN es_int_topics t ON t.topic_id = e.topic '
+    'ORDER BY e.sequence_id, e.position DESC'
+)
+
+# Returns the ID of a topic, giving it the next ID if it has none.
+INSERT_TOPIC_SQL = (
+    'INSERT INTO es_int_topics (topic) VALUES (%s) '
+    'ON CONFLICT (topic) DO UPDATE SET topic = EXCLUDED.topic '
+    'RETURNING topic_id'
+)
 
 
 class PeweeActiveRecordStrategy(AbstractActiveRecordStrategy):
-    def __init__(self, manager, *args, **kwargs):
+    """
+    Stores sequenced items in a PostgreSQL table.
+
+    If intern_topics is True, each topic is stored once in a topics
+    table, and the events table stores its integer ID instead. Topics and
+    their IDs are cached, so they are only read from the topics table the
+    first time they are seen. Since the events table has a topic column of
+    another type, the items are kept in the es_int_interned_events table.
+    """
+
+    # The number of sequences selected by each query of a batch read.
+    batch_chunk_size = 500
+
+    atomic_append = True
+
+    def __init__(self, manager, intern_topics=False, *args, **kwargs):
         self.manager = manager
-        EventRecord._meta.database = self.manager.database
-        if not EventRecord.table_exists():
-            EventRecord.create_table()
+        self.intern_topics = intern_topics
+        self.record_class = InternedEventRecord if intern_topics else EventRecord
+        self.topics = TopicCache()
+        self.record_class._meta.database = self.manager.database
+        if not self.record_class.table_exists():
+            self.record_class.create_table()
+
+        if intern_topics:
+            TopicRecord._meta.database = self.manager.database
+            if not TopicRecord.table_exists():
+                TopicRecord.create_table()
+
+        StreamRecord._meta.database = self.manager.database
+        if not StreamRecord.table_exists():
+            StreamRecord.create_table()
+            backfill_sql = BACKFILL_INTERNED_STREAM_HEADS_SQL if intern_topics else BACKFILL_STREAM_HEADS_SQL
+            self.manager.database.execute_sql(backfill_sql, (time.time(),))
 
         super(PeweeActiveRecordStrategy, self).__init__(*args, **kwargs)
 
+        if self.notification_log:
+            NotificationRecord._meta.database = self.manager.database
+            if not NotificationRecord.table_exists():
+                NotificationRecord.create_table()
+
     async def append(self, sequenced_item_or_items):
         if isinstance(sequenced_item_or_items, list):
-            active_records = [self.to_active_record(i) for i in sequenced_item_or_items]
+            items = sequenced_item_or_items
         else:
-            active_records = [self.to_active_record(sequenced_item_or_items)]
+            items = [sequenced_item_or_items]
 
-        async with self.manager.atomic():
-            await self.manager.execute(EventRecord.insert_many(active_records))
+        if self.intern_topics:
+            # Topics are given IDs outside the transaction, so the
+            # cached IDs are never rolled back.
+            for topic in {item.topic for item in items}:
+                await self.get_topic_id(topic)
+        active_records = [self.to_active_record(i) for i in items]
+
+        try:
+            async with self.manager.atomic():
+                await self.manager.execute(self.record_class.insert_many(active_records))
+                await self.update_stream_heads(items)
+                if self.notification_log:
+                    await self.append_notifications(active_records)
+        except IntegrityError as e:
+            self.raise_sequenced_item_error(sequenced_item_or_items, e)
+
+    async def get_topic_id(self, topic):
+        """
+        Returns the ID of given topic, from the cache, or else from the topics table.
+        """
+        topic_id = self.topics.get_id(topic)
+        if topic_id is None:
+            rows = list(await self.manager.execute(TopicRecord.raw(INSERT_TOPIC_SQL, topic)))
+            topic_id = rows[0].topic_id
+            self.topics.add(topic_id, topic)
+        return topic_id
+
+    async def load_topics(self, rows):
+        """
+        Caches the topics of given rows that aren't cached yet, and returns the rows.
+        """
+        if self.intern_topics:
+            missing_ids = self.topics.missing_ids({row.topic for row in rows})
+            if missing_ids:
+                query = TopicRecord.select().where(TopicRecord.topic_id.in_(list(missing_ids)))
+                for record in await self.manager.execute(query):
+                    self.topics.add(record.topic_id, record.topic)
+        return rows
+
+    async def select(self, query):
+        return await self.load_topics(list(await self.manager.execute(query)))
+
+    async def update_stream_heads(self, items):
+        """
+        Records the last position of each stream appended to, within the current transaction.
+        """
+        heads = {}
+        for item in items:
+            head = heads.get(item.sequence_id)
+            if head is None or item.position > head.position:
+                heads[item.sequence_id] = item
+        now = time.time()
+        params = [value for item in heads.values() for value in (item.sequence_id, item.position, item.topic, now)]
+        sql = UPSERT_STREAM_HEADS_SQL.format(', '.join(['(%s, %s, %s, %s)'] * len(heads)))
+        await self.manager.execute(StreamRecord.raw(sql, *params))
+
+    async def get_stream_head(self, sequence_id):
+        rows = list(await self.manager.execute(
+            StreamRecord.select().where(StreamRecord.sequence_id == sequence_id)))
+        if rows:
+            row = rows[0]
+            return StreamHead(row.sequence_id, row.position, row.topic, row.updated_at)
+
+    async def append_notifications(self, active_records):
+        """
+        Gives the records the next IDs in the notification log, within the current transaction.
+        """
+        await self.manager.execute(
+            NotificationRecord.raw('SELECT pg_advisory_xact_lock(%s)', NOTIFICATION_LOG_LOCK_KEY))
+        last_id = await self.manager.scalar(NotificationRecord.select(fn.MAX(NotificationRecord.notification_id)))
+        last_id = last_id or 0
+        await self.manager.execute(NotificationRecord.insert_many([
+            {
+                'notification_id': last_id + i,
+                'sequence_id': record['sequence_id'],
+                'position': record['position'],
+            } for i, record in enumerate(active_records, 1)
+        ]))
 
     async def get_item(self, sequence_id, eq):
-        return await EventRecord \
-            .select() \
-            .where(EventRecord.sequence_id == sequence_id and EventRecord.position == eq)
+        record_class = self.record_class
+        rows = await self.select(record_class
+                                 .select()
+                                 .where((record_class.sequence_id == sequence_id) & (record_class.position == eq)))
+        if not rows:
+            self.raise_index_error(eq)
+        return self.from_active_record(rows[0])
 
     async def get_items(self, sequence_id, gt=None, gte=None, lt=None, lte=None, limit=None,
                         query_ascending=True, results_ascending=True):
-        query = EventRecord.select().where(EventRecord.sequence_id == sequence_id)
+        record_class = self.record_class
+        query = record_class.select().where(record_class.sequence_id == sequence_id)
         if gt is not None:
-            query = query.where(EventRecord.position > gt)
+            query = query.where(record_class.position > gt)
         if gte is not None:
-            query = query.where(EventRecord.position >= gte)
+            query = query.where(record_class.position >= gte)
         if lt is not None:
-            query = query.where(EventRecord.position < lt)
+            query = query.where(record_class.position < lt)
         if lte is not None:
-            query = query.where(EventRecord.position <= lte)
+            query = query.where(record_class.position <= lte)
 
         if limit is not None:
             query = query.limit(limit)
 
         if query_ascending:
-            query = query.order_by(EventRecord.position.asc())
+            query = query.order_by(record_class.position.asc())
         else:
-            query = query.order_by(EventRecord.position.desc())
+            query = query.order_by(record_class.position.desc())
 
-        events = []
-        async with self.manager.atomic():
-            for row in await self.manager.execute(query):
-                events.append(self.from_active_record(row))
+        items = [self.from_active_record(row) for row in await self.select(query)]
+        if results_ascending != query_ascending:
+            items.reverse()
+        return items
+
+    async def get_items_batch(self, sequence_ids, gt=None, limit=None, is_ascending=True):
+        if limit is not None and limit != 1:
+            return await super(PeweeActiveRecordStrategy, self).get_items_batch(
+                sequence_ids, gt=gt, limit=limit, is_ascending=is_ascending)
 
-        return events
+        record_class = self.record_class
+        gt = gt or {}
+        items = {sequence_id: [] for sequence_id in sequence_ids}
+        # The rows have IDs of the column's type, which may not be the type the IDs were given in.
+        keys = {self.to_sequence_key(sequence_id): sequence_id for sequence_id in items}
+        sequence_ids = list(items)
+        position_order = record_class.position.asc() if is_ascending else record_class.position.desc()
+        for i in range(0, len(sequence_ids), self.batch_chunk_size):
+            chunk = sequence_ids[i:i + self.batch_chunk_size]
+            conditions = [(record_class.sequence_id == sequence_id) & (record_class.position > gt[sequence_id])
+                          for sequence_id in chunk if gt.get(sequence_id) is not None]
+            whole_sequence_ids = [sequence_id for sequence_id in chunk if gt.get(sequence_id) is None]
+            if whole_sequence_ids:
+                conditions.append(record_class.sequence_id.in_(whole_sequence_ids))
+
+            query = record_class \
+                .select() \
+                .where(reduce(operator.or_, conditions)) \
+                .order_by(record_class.sequence_id.asc(), position_order)
+            if limit is not None:
+                # Selects only the first row of each sequence, in the order of the query.
+                query = query.distinct([record_class.sequence_id])
+            for row in await self.select(query):
+                items[keys[self.to_sequence_key(row.sequence_id)]].append(self.from_active_record(row))
+        return items
 
     async def all_items(self):
-        return await execute(EventRecord.select())
+        return [self.from_active_record(r) for r in await self.select(self.record_class.select())]
 
-    async def all_records(self, resume=None, *args, **kwargs):
-        return await execute(EventRecord.select())
+    async def all_records(self, resume=None, limit=None, *args, **kwargs):
+        record_class = self.record_class
+        query = record_class.select().order_by(record_class.sequence_id.asc(), record_class.position.asc())
+        if resume is not None:
+            sequence_id, position = resume
+            query = query.where((record_class.sequence_id > sequence_id) |
+                                ((record_class.sequence_id == sequence_id) & (record_class.position > position)))
+        if limit is not None:
+            query = query.limit(limit)
+        return await self.select(query)
+
+    async def read_notifications(self, start, limit=None):
+        if not self.notification_log:
+            self.raise_notification_log_error()
+        record_class = self.record_class
+        query = record_class \
+            .select(record_class, NotificationRecord.notification_id) \
+            .join(NotificationRecord, on=((NotificationRecord.sequence_id == record_class.sequence_id) &
+                                          (NotificationRecord.position == record_class.position))) \
+            .where(NotificationRecord.notification_id >= start) \
+            .order_by(NotificationRecord.notification_id.asc()) \
+            .naive()
+        if limit is not None:
+            query = query.where(NotificationRecord.notification_id < start + limit)
+        return [Notification(row.notification_id, self.from_active_record(row))
+                for row in await self.select(query)]
 
     async def delete_record(self, record):
-        await execute(EventRecord.delete_instance(record))
+        """
+        Deletes record, and moves the head of its stream back if it was the last item.
+        """
+        record_class = self.record_class
+        sequence_id = getattr(record, self.field_names.sequence_id)
+        position = getattr(record, self.field_names.position)
+        rewind_sql = REWIND_INTERNED_STREAM_HEAD_SQL if self.intern_topics else REWIND_STREAM_HEAD_SQL
+        async with self.manager.atomic():
+            await self.manager.execute(record_class.delete().where(
+                (record_class.sequence_id == sequence_id) & (record_class.position == position)))
+            await self.manager.execute(StreamRecord.raw(rewind_sql, time.time(), sequence_id, sequence_id, position))
+            # If the stream has no items left, its head wasn't moved.
+            await self.manager.execute(StreamRecord.raw(DELETE_STREAM_HEAD_SQL, sequence_id, position))
 
     def init(self):
-        EventRecord._meta.database = self.manager.database
-        EventRecord.create_table(True)
+        self.record_class._meta.database = self.manager.database
+        self.record_class.create_table(True)
+
+    def to_sequence_key(self, sequence_id):
+        """
+        Returns given sequence ID as the type of the sequence ID column.
+        """
+        field = self.record_class.sequence_id
+        return field.python_value(field.db_value(sequence_id))
+
+    def from_active_record(self, record):
+        kwargs = self.get_field_kwargs(record)
+        if self.intern_topics:
+            kwargs[self.field_names.topic] = self.topics.get_topic(kwargs[self.field_names.topic])
+        return self.sequenced_item_class(**kwargs)
 
     def to_active_record(self, item):
         return {
             'sequence_id': item.sequence_id,
             'position': item.position,
-            'topic': item.topic,
+            'topic': self.topics.get_id(item.topic) if self.intern_topics else item.topic,
             'data': item.data
         }
 
-    def from_active_record(self, item):
-        kwargs = self.get_field_kwargs(item)
-        return self.sequenced_item_class(**kwargs)
-
 
 class EventRecord(Model):
     sequence_id = UUIDField()
@@ -90,3 +341,41 @@ class EventRecord(Model):
     class Meta:
         db_table = 'es_int_events'
         primary_key = CompositeKey('sequence_id', 'position')
+
+
+class InternedEventRecord(Model):
+    sequence_id = UUIDField()
+    position = BigIntegerField()
+    topic = IntegerField()
+    data = JSONField()
+
+    class Meta:
+        db_table = 'es_int_interned_events'
+        primary_key = CompositeKey('sequence_id', 'position')
+
+
+class TopicRecord(Model):
+    topic_id = PrimaryKeyField()
+    topic = CharField(max_length=255, unique=True)
+
+    class Meta:
+        db_table = 'es_int_topics'
+
+
+class StreamRecord(Model):
+    sequence_id = UUIDField(primary_key=True)
+    position = BigIntegerField()
+    topic = CharField(max_length=255)
+    updated_at = DoubleField()
+
+    class Meta:
+        db_table = 'es_int_streams'
+
+
+class NotificationRecord(Model):
+    notification_id = BigIntegerField(primary_key=True)
+    sequence_id = UUIDField()
+    position = BigIntegerField()
+
+    class Meta:
+        db_table = 'es_int_notifications'
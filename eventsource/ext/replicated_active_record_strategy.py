@@ -0,0 +1,174 @@
+import itertools
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from eventsource.services.activerecord import AbstractActiveRecordStrategy
+
+
+class ReplicatedActiveRecordStrategy(AbstractActiveRecordStrategy):
+    """
+    Writes to a primary active record strategy, and reads from replicas of it.
+
+    Appends go to the primary. Reads go to the replicas in turn, except
+    when a replica might not yet have items the caller appended. For
+    max_replica_lag seconds after items are appended to a sequence, the
+    last position appended is remembered, and reads of that sequence which
+    should include it are checked: if the replica doesn't have the item
+    yet, the read is repeated on the primary. Reads that can't be checked,
+    such as ascending reads with a limit, go straight to the primary
+    during that time. So a caller always reads its own writes, while
+    most reads are served by the replicas.
+
+    Appended positions are remembered in a context variable, so each
+    asyncio task, and the tasks it starts afterwards, read their own
+    writes, without other callers' writes sending their reads to the
+    primary. A task started before its caller's first write doesn't pass
+    its writes back to the caller, so callers that write in child tasks,
+    for example with asyncio.gather(), should do so within session().
+
+    Stream heads are read from the primary, since they are used to check
+    the current version of a sequence before appending to it. Scans of
+    all items and notification log reads go to the replicas, and so may
+    lag the primary.
+    """
+
+    def __init__(self, primary, replicas, max_replica_lag=10.0):
+        assert isinstance(primary, AbstractActiveRecordStrategy), primary
+        assert replicas, replicas
+        super(ReplicatedActiveRecordStrategy, self).__init__(
+            active_record_class=primary.active_record_class,
+            sequenced_item_class=primary.sequenced_item_class,
+            notification_log=primary.notification_log,
+        )
+        self.primary = primary
+        self.atomic_append = primary.atomic_append
+        self.replicas = list(replicas)
+        self.max_replica_lag = max_replica_lag
+        self._replica_cycle = itertools.cycle(self.replicas)
+        self._written = ContextVar('replicated_active_record_written_{}'.format(id(self)))
+
+    def replica(self):
+        return next(self._replica_cycle)
+
+    @contextmanager
+    def session(self):
+        """
+        Within the context, reads are checked against the writes made in it, and no others.
+
+        The positions written are shared by the tasks started within the
+        context, so writes made in child tasks are seen by the caller's reads.
+        """
+        token = self._written.set(OrderedDict())
+        try:
+            yield
+        finally:
+            self._written.reset(token)
+
+    def written_position(self, sequence_id):
+        """
+        Returns the last position the caller appended to given sequence, if replicas might not have it yet.
+        """
+        written = self._written.get(None)
+        if not written:
+            return None
+        try:
+            position, written_at = written[sequence_id]
+        except KeyError:
+            return None
+        if time.monotonic() - written_at > self.max_replica_lag:
+            del written[sequence_id]
+            return None
+        return position
+
+    def _record_written(self, items):
+        written = self._written.get(None)
+        if written is None:
+            written = OrderedDict()
+            self._written.set(written)
+        now = time.monotonic()
+        for item in items:
+            sequence_id, position = item[0], item[1]
+            previous = written.pop(sequence_id, None)
+            if previous is not None and previous[0] > position:
+                position = previous[0]
+            written[sequence_id] = (position, now)
+
+        # Forget sequences written longer ago than the replicas can lag.
+        while written:
+            sequence_id, (_, written_at) = next(iter(written.items()))
+            if now - written_at <= self.max_replica_lag:
+                break
+            del written[sequence_id]
+
+    async def append(self, sequenced_item_or_items):
+        await self.primary.append(sequenced_item_or_items)
+        if isinstance(sequenced_item_or_items, list):
+            self._record_written(sequenced_item_or_items)
+        else:
+            self._record_written([sequenced_item_or_items])
+
+    async def get_item(self, sequence_id, eq):
+        try:
+            return await self.replica().get_item(sequence_id, eq)
+        except IndexError:
+            written = self.written_position(sequence_id)
+            if written is None or eq > written:
+                raise
+        return await self.primary.get_item(sequence_id, eq)
+
+    async def get_items(self, sequence_id, gt=None, gte=None, lt=None, lte=None, limit=None,
+                        query_ascending=True, results_ascending=True):
+        kwargs = dict(gt=gt, gte=gte, lt=lt, lte=lte, limit=limit,
+                      query_ascending=query_ascending, results_ascending=results_ascending)
+        written = self.written_position(sequence_id)
+
+        # Nothing recently written falls in the range.
+        if written is None or (gt is not None and written <= gt) or (gte is not None and written < gte):
+            return await self.replica().get_items(sequence_id, **kwargs)
+
+        # The replica's items can't show whether it has caught up.
+        if (lt is not None and written >= lt) or (lte is not None and written > lte) or \
+                (limit is not None and query_ascending):
+            return await self.primary.get_items(sequence_id, **kwargs)
+
+        items = await self.replica().get_items(sequence_id, **kwargs)
+        if items:
+            last_position = max(getattr(items[0], self.field_names.position),
+                                getattr(items[-1], self.field_names.position))
+            if last_position >= written:
+                return items
+        return await self.primary.get_items(sequence_id, **kwargs)
+
+    async def get_stream_head(self, sequence_id):
+        return await self.primary.get_stream_head(sequence_id)
+
+    async def get_items_batch(self, sequence_ids, gt=None, limit=None, is_ascending=True):
+        recent = [s for s in sequence_ids if self.written_position(s) is not None]
+        items = {}
+        if len(recent) < len(sequence_ids):
+            recent_set = set(recent)
+            items.update(await self.replica().get_items_batch(
+                [s for s in sequence_ids if s not in recent_set], gt=gt, limit=limit, is_ascending=is_ascending))
+        if recent:
+            items.update(await self.primary.get_items_batch(recent, gt=gt, limit=limit, is_ascending=is_ascending))
+        return {sequence_id: items[sequence_id] for sequence_id in sequence_ids}
+
+    async def all_items(self):
+        return await self.replica().all_items()
+
+    async def all_records(self, resume=None, limit=None, *args, **kwargs):
+        return await self.replica().all_records(resume, limit, *args, **kwargs)
+
+    async def read_notifications(self, start, limit=None):
+        return await self.replica().read_notifications(start, limit=limit)
+
+    async def delete_record(self, record):
+        await self.primary.delete_record(record)
+
+    def from_active_record(self, record):
+        return self.replicas[0].from_active_record(record)
+
+    def get_resume_token(self, record):
+        return self.replicas[0].get_resume_token(record)
@@ -0,0 +1,141 @@
+import asyncio
+import heapq
+import zlib
+from collections import namedtuple
+from itertools import islice
+from uuid import UUID
+
+from eventsource.services.activerecord import AbstractActiveRecordStrategy
+
+ShardRecord = namedtuple('ShardRecord', ['shard', 'record'])
+
+
+class ShardedActiveRecordStrategy(AbstractActiveRecordStrategy):
+    """
+    Spreads sequences across several active record strategies.
+
+    Each sequence belongs to one shard, chosen by a stable hash of its
+    sequence ID, so all the items of a sequence are in one place and
+    reads of a sequence go to one shard. Reads of many sequences and
+    scans of all items are sent to all the shards concurrently.
+
+    Items appended together that belong to different shards are written
+    concurrently, but not atomically. The shards have no common order, so
+    there is no notification log across them. Scans merge the records of
+    the shards by sequence ID and position, so shards whose records are
+    in that order are scanned as if they were one table.
+    """
+
+    def __init__(self, strategies):
+        assert strategies, strategies
+        for strategy in strategies:
+            assert isinstance(strategy, AbstractActiveRecordStrategy), strategy
+        super(ShardedActiveRecordStrategy, self).__init__(
+            active_record_class=strategies[0].active_record_class,
+            sequenced_item_class=strategies[0].sequenced_item_class,
+        )
+        self.strategies = list(strategies)
+
+    def shard_index(self, sequence_id):
+        """
+        Returns the index of the shard that holds given sequence.
+
+        The hash doesn't depend on the process, so a sequence is always
+        found in the same shard for the same number of shards.
+        """
+        if isinstance(sequence_id, UUID):
+            key = sequence_id.bytes
+        else:
+            key = str(sequence_id).encode('utf8')
+        return zlib.crc32(key) % len(self.strategies)
+
+    def shard(self, sequence_id):
+        return self.strategies[self.shard_index(sequence_id)]
+
+    async def append(self, sequenced_item_or_items):
+        if not isinstance(sequenced_item_or_items, list):
+            await self.shard(sequenced_item_or_items[0]).append(sequenced_item_or_items)
+            return
+
+        items_by_shard = {}
+        for item in sequenced_item_or_items:
+            items_by_shard.setdefault(self.shard_index(item[0]), []).append(item)
+        await asyncio.gather(*[self.strategies[i].append(items) for i, items in items_by_shard.items()])
+
+    async def get_item(self, sequence_id, eq):
+        return await self.shard(sequence_id).get_item(sequence_id, eq)
+
+    async def get_items(self, sequence_id, gt=None, gte=None, lt=None, lte=None, limit=None,
+                        query_ascending=True, results_ascending=True):
+        return await self.shard(sequence_id).get_items(sequence_id, gt=gt, gte=gte, lt=lt, lte=lte, limit=limit,
+                                                       query_ascending=query_ascending,
+                                                       results_ascending=results_ascending)
+
+    async def get_stream_head(self, sequence_id):
+        return await self.shard(sequence_id).get_stream_head(sequence_id)
+
+    async def get_items_batch(self, sequence_ids, gt=None, limit=None, is_ascending=True):
+        gt = gt or {}
+        sequence_ids_by_shard = {}
+        for sequence_id in sequence_ids:
+            sequence_ids_by_shard.setdefault(self.shard_index(sequence_id), []).append(sequence_id)
+
+        results = await asyncio.gather(*[
+            self.strategies[i].get_items_batch(ids, gt={s: gt[s] for s in ids if s in gt}, limit=limit,
+                                               is_ascending=is_ascending)
+            for i, ids in sequence_ids_by_shard.items()
+        ])
+        items = {}
+        for result in results:
+            items.update(result)
+        return {sequence_id: items[sequence_id] for sequence_id in sequence_ids}
+
+    async def all_items(self):
+        results = await asyncio.gather(*[strategy.all_items() for strategy in self.strategies])
+        return list(heapq.merge(*results, key=self._item_key))
+
+    async def all_records(self, resume=None, limit=None, *args, **kwargs):
+        """
+        Returns records from all the shards, merged by sequence ID and position, up to limit.
+
+        The resume token is a tuple with the resume token of each shard.
+        Since the first records of the merge may all be in one shard, up
+        to limit records are read from each shard.
+        """
+        resume = resume or (None,) * len(self.strategies)
+        results = await asyncio.gather(*[
+            strategy.all_records(resume=token, limit=limit) for strategy, token in zip(self.strategies, resume)
+        ])
+        records = heapq.merge(*[[ShardRecord(i, record) for record in records] for i, records in enumerate(results)],
+                              key=lambda record: self._item_key(self.from_active_record(record)))
+        return list(islice(records, limit))
+
+    async def scan_items(self, resume=None, page_size=None):
+        """
+        Yields batches of up to page_size items from all the shards, and a resume token for each batch.
+        """
+        page_size = page_size or self.scan_page_size
+        assert page_size >= 1, page_size
+        resume = list(resume or (None,) * len(self.strategies))
+        while True:
+            records = await self.all_records(resume=tuple(resume), limit=page_size)
+            if not records:
+                break
+            # Each shard carries on after the last of its records in the batch.
+            for record in records:
+                resume[record.shard] = self.strategies[record.shard].get_resume_token(record.record)
+            yield [self.from_active_record(r) for r in records], tuple(resume)
+            if len(records) < page_size:
+                break
+
+    def _item_key(self, item):
+        return getattr(item, self.field_names.sequence_id), getattr(item, self.field_names.position)
+
+    async def delete_record(self, record):
+        if isinstance(record, ShardRecord):
+            await self.strategies[record.shard].delete_record(record.record)
+        else:
+            await self.shard(record[0]).delete_record(record)
+
+    def from_active_record(self, record):
+        return self.strategies[record.shard].from_active_record(record.record)
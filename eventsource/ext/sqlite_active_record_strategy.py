@@ -0,0 +1,370 @@
+import asyncio
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from uuid import UUID
+
+from eventsource.services.activerecord import AbstractActiveRecordStrategy, TopicCache
+from eventsource.services.sequenceditem import Notification, StreamHead
+
+
+class SQLiteActiveRecordStrategy(AbstractActiveRecordStrategy):
+    """
+    Stores sequenced items in an SQLite database file.
+
+    The events table is keyed and clustered on (sequence_id, position)
+    without a rowid, so every read is a range scan of the primary key
+    and needs no separate index. The database is opened in WAL mode, so
+    readers don't block the writer. All the database work happens on one
+    dedicated I/O thread, so none of it blocks the event loop.
+
+    The head of each sequence is kept in a streams table, which is
+    updated in the same transaction as the items are inserted.
+
+    Sequence IDs that are UUIDs are stored as 16 byte blobs, and are
+    returned as UUIDs. Other sequence IDs are stored as they are.
+
+    If intern_topics is True, each topic is stored once in a topics
+    table, and the events table stores its integer ID instead. Topics and
+    their IDs are cached, so the topics table is only read the first time
+    a topic is seen. This must be decided when the events table is
+    created, since the events table is read in only one way.
+    """
+
+    # The number of sequences selected by each query of a batch read.
+    batch_chunk_size = 400
+
+    atomic_append = True
+
+    def __init__(self, database, table_name='es_int_events', intern_topics=False, *args, **kwargs):
+        super(SQLiteActiveRecordStrategy, self).__init__(*args, **kwargs)
+        self.database = database
+        self.table_name = table_name
+        self.intern_topics = intern_topics
+        self.notifications_table_name = table_name + '_notifications'
+        self.streams_table_name = table_name + '_streams'
+        self.topics_table_name = table_name + '_topics'
+        self.topics = TopicCache()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sqlite-active-record')
+        self._connection = None
+        self._executor.submit(self._connect).result()
+
+    def _connect(self):
+        self._connection = sqlite3.connect(self.database, isolation_level=None)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS {} ('
+            'sequence_id NOT NULL, '
+            'position NOT NULL, '
+            'topic {} NOT NULL, '
+            'data TEXT NOT NULL, '
+            'PRIMARY KEY (sequence_id, position)'
+            ') WITHOUT ROWID'.format(self.table_name, 'INTEGER' if self.intern_topics else 'TEXT')
+        )
+        if self.intern_topics:
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS {} ('
+                'topic_id INTEGER PRIMARY KEY, '
+                'topic TEXT NOT NULL UNIQUE'
+                ')'.format(self.topics_table_name)
+            )
+        streams_table_exists = self._connection.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (self.streams_table_name,)
+        ).fetchone()
+        if not streams_table_exists:
+            self._connection.execute(
+                'CREATE TABLE {} ('
+                'sequence_id PRIMARY KEY, '
+                'position NOT NULL, '
+                'topic TEXT NOT NULL, '
+                'updated_at REAL NOT NULL'
+                ') WITHOUT ROWID'.format(self.streams_table_name)
+            )
+            # Fill in the heads of sequences stored before there was a streams table.
+            if self.intern_topics:
+                heads_sql = ('SELECT e.sequence_id, MAX(e.position), t.topic, ? FROM {} e '
+                             'JOIN {} t ON t.topic_id = e.topic GROUP BY e.sequence_id').format(
+                    self.table_name, self.topics_table_name)
+            else:
+                heads_sql = 'SELECT sequence_id, MAX(position), topic, ? FROM {} GROUP BY sequence_id'.format(
+                    self.table_name)
+            self._connection.execute(
+                'INSERT INTO {} (sequence_id, position, topic, updated_at) {}'.format(
+                    self.streams_table_name, heads_sql),
+                (time.time(),)
+            )
+        if self.notification_log:
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS {} ('
+                'notification_id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                'sequence_id NOT NULL, '
+                'position NOT NULL'
+                ')'.format(self.notifications_table_name)
+            )
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self._executor, partial(func, *args))
+
+    def close(self):
+        """
+        Closes the database connection, and stops the I/O thread.
+        """
+        if self._connection is not None:
+            self._executor.submit(self._connection.close).result()
+            self._connection = None
+        self._executor.shutdown()
+
+    async def append(self, sequenced_item_or_items):
+        if isinstance(sequenced_item_or_items, list):
+            rows = [self.to_active_record(i) for i in sequenced_item_or_items]
+        else:
+            rows = [self.to_active_record(sequenced_item_or_items)]
+
+        try:
+            await self._run(self._append, rows)
+        except sqlite3.IntegrityError as e:
+            self.raise_sequenced_item_error(sequenced_item_or_items, e)
+
+    def _get_topic_id(self, topic):
+        topic_id = self.topics.get_id(topic)
+        if topic_id is None:
+            connection = self._connection
+            connection.execute('INSERT OR IGNORE INTO {} (topic) VALUES (?)'.format(self.topics_table_name), (topic,))
+            topic_id, = connection.execute(
+                'SELECT topic_id FROM {} WHERE topic = ?'.format(self.topics_table_name), (topic,)
+            ).fetchone()
+            self.topics.add(topic_id, topic)
+        return topic_id
+
+    def _append(self, rows):
+        connection = self._connection
+        if self.intern_topics:
+            # Topics are given IDs outside the transaction, so the
+            # cached IDs are never rolled back.
+            stored_rows = [row[:2] + (self._get_topic_id(row[2]),) + row[3:] for row in rows]
+        else:
+            stored_rows = rows
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            connection.executemany(
+                'INSERT INTO {} (sequence_id, position, topic, data) VALUES (?, ?, ?, ?)'.format(self.table_name),
+                stored_rows
+            )
+            heads = {}
+            for row in rows:
+                head = heads.get(row[0])
+                if head is None or row[1] > head[1]:
+                    heads[row[0]] = row
+            now = time.time()
+            connection.executemany(
+                'INSERT INTO {0} (sequence_id, position, topic, updated_at) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT (sequence_id) DO UPDATE SET '
+                'position = excluded.position, topic = excluded.topic, updated_at = excluded.updated_at '
+                'WHERE excluded.position > {0}.position'.format(self.streams_table_name),
+                [(row[0], row[1], row[2], now) for row in heads.values()]
+            )
+            if self.notification_log:
+                # Writers are serialised by the immediate transaction, so
+                # the notification IDs are assigned in order. IDs of deleted
+                # notifications are never assigned again.
+                connection.executemany(
+                    'INSERT INTO {} (sequence_id, position) VALUES (?, ?)'.format(self.notifications_table_name),
+                    [(row[0], row[1]) for row in rows]
+                )
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+
+    def _select(self, sql, params=()):
+        return [self.from_active_record(row) for row in self._load_topics(self._connection.execute(sql, params))]
+
+    def _load_topics(self, rows, topic_index=2):
+        """
+        Caches the topics of given rows that aren't cached yet, and returns the rows.
+        """
+        if not self.intern_topics:
+            return rows
+        rows = rows.fetchall()
+        missing_ids = self.topics.missing_ids({row[topic_index] for row in rows})
+        if missing_ids:
+            sql = 'SELECT topic_id, topic FROM {} WHERE topic_id IN ({})'.format(
+                self.topics_table_name, ', '.join('?' * len(missing_ids)))
+            for topic_id, topic in self._connection.execute(sql, list(missing_ids)):
+                self.topics.add(topic_id, topic)
+        return rows
+
+    async def get_item(self, sequence_id, eq):
+        items = await self._run(
+            self._select,
+            'SELECT sequence_id, position, topic, data FROM {} '
+            'WHERE sequence_id = ? AND position = ?'.format(self.table_name),
+            (self.to_sequence_key(sequence_id), eq)
+        )
+        if not items:
+            self.raise_index_error(eq)
+        return items[0]
+
+    async def get_stream_head(self, sequence_id):
+        rows = await self._run(lambda: self._connection.execute(
+            'SELECT position, topic, updated_at FROM {} WHERE sequence_id = ?'.format(self.streams_table_name),
+            (self.to_sequence_key(sequence_id),)
+        ).fetchall())
+        if rows:
+            return StreamHead(sequence_id, *rows[0])
+
+    async def get_items(self, sequence_id, gt=None, gte=None, lt=None, lte=None, limit=None,
+                        query_ascending=True, results_ascending=True):
+        assert limit is None or limit >= 1, limit
+        sql = 'SELECT sequence_id, position, topic, data FROM {} WHERE sequence_id = ?'.format(self.table_name)
+        params = [self.to_sequence_key(sequence_id)]
+        for operator, value in (('>', gt), ('>=', gte), ('<', lt), ('<=', lte)):
+            if value is not None:
+                sql += ' AND position {} ?'.format(operator)
+                params.append(value)
+        sql += ' ORDER BY position {}'.format('ASC' if query_ascending else 'DESC')
+        if limit is not None:
+            sql += ' LIMIT ?'
+            params.append(limit)
+
+        items = await self._run(self._select, sql, params)
+        if results_ascending != query_ascending:
+            items.reverse()
+        return items
+
+    async def get_items_batch(self, sequence_ids, gt=None, limit=None, is_ascending=True):
+        assert limit is None or limit >= 1, limit
+        gt = gt or {}
+        order = 'ASC' if is_ascending else 'DESC'
+        items = {sequence_id: [] for sequence_id in sequence_ids}
+        keys = {self.to_sequence_key(sequence_id): sequence_id for sequence_id in items}
+        sequence_ids = list(items)
+        for i in range(0, len(sequence_ids), self.batch_chunk_size):
+            chunk = sequence_ids[i:i + self.batch_chunk_size]
+            conditions, params = [], []
+            whole_sequence_ids = [s for s in chunk if gt.get(s) is None]
+            if whole_sequence_ids:
+                conditions.append('sequence_id IN ({})'.format(', '.join('?' * len(whole_sequence_ids))))
+                params.extend(self.to_sequence_key(s) for s in whole_sequence_ids)
+            for sequence_id in chunk:
+                if gt.get(sequence_id) is not None:
+                    conditions.append('(sequence_id = ? AND position > ?)')
+                    params.extend((self.to_sequence_key(sequence_id), gt[sequence_id]))
+
+            sql = 'SELECT sequence_id, position, topic, data FROM {} WHERE {}'.format(
+                self.table_name, ' OR '.join(conditions))
+            if limit is not None:
+                # Ranks the items within each sequence, so the limit applies to each sequence.
+                sql = 'SELECT sequence_id, position, topic, data FROM (' \
+                      'SELECT *, ROW_NUMBER() OVER (PARTITION BY sequence_id ORDER BY position {}) AS rank ' \
+                      'FROM ({})) WHERE rank <= ?'.format(order, sql)
+                params.append(limit)
+            sql += ' ORDER BY sequence_id, position {}'.format(order)
+            for item in await self._run(self._select, sql, params):
+                items[keys[self.to_sequence_key(item.sequence_id)]].append(item)
+        return items
+
+    async def all_items(self):
+        return await self._run(
+            self._select,
+            'SELECT sequence_id, position, topic, data FROM {} ORDER BY sequence_id, position'.format(self.table_name)
+        )
+
+    async def all_records(self, resume=None, limit=None, *args, **kwargs):
+        sql = 'SELECT sequence_id, position, topic, data FROM {}'.format(self.table_name)
+        params = []
+        if resume is not None:
+            sequence_id, position = resume
+            sql += ' WHERE (sequence_id, position) > (?, ?)'
+            params.extend((self.to_sequence_key(sequence_id), position))
+        sql += ' ORDER BY sequence_id, position'
+        if limit is not None:
+            sql += ' LIMIT ?'
+            params.append(limit)
+        return await self._run(self._select, sql, params)
+
+    async def read_notifications(self, start, limit=None):
+        if not self.notification_log:
+            self.raise_notification_log_error()
+        sql = ('SELECT n.notification_id, e.sequence_id, e.position, e.topic, e.data '
+               'FROM {} n JOIN {} e ON e.sequence_id = n.sequence_id AND e.position = n.position '
+               'WHERE n.notification_id >= ?').format(self.notifications_table_name, self.table_name)
+        params = [start]
+        if limit is not None:
+            sql += ' AND n.notification_id < ?'
+            params.append(start + limit)
+        sql += ' ORDER BY n.notification_id'
+        rows = await self._run(lambda: list(self._load_topics(self._connection.execute(sql, params), 3)))
+        return [Notification(row[0], self.from_active_record(row[1:])) for row in rows]
+
+    async def delete_record(self, record):
+        def delete():
+            connection = self._connection
+            key = (self.to_sequence_key(record[0]), record[1])
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                connection.execute(
+                    'DELETE FROM {} WHERE sequence_id = ? AND position = ?'.format(self.table_name), key
+                )
+                if self.notification_log:
+                    connection.execute(
+                        'DELETE FROM {} WHERE sequence_id = ? AND position = ?'.format(
+                            self.notifications_table_name), key
+                    )
+                self._rewind_stream_head(*key)
+            except BaseException:
+                connection.execute('ROLLBACK')
+                raise
+            connection.execute('COMMIT')
+
+        await self._run(delete)
+
+    def _rewind_stream_head(self, sequence_key, position):
+        """
+        Moves the head of a stream back to its last item, if the head's item was deleted.
+        """
+        connection = self._connection
+        head = connection.execute(
+            'SELECT position FROM {} WHERE sequence_id = ?'.format(self.streams_table_name), (sequence_key,)
+        ).fetchone()
+        if head is None or head[0] != position:
+            return
+        if self.intern_topics:
+            last_sql = ('SELECT e.position, t.topic FROM {} e JOIN {} t ON t.topic_id = e.topic '
+                        'WHERE e.sequence_id = ? ORDER BY e.position DESC LIMIT 1').format(
+                self.table_name, self.topics_table_name)
+        else:
+            last_sql = 'SELECT position, topic FROM {} WHERE sequence_id = ? ORDER BY position DESC LIMIT 1'.format(
+                self.table_name)
+        last = connection.execute(last_sql, (sequence_key,)).fetchone()
+        if last is None:
+            connection.execute('DELETE FROM {} WHERE sequence_id = ?'.format(self.streams_table_name),
+                               (sequence_key,))
+        else:
+            connection.execute(
+                'UPDATE {} SET position = ?, topic = ?, updated_at = ? WHERE sequence_id = ?'.format(
+                    self.streams_table_name),
+                last + (time.time(), sequence_key)
+            )
+
+    def from_active_record(self, record):
+        if isinstance(record, self.sequenced_item_class):
+            return record
+        sequence_id, position, topic, data = record
+        if isinstance(sequence_id, bytes):
+            sequence_id = UUID(bytes=sequence_id)
+        if self.intern_topics:
+            topic = self.topics.get_topic(topic)
+        return self.sequenced_item_class(sequence_id, position, topic, data)
+
+    def to_active_record(self, item):
+        return (self.to_sequence_key(item[0]), item[1], item[2], item[3])
+
+    @staticmethod
+    def to_sequence_key(sequence_id):
+        if isinstance(sequence_id, UUID):
+            return sequence_id.bytes
+        return sequence_id
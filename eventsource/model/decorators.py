@@ -1,3 +1,4 @@
+from abc import get_cache_token
 from inspect import isfunction
 from random import random
 from time import sleep
@@ -87,19 +88,69 @@ def mutator(arg=None):
             return initial(**event.__dict__)
 
         entity = mutate(None, Entity.Created())
+
+    The handler of each type of event is looked up once, and kept
+    until another handler is registered. Instead of a handler, a
+    factory can be registered with register_factory(). It is called
+    once for each type of event it handles, with that type, and returns
+    the handler for that type. So a handler can decide once what it
+    does for each type of event, rather than checking for every event.
+
+    .. code::
+
+        @mutate.register_factory(Entity.Updated)
+        def _(event_class):
+            is_timestamped = issubclass(event_class, TimestampedEvent)
+
+            def handler(initial, event):
+                ...
+
+            return handler
     """
 
     domain_class = None
 
     def _mutator(func):
         wrapped = singledispatch(func)
+        handlers = {}
+        cache_token = [get_cache_token()]
+
+        def get_handler(event_class):
+            # Classes registered with ABCs change which handlers apply.
+            token = get_cache_token()
+            if token != cache_token[0]:
+                handlers.clear()
+                cache_token[0] = token
+            try:
+                return handlers[event_class]
+            except KeyError:
+                handler = wrapped.dispatch(event_class)
+                if isinstance(handler, HandlerFactory):
+                    handler = handler.make_handler(event_class)
+                handlers[event_class] = handler
+                return handler
 
         @wraps(wrapped)
         def wrapper(initial, event):
             initial = initial or domain_class
-            return wrapped.dispatch(type(event))(initial, event)
+            return get_handler(type(event))(initial, event)
+
+        def register(cls, func=None):
+            if func is None and isinstance(cls, type):
+                return lambda f: register(cls, f)
+            registered = wrapped.register(cls, func)
+            handlers.clear()
+            return registered
 
-        wrapper.register = wrapped.register
+        def register_factory(cls, make_handler=None):
+            if make_handler is None:
+                return lambda f: register_factory(cls, f)
+            register(cls, HandlerFactory(make_handler))
+            return make_handler
+
+        wrapper.register = register
+        wrapper.register_factory = register_factory
+        wrapper.dispatch = get_handler
 
         return wrapper
 
@@ -110,6 +161,18 @@ def mutator(arg=None):
         return _mutator
 
 
+class HandlerFactory(object):
+    """
+    Makes the handler of a mutator for a type of event.
+    """
+
+    def __init__(self, make_handler):
+        self.make_handler = make_handler
+
+    def __call__(self, *args, **kwargs):
+        raise ProgrammingError("Handler factories must be dispatched by a mutator")
+
+
 def event_generator(arg: type):
     def _handler(func):
         def _handler_wrapper(self, *args, **kwargs):
@@ -1,4 +1,6 @@
+import threading
 from abc import ABCMeta, abstractmethod, abstractproperty
+from contextlib import contextmanager
 from typing import TypeVar, Generic
 
 from eventsource.model.decorators import mutator
@@ -11,6 +13,29 @@ from eventsource.services.time import timestamp_from_uuid
 from six import with_metaclass
 
 
+class _ReplayState(threading.local):
+    is_trusted = False
+
+
+_replay_state = _ReplayState()
+
+
+@contextmanager
+def trusted_replay():
+    """
+    Within the context, entities don't validate the originator of each event that mutates them.
+
+    For replaying events that have already been checked as a batch,
+    such as by an event player that trusts replays.
+    """
+    was_trusted = _replay_state.is_trusted
+    _replay_state.is_trusted = True
+    try:
+        yield
+    finally:
+        _replay_state.is_trusted = was_trusted
+
+
 class DomainEntity(QualnameABC):
     class Event(EventWithOriginatorID, DomainEvent):
         """Layer supertype."""
@@ -62,7 +87,8 @@ class DomainEntity(QualnameABC):
         """
         Checks the event originated from (was published by) this entity.
         """
-        self._validate_originator_id(event)
+        if not _replay_state.is_trusted:
+            self._validate_originator_id(event)
 
     def _validate_originator_id(self, event):
         """
@@ -155,8 +181,9 @@ class VersionedEntity(DomainEntity):
             self._version += 1
 
     def _validate_originator(self, event):
-        super(VersionedEntity, self)._validate_originator(event)
-        self._validate_originator_version(event)
+        if not _replay_state.is_trusted:
+            super(VersionedEntity, self)._validate_originator(event)
+            self._validate_originator_version(event)
 
     def _validate_originator_version(self, event):
         """
@@ -250,43 +277,63 @@ def mutate_entity(initial, event):
     raise NotImplementedError("Event type not supported: {}".format(type(event)))
 
 
-@mutate_entity.register(DomainEntity.Created)
-def _(cls, event):
-    assert isinstance(event, Created), event
-    if not isinstance(cls, type):
-        msg = ("Mutator for Created event requires object type: {}".format(type(cls)))
-        raise MutatorRequiresTypeNotInstance(msg)
-    try:
-        self = cls(**event.__dict__)
-    except TypeError as e:
-        raise TypeError("Class {} {}. Given {} from event type {}"
-                        "".format(cls, e, event.__dict__, type(event)))
-    if isinstance(event, VersionedEntity.Created):
-        self._increment_version()
-    return self
-
-
-@mutate_entity.register(DomainEntity.AttributeChanged)
-def _(self, event):
-    self._validate_originator(event)
-    setattr(self, event.name, event.value)
-    if isinstance(event, TimestampedEntity.AttributeChanged):
-        self._last_modified_on = event.timestamp
-    if isinstance(event, VersionedEntity.AttributeChanged):
-        self._increment_version()
-    return self
-
-
-@mutate_entity.register(DomainEntity.Discarded)
-def _(self, event):
-    assert isinstance(self, DomainEntity), self
-    self._validate_originator(event)
-    self._is_discarded = True
-    if isinstance(event, TimestampedEntity.Discarded):
-        self._last_modified_on = event.timestamp
-    if isinstance(event, VersionedEntity.Discarded):
-        self._increment_version()
-    return None
+# The handlers of entity events are made for each type of event, so
+# whether an event is versioned or timestamped is checked once per type.
+
+@mutate_entity.register_factory(DomainEntity.Created)
+def _(event_class):
+    assert issubclass(event_class, Created), event_class
+    is_versioned = issubclass(event_class, VersionedEntity.Created)
+
+    def mutate_created(cls, event):
+        if not isinstance(cls, type):
+            msg = ("Mutator for Created event requires object type: {}".format(type(cls)))
+            raise MutatorRequiresTypeNotInstance(msg)
+        try:
+            self = cls(**event.__dict__)
+        except TypeError as e:
+            raise TypeError("Class {} {}. Given {} from event type {}"
+                            "".format(cls, e, event.__dict__, type(event)))
+        if is_versioned:
+            self._increment_version()
+        return self
+
+    return mutate_created
+
+
+@mutate_entity.register_factory(DomainEntity.AttributeChanged)
+def _(event_class):
+    is_timestamped = issubclass(event_class, TimestampedEntity.AttributeChanged)
+    is_versioned = issubclass(event_class, VersionedEntity.AttributeChanged)
+
+    def mutate_attribute_changed(self, event):
+        self._validate_originator(event)
+        setattr(self, event.name, event.value)
+        if is_timestamped:
+            self._last_modified_on = event.timestamp
+        if is_versioned:
+            self._increment_version()
+        return self
+
+    return mutate_attribute_changed
+
+
+@mutate_entity.register_factory(DomainEntity.Discarded)
+def _(event_class):
+    is_timestamped = issubclass(event_class, TimestampedEntity.Discarded)
+    is_versioned = issubclass(event_class, VersionedEntity.Discarded)
+
+    def mutate_discarded(self, event):
+        assert isinstance(self, DomainEntity), self
+        self._validate_originator(event)
+        self._is_discarded = True
+        if is_timestamped:
+            self._last_modified_on = event.timestamp
+        if is_versioned:
+            self._increment_version()
+        return None
+
+    return mutate_discarded
 
 
 T = TypeVar('T')
@@ -302,6 +349,12 @@ class AbstractEntityRepository(Generic[T]):
         Returns entity for given ID.
         """
 
+    async def get_entities(self, entity_ids):
+        """
+        Returns entities for given IDs, keyed by ID.
+        """
+        return {entity_id: await self.get_entity(entity_id) for entity_id in entity_ids}
+
     @abstractmethod
     async def contains(self, entity_id) -> bool:
         """
@@ -1,9 +1,13 @@
 import importlib
 import itertools
+import os
+import threading
 import time
 from abc import ABCMeta
+from array import array
 from collections import OrderedDict
-from uuid import uuid1
+from functools import lru_cache
+from uuid import UUID
 
 import six
 from six import with_metaclass
@@ -36,8 +40,70 @@ class QualnameABCMeta(ABCMeta):
                 return "%s.%s" % (c.__qualname__, cls.__name__)
 
 
+if hasattr(time, 'time_ns'):
+    time_ns = time.time_ns
+else:
+    def time_ns():
+        return int(time.time() * 1e9)
+
+
+class TimeOrderedIDGenerator(object):
+    """
+    Generates time-ordered UUIDs, with the layout of UUIDv7.
+
+    The first 48 bits are the Unix time in milliseconds, and the 12 bits
+    after the version are the fraction of the millisecond, so an ID
+    records its time to about a quarter of a microsecond. Each ID has a
+    later time than the one before it in the process, even when the clock
+    hasn't moved on or has gone back, so IDs are strictly increasing, and
+    are inserted at the end of indexes. The last 62 bits are random, from
+    os.urandom, which is read for random_batch_size IDs at a time.
+    """
+
+    random_batch_size = 512
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._last_tick = 0
+        self._random_bits = array('Q')
+        if hasattr(os, 'register_at_fork'):
+            # Child processes mustn't use the same random bits.
+            os.register_at_fork(after_in_child=self._discard_random_bits)
+
+    def _discard_random_bits(self):
+        self._random_bits = array('Q')
+
+    def __call__(self):
+        return UUID(int=self.next_int())
+
+    def next_int(self):
+        """
+        Returns the integer value of the next ID.
+        """
+        ms, ns = divmod(time_ns(), 1000000)
+        tick = (ms << 12) | (ns * 4096 // 1000000)
+        with self._lock:
+            if tick <= self._last_tick:
+                tick = self._last_tick + 1
+            self._last_tick = tick
+            try:
+                bits = self._random_bits.pop()
+            except IndexError:
+                self._random_bits = array('Q', os.urandom(8 * self.random_batch_size))
+                bits = self._random_bits.pop()
+        return (tick >> 12) << 80 | 0x7 << 76 | (tick & 0xfff) << 64 | 0x2 << 62 | bits >> 2
+
+
+# The generator of time-ordered IDs in this process.
+time_ordered_ids = TimeOrderedIDGenerator()
+
+
+def create_time_ordered_id():
+    return UUID(int=time_ordered_ids.next_int())
+
+
 def create_timesequenced_event_id():
-    return uuid1().hex
+    return '%032x' % time_ordered_ids.next_int()
 
 
 class QualnameABC(with_metaclass(QualnameABCMeta)):
@@ -135,12 +201,15 @@ class EventWithOriginatorVersion(DomainEvent):
 
 class EventWithTimeuuid(DomainEvent):
     """
-    For events that have an UUIDv1 event ID.
+    For events that have a time-ordered event ID.
+
+    Unless given, the ID is a UUID made by the time-ordered ID generator.
+    Time-based UUIDs of version 1 can also be given.
     """
 
     def __init__(self, event_id=None, **kwargs):
         super(EventWithTimeuuid, self).__init__(**kwargs)
-        self.__dict__['event_id'] = event_id or uuid1()
+        self.__dict__['event_id'] = event_id or create_time_ordered_id()
 
     @property
     def event_id(self):
@@ -245,6 +314,72 @@ def topic_from_domain_class(domain_class):
     return domain_class.__module__ + '#' + getattr(domain_class, '__qualname__', domain_class.__name__)
 
 
+class TopicRegistry(object):
+    """Resolves topics to domain classes.
+
+    Classes registered with the registry are resolved without importing
+    anything. Other topics are resolved by importing their module, and
+    the most recently used cache_size of them are cached. If strict is
+    True, only registered classes are resolved, so reading a topic never
+    imports a module.
+
+    Aliases let topics that were stored before a class was moved or
+    renamed resolve to the class.
+    """
+
+    def __init__(self, cache_size=1024, strict=False):
+        self.strict = strict
+        self._classes = {}
+        self._aliases = {}
+        self._import_cached = lru_cache(maxsize=cache_size)(import_domain_topic)
+
+    def register(self, domain_class, aliases=()):
+        """Registers a domain class, and topics that are aliases of its topic.
+        """
+        topic = topic_from_domain_class(domain_class)
+        self._classes[topic] = domain_class
+        for alias in aliases:
+            self.register_alias(alias, topic)
+        return domain_class
+
+    def register_alias(self, alias, topic):
+        """Makes alias resolve to the class of given topic.
+        """
+        self._aliases[alias] = topic
+        self._import_cached.cache_clear()
+
+    def resolve(self, topic):
+        """Return domain class described by given topic.
+
+        Raises:
+            TopicResolutionError: If there is no such domain class.
+        """
+        try:
+            return self._classes[topic]
+        except KeyError:
+            pass
+        topic = self._aliases.get(topic, topic)
+        try:
+            return self._classes[topic]
+        except KeyError:
+            pass
+        if self.strict:
+            raise TopicResolutionError("{}: not registered".format(topic))
+        return self._import_cached(topic)
+
+    def clear_cache(self):
+        self._import_cached.cache_clear()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_import_cached'] = self._import_cached.cache_info().maxsize
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._import_cached = lru_cache(maxsize=state['_import_cached'])(import_domain_topic)
+
+
 def resolve_domain_topic(topic):
     """Return domain class described by given topic.
 
@@ -254,6 +389,15 @@ def resolve_domain_topic(topic):
     Returns:
         A domain class.
 
+    Raises:
+        TopicResolutionError: If there is no such domain class.
+    """
+    return topic_registry.resolve(topic)
+
+
+def import_domain_topic(topic):
+    """Return domain class described by given topic, importing its module.
+
     Raises:
         TopicResolutionError: If there is no such domain class.
     """
@@ -289,7 +433,201 @@ def resolve_attr(obj, path):
     return resolve_attr(head_obj, tail)
 
 
+# The registry that resolves topics, unless another is given.
+topic_registry = TopicRegistry()
+
+
 def reconstruct_object(obj_class, obj_state):
     obj = object.__new__(obj_class)
-    obj.__dict__.update(obj_state)
+    if obj_class.__dictoffset__:
+        obj.__dict__.update(obj_state)
+    else:
+        set_object_state(obj, obj_state)
+    return obj
+
+
+def set_object_state(obj, obj_state):
+    """
+    Updates the state of an object without calling its methods, whether it keeps its state in a dict or in slots.
+    """
+    if type(obj).__dictoffset__:
+        object.__getattribute__(obj, '__dict__').update(obj_state)
+    else:
+        for name, value in obj_state.items():
+            object.__setattr__(obj, name, value)
+
+
+# The key of the lazy object state function, while the state is pending.
+LAZY_STATE_KEY = '__lazy_state__'
+
+_lazy_classes = {}
+_lazy_class_bases = {}
+
+
+def reconstruct_lazy_object(obj_class, get_state, obj_state=None):
+    """
+    Returns an object of given class, whose state is completed by get_state when the object is first used.
+
+    Args:
+        obj_class: The class of the object.
+        get_state: A function returning the rest of the state of the object.
+        obj_state: The part of the state of the object that is already known.
+    """
+    obj = object.__new__(lazy_class(obj_class))
+    if obj_state:
+        set_object_state(obj, obj_state)
+    object.__setattr__(obj, LAZY_STATE_KEY, get_state)
+    return obj
+
+
+def lazy_class(obj_class):
+    """
+    Returns a subclass of given class, whose instances complete their state when first used.
+
+    On first use, the state is completed and the object's class is
+    changed back to given class, so afterwards the object costs no more
+    to use than any other. Instances are instances of given class, and
+    their __class__ is given class, so checking their type doesn't
+    count as using them.
+    """
+    try:
+        return _lazy_classes[obj_class]
+    except KeyError:
+        cls = type(obj_class)(obj_class.__name__, (obj_class,), {
+            '__slots__': (),
+            '__module__': obj_class.__module__,
+            '__qualname__': getattr(obj_class, '__qualname__', obj_class.__name__),
+            '__getattribute__': _lazy_getattribute,
+            '__eq__': lambda self, other: _complete_lazy_object(self) == other,
+            '__ne__': lambda self, other: _complete_lazy_object(self) != other,
+            '__hash__': lambda self: hash(_complete_lazy_object(self)),
+            '__repr__': lambda self: repr(_complete_lazy_object(self)),
+        })
+        _lazy_classes[obj_class] = cls
+        _lazy_class_bases[cls] = obj_class
+        return cls
+
+
+def _lazy_getattribute(self, name):
+    # The class and the part of the state that is already known are
+    # used without completing the state, so checking the type of a lazy
+    # object, or its ID, doesn't pay for decoding the rest.
+    obj_class = _lazy_class_bases[type(self)]
+    if name == '__class__':
+        return obj_class
+    if isinstance(obj_class, CompactEventMeta):
+        if name in obj_class.__fields__:
+            try:
+                return object.__getattribute__(self, name)
+            except AttributeError:
+                pass
+    else:
+        obj_dict = object.__getattribute__(self, '__dict__')
+        if name in obj_dict:
+            return obj_dict[name]
+    return getattr(_complete_lazy_object(self), name)
+
+
+def _complete_lazy_object(obj):
+    obj_class = _lazy_class_bases.get(type(obj))
+    if obj_class is not None:
+        get_state = object.__getattribute__(obj, LAZY_STATE_KEY)
+        set_object_state(obj, get_state())
+        object.__delattr__(obj, LAZY_STATE_KEY)
+        object.__setattr__(obj, '__class__', obj_class)
     return obj
+
+
+class CompactEventMeta(QualnameABCMeta):
+    """
+    Derives the slots of compact domain event classes from the fields declared by their annotations.
+
+    A field declared with a value has that value by default, and a
+    subclass that gives an inherited field a value overrides its default.
+    """
+
+    def __new__(mcs, name, bases, namespace, **kwargs):
+        fields = []
+        defaults = {}
+        for base in reversed(bases):
+            fields += [f for f in getattr(base, '__fields__', ()) if f not in fields]
+            defaults.update(getattr(base, '__field_defaults__', {}))
+        new_fields = [f for f in namespace.get('__annotations__', {}) if f not in fields]
+        for field in fields + new_fields:
+            # Slots can't have class attributes of the same name.
+            if field in namespace:
+                defaults[field] = namespace.pop(field)
+        namespace['__slots__'] = tuple(namespace.get('__slots__', ())) + tuple(new_fields)
+        namespace['__fields__'] = tuple(fields + new_fields)
+        namespace['__field_defaults__'] = defaults
+        return super(CompactEventMeta, mcs).__new__(mcs, name, bases, namespace, **kwargs)
+
+
+_missing = object()
+
+
+class CompactDomainEvent(with_metaclass(CompactEventMeta)):
+    """
+    Base class for compact domain events.
+
+    The attributes of compact domain events are the fields declared by
+    the annotations of their classes, and are kept in slots rather than
+    a dict, so each event takes much less memory. Like other domain
+    events, they are read-only, and compared and hashed by type and
+    attribute values, but their hash is computed once. Their __dict__ is
+    a new dict of their attribute values, so they are serialized and
+    reconstructed like other domain events.
+    """
+    __slots__ = ('_hash', LAZY_STATE_KEY)
+    __always_encrypt__ = False
+
+    def __init__(self, **kwargs):
+        for name in self.__fields__:
+            value = kwargs.pop(name, self.__field_defaults__.get(name, _missing))
+            if value is _missing:
+                raise TypeError("{} requires a value for {}".format(type(self).__qualname__, name))
+            object.__setattr__(self, name, value)
+        if kwargs:
+            raise TypeError("{} has no fields {}".format(type(self).__qualname__, ', '.join(sorted(kwargs))))
+
+    @property
+    def __dict__(self):
+        values = {}
+        for name in self.__fields__:
+            value = getattr(self, name, _missing)
+            if value is not _missing:
+                values[name] = value
+        return values
+
+    def _field_values(self):
+        return tuple(getattr(self, name, _missing) for name in self.__fields__)
+
+    def __setattr__(self, key, value):
+        raise AttributeError("DomainEvent attributes are read-only")
+
+    def __delattr__(self, key):
+        raise AttributeError("DomainEvent attributes are read-only")
+
+    def __eq__(self, other):
+        return type(self) == type(other) and self._field_values() == other._field_values()
+
+    def __ne__(self, other):
+        return not (self == other)
+
+    def __hash__(self):
+        try:
+            return self._hash
+        except AttributeError:
+            value = hash((type(self),) + self._field_values())
+            object.__setattr__(self, '_hash', value)
+            return value
+
+    def __repr__(self):
+        return self.__class__.__qualname__ + "(" + ', '.join(
+            "{0}={1!r}".format(*item) for item in sorted(self.__dict__.items())) + ')'
+
+    def __reduce__(self):
+        return reconstruct_object, (type(self), self.__dict__)
+
+
+DomainEvent.register(CompactDomainEvent)
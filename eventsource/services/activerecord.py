@@ -1,17 +1,29 @@
+import sys
 from abc import ABCMeta, abstractmethod
-from eventsource.services.sequenceditem import SequencedItemFieldNames, SequencedItem
-from eventsource.exceptions import SequencedItemError
+from eventsource.services.sequenceditem import SequencedItemFieldNames, SequencedItem, StreamHead
+from eventsource.exceptions import ProgrammingError, SequencedItemError
 
 import six
 
 
 class AbstractActiveRecordStrategy(six.with_metaclass(ABCMeta)):
+    # The number of records read by each query of a scan.
+    scan_page_size = 1000
+
+    # True if an append of many items that fails leaves none of them written.
+    atomic_append = False
+
     def __init__(self, active_record_class: type,
-                 sequenced_item_class=SequencedItem):
+                 sequenced_item_class=SequencedItem,
+                 notification_log=False):
         self.active_record_class = active_record_class
         self.sequenced_item_class = sequenced_item_class
         self.field_names = SequencedItemFieldNames(self.sequenced_item_class)
 
+        # If True, every appended item is also given the next ID of
+        # a gap-free notification log that spans all the sequences.
+        self.notification_log = notification_log
+
     @abstractmethod
     async def append(self, sequenced_item_or_items):
         """
@@ -31,6 +43,73 @@ class AbstractActiveRecordStrategy(six.with_metaclass(ABCMeta)):
         Reads sequenced items from the datastore.
         """
 
+    async def get_stream_head(self, sequence_id):
+        """
+        Returns the position and topic of the last item of a sequence, or None if there are no items.
+
+        Strategies that keep this for each sequence as items are appended
+        should override this, since by default the last item is read.
+        """
+        items = await self.get_items(sequence_id, limit=1, query_ascending=False, results_ascending=False)
+        if items:
+            item = items[0]
+            return StreamHead(sequence_id, getattr(item, self.field_names.position),
+                              getattr(item, self.field_names.topic), None)
+
+    async def get_items_batch(self, sequence_ids, gt=None, limit=None, is_ascending=True):
+        """
+        Reads the sequenced items of many sequences.
+
+        Returns a dict of item lists keyed by sequence ID. Optionally, gt
+        maps sequence IDs to the position after which items are wanted,
+        and limit is the number of items wanted from each sequence, taken
+        from its end if is_ascending is False. Strategies that can select
+        many sequences with one query should override this, since by
+        default each sequence is read in turn.
+        """
+        gt = gt or {}
+        items = {}
+        for sequence_id in sequence_ids:
+            items[sequence_id] = await self.get_items(sequence_id, gt=gt.get(sequence_id), limit=limit,
+                                                      query_ascending=is_ascending,
+                                                      results_ascending=is_ascending)
+        return items
+
+    async def iter_items(self, sequence_id, gt=None, gte=None, lt=None, lte=None, limit=None,
+                         page_size=None, is_ascending=True):
+        """
+        Yields pages of sequenced items from the datastore.
+
+        Pages are keyed on position: each query starts after the last
+        position of the previous page, so no page needs an offset and
+        every page costs the same however deep into the sequence it is.
+        Without a page size, all the items are yielded as one page.
+        """
+        if page_size is None:
+            items = await self.get_items(sequence_id, gt=gt, gte=gte, lt=lt, lte=lte, limit=limit,
+                                         query_ascending=is_ascending, results_ascending=is_ascending)
+            if items:
+                yield items
+            return
+
+        assert page_size >= 1, page_size
+        while limit is None or limit > 0:
+            size = page_size if limit is None else min(page_size, limit)
+            items = await self.get_items(sequence_id, gt=gt, gte=gte, lt=lt, lte=lte, limit=size,
+                                         query_ascending=is_ascending, results_ascending=is_ascending)
+            if items:
+                yield items
+            if len(items) < size:
+                break
+
+            last_position = getattr(items[-1], self.field_names.position)
+            if is_ascending:
+                gt, gte = last_position, None
+            else:
+                lt, lte = last_position, None
+            if limit is not None:
+                limit -= len(items)
+
     @abstractmethod
     async def all_items(self):
         """
@@ -38,10 +117,40 @@ class AbstractActiveRecordStrategy(six.with_metaclass(ABCMeta)):
         """
 
     @abstractmethod
-    async def all_records(self, resume=None, *arg, **kwargs):
+    async def all_records(self, resume=None, limit=None, *arg, **kwargs):
         """
-        Returns all records in the table (possibly in chronological order, depending on database).
+        Returns records in the table, ordered by sequence ID and position.
+
+        If a resume token is given, only records after it are returned.
+        """
+
+    async def scan_items(self, resume=None, page_size=None):
         """
+        Yields all stored items in batches, each with the resume token of its last item.
+
+        Passing a token back as resume continues the scan after that
+        batch, so a process that stops part way through can carry on
+        from the last token it saw rather than starting again.
+        """
+        page_size = page_size or self.scan_page_size
+        assert page_size >= 1, page_size
+        while True:
+            records = await self.all_records(resume=resume, limit=page_size)
+            if not records:
+                break
+            resume = self.get_resume_token(records[-1])
+            yield [self.from_active_record(r) for r in records], resume
+            if len(records) < page_size:
+                break
+
+    async def read_notifications(self, start, limit=None):
+        """
+        Returns notifications with IDs from start, in the order the items were appended.
+
+        Notification IDs start at 1 and have no gaps, so a reader can
+        continue from the ID after the last notification it processed.
+        """
+        self.raise_notification_log_error()
 
     @abstractmethod
     async def delete_record(self, record):
@@ -52,6 +161,16 @@ class AbstractActiveRecordStrategy(six.with_metaclass(ABCMeta)):
     def get_field_kwargs(self, item):
         return {name: getattr(item, name) for name in self.field_names}
 
+    def from_active_record(self, record):
+        kwargs = self.get_field_kwargs(record)
+        return self.sequenced_item_class(**kwargs)
+
+    def get_resume_token(self, record):
+        """
+        Returns the token from which a scan continues after given record.
+        """
+        return getattr(record, self.field_names.sequence_id), getattr(record, self.field_names.position)
+
     def raise_sequenced_item_error(self, sequenced_item, e):
         sequenced_item = sequenced_item[0] if isinstance(sequenced_item, list) else sequenced_item
         raise SequencedItemError("Item at position '{}' already exists in sequence '{}': {}"
@@ -59,3 +178,32 @@ class AbstractActiveRecordStrategy(six.with_metaclass(ABCMeta)):
 
     def raise_index_error(self, eq):
         raise IndexError("Sequence index out of range: {}".format(eq))
+
+    def raise_notification_log_error(self):
+        raise ProgrammingError("Notification log is not enabled for {}".format(type(self).__name__))
+
+
+class TopicCache(object):
+    """
+    Maps topics to the integer IDs an active record strategy stores instead of them, and back.
+
+    Topics are interned, so the items of a topic all refer to one string.
+    """
+
+    def __init__(self):
+        self._ids = {}
+        self._topics = {}
+
+    def add(self, topic_id, topic):
+        topic = sys.intern(topic)
+        self._ids[topic] = topic_id
+        self._topics[topic_id] = topic
+
+    def get_id(self, topic):
+        return self._ids.get(topic)
+
+    def get_topic(self, topic_id):
+        return self._topics[topic_id]
+
+    def missing_ids(self, topic_ids):
+        return {topic_id for topic_id in topic_ids if topic_id not in self._topics}
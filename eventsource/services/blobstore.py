@@ -0,0 +1,72 @@
+import hashlib
+import os
+import tempfile
+from abc import ABCMeta, abstractmethod
+
+import six
+
+from eventsource.exceptions import BlobNotFoundError
+
+
+class AbstractBlobStore(six.with_metaclass(ABCMeta)):
+    """
+    Stores blobs of bytes, keyed by the hash of their content.
+    """
+
+    @abstractmethod
+    def put(self, data):
+        """
+        Stores given bytes, and returns their key.
+        """
+
+    @abstractmethod
+    def get(self, key):
+        """
+        Returns the bytes stored with given key.
+        """
+
+    @staticmethod
+    def content_key(data):
+        return hashlib.sha256(data).hexdigest()
+
+    def raise_blob_not_found_error(self, key):
+        raise BlobNotFoundError(key)
+
+
+class FileSystemBlobStore(AbstractBlobStore):
+    """
+    Stores each blob in a file named by its key, below given directory.
+
+    Blobs with the same content have the same key, so they are stored
+    once. Files are written to a temporary name and then renamed, so a
+    blob is either complete or absent.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key[2:])
+
+    def put(self, data):
+        key = self.content_key(data)
+        path = self.path(key)
+        if not os.path.exists(path):
+            directory = os.path.dirname(path)
+            os.makedirs(directory, exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=directory)
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(data)
+                os.replace(temp_path, path)
+            except BaseException:
+                os.unlink(temp_path)
+                raise
+        return key
+
+    def get(self, key):
+        try:
+            with open(self.path(key), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            self.raise_blob_not_found_error(key)
@@ -0,0 +1,157 @@
+import base64
+import datetime
+from abc import ABCMeta, abstractmethod
+from uuid import UUID
+
+import six
+
+from eventsource.exceptions import CodecError
+from eventsource.model.events import reconstruct_object, topic_from_domain_class, \
+    topic_registry as default_topic_registry
+from eventsource.services.transcoding import ObjectJSONDecoder, ObjectJSONEncoder, make_json_encode
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Data encoded by a binary codec, and not compressed, is stored as
+# this character, the name of the codec, a colon, and base64 text.
+BINARY_PREFIX = '%'
+
+JSON = 'json'
+MSGPACK = 'msgpack'
+
+
+class AbstractCodec(six.with_metaclass(ABCMeta)):
+    """
+    Encodes the state of domain events as bytes.
+    """
+
+    # The name recorded with data encoded by the codec.
+    name = None
+
+    @abstractmethod
+    def encode(self, obj):
+        """
+        Returns bytes encoding given object.
+        """
+
+    @abstractmethod
+    def decode(self, data):
+        """
+        Returns object encoded by given bytes.
+        """
+
+
+class JSONCodec(AbstractCodec):
+    name = JSON
+
+    def __init__(self, json_encoder_class=ObjectJSONEncoder, json_decoder_class=ObjectJSONDecoder,
+                 topic_registry=None):
+        self.json_encoder_class = json_encoder_class
+        self.json_decoder_class = json_decoder_class
+        self.topic_registry = topic_registry
+        self._json_encode = make_json_encode(json_encoder_class)
+        self._json_decode = json_decoder_class(topic_registry=topic_registry).decode
+
+    def encode(self, obj):
+        return self._json_encode(obj).encode('utf8')
+
+    def decode(self, data):
+        return self._json_decode(data.decode('utf8'))
+
+    def __reduce__(self):
+        return self.__class__, (self.json_encoder_class, self.json_decoder_class, self.topic_registry)
+
+
+class MsgpackCodec(AbstractCodec):
+    """
+    Encodes objects with msgpack, using extension types for UUIDs, dates, datetimes and domain objects.
+
+    Datetimes keep their UTC offset, but not the name of their time zone,
+    as with the JSON codec. The classes of domain objects are resolved
+    from their topics with given topic registry, or the default registry.
+    """
+
+    name = MSGPACK
+
+    UUID_TYPE = 1
+    DATETIME_TYPE = 2
+    DATE_TYPE = 3
+    OBJECT_TYPE = 4
+
+    def __init__(self, topic_registry=None):
+        if msgpack is None:
+            raise CodecError("The msgpack package is required for the msgpack codec")
+        self.topic_registry = topic_registry
+        self._resolve_topic = (topic_registry or default_topic_registry).resolve
+        self._packer_options = dict(default=self.to_ext, use_bin_type=True)
+        self._unpacker_options = dict(ext_hook=self.from_ext, raw=False, strict_map_key=False)
+
+    def encode(self, obj):
+        return msgpack.packb(obj, **self._packer_options)
+
+    def decode(self, data):
+        return msgpack.unpackb(data, **self._unpacker_options)
+
+    def __reduce__(self):
+        return self.__class__, (self.topic_registry,)
+
+    def to_ext(self, obj):
+        if isinstance(obj, UUID):
+            return msgpack.ExtType(self.UUID_TYPE, obj.bytes)
+        elif isinstance(obj, datetime.datetime):
+            offset = obj.utcoffset()
+            return msgpack.ExtType(self.DATETIME_TYPE, self.encode([
+                obj.year, obj.month, obj.day, obj.hour, obj.minute, obj.second, obj.microsecond,
+                None if offset is None else offset.days * 86400 + offset.seconds,
+            ]))
+        elif isinstance(obj, datetime.date):
+            return msgpack.ExtType(self.DATE_TYPE, self.encode(obj.toordinal()))
+        elif hasattr(obj, '__dict__'):
+            return msgpack.ExtType(self.OBJECT_TYPE, self.encode([topic_from_domain_class(obj.__class__),
+                                                                  obj.__dict__]))
+        raise TypeError("Can't encode {!r}".format(obj))
+
+    def from_ext(self, code, data):
+        if code == self.UUID_TYPE:
+            return UUID(bytes=data)
+        elif code == self.DATETIME_TYPE:
+            fields = self.decode(data)
+            offset = fields.pop()
+            if offset is not None:
+                fields.append(datetime.timezone(datetime.timedelta(seconds=offset)))
+            return datetime.datetime(*fields)
+        elif code == self.DATE_TYPE:
+            return datetime.date.fromordinal(self.decode(data))
+        elif code == self.OBJECT_TYPE:
+            topic, state = self.decode(data)
+            return reconstruct_object(self._resolve_topic(topic), state)
+        return msgpack.ExtType(code, data)
+
+
+# The codecs that can be named by stored data.
+codec_classes = {
+    JSON: JSONCodec,
+    MSGPACK: MsgpackCodec,
+}
+
+
+def is_binary_text(data):
+    return data.startswith(BINARY_PREFIX)
+
+
+def encode_binary_text(codec_name, data):
+    """
+    Returns text holding given bytes, encoded by the named codec.
+    """
+    return '{}{}:{}'.format(BINARY_PREFIX, codec_name, base64.b64encode(data).decode('ascii'))
+
+
+def decode_binary_text(text):
+    """
+    Returns the name of the codec and the bytes held in given text.
+    """
+    codec_name, _, data = text[len(BINARY_PREFIX):].partition(':')
+    return codec_name, base64.b64decode(data)
@@ -0,0 +1,204 @@
+import base64
+import zlib
+from collections import namedtuple
+
+from eventsource.exceptions import CompressionError
+from eventsource.services.codecs import JSON, decode_binary_text, encode_binary_text, is_binary_text
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Compressed payloads start with this character, which never starts JSON.
+COMPRESSED_PREFIX = '~'
+
+ZLIB = 'zlib'
+ZSTD = 'zstd'
+
+CompressionDictionary = namedtuple('CompressionDictionary', ['codec', 'dict_id', 'topic', 'data'])
+
+
+class PayloadCompressor(object):
+    """
+    Compresses the serialized data of sequenced items.
+
+    Uses zstd if the zstandard package is installed, otherwise zlib.
+    Compressed data is text, so it can be stored wherever the data of a
+    sequenced item is stored. It starts with a header that records the
+    codec and the dictionary, so it can be decompressed by a compressor
+    that uses another codec, as long as it has the dictionary. Data
+    encoded by a binary codec is compressed as bytes, and the header
+    also records the name of that codec.
+
+    Events of one topic repeat the same attribute names and many of the
+    same values. A dictionary trained from a sample of the stored data of
+    a topic lets even small payloads of that topic compress well. The
+    data of dictionaries must be kept, and given to each compressor that
+    reads items compressed with them.
+    """
+
+    def __init__(self, codec=None, level=None, min_size=128, dictionaries=()):
+        self.codec = codec or (ZSTD if zstandard is not None else ZLIB)
+        if self.codec == ZSTD and zstandard is None:
+            raise CompressionError("The zstandard package is required for zstd compression")
+        if self.codec not in (ZLIB, ZSTD):
+            raise CompressionError("Unsupported codec: {}".format(self.codec))
+        self.level = level
+        self.min_size = min_size
+        self._dictionaries = {}
+        self._topic_dictionaries = {}
+        self._compressors = {}
+        self._decompressors = {}
+        for dictionary in dictionaries:
+            self.add_dictionary(dictionary)
+
+    def __reduce__(self):
+        # Compressors and decompressors are made again when unpickled.
+        return self.__class__, (self.codec, self.level, self.min_size, list(self._dictionaries.values()))
+
+    def train_dictionary(self, topic, samples, size=16 * 1024):
+        """
+        Returns a dictionary for given topic, trained from a sample of stored data, and uses it to compress.
+        """
+        samples = [self.decompress_payload(s)[1] for s in samples]
+        if self.codec == ZSTD:
+            data = zstandard.train_dictionary(size, samples).as_bytes()
+            dict_id = zstandard.ZstdCompressionDict(data).dict_id()
+        else:
+            # Deflate has no dictionary trainer. The last bytes of its
+            # dictionary are the cheapest to refer to, so the samples are
+            # simply joined and cut to fit its window.
+            data = b''.join(samples)[-min(size, 32 * 1024):]
+            dict_id = zlib.adler32(data)
+        dictionary = CompressionDictionary(self.codec, dict_id, topic, data)
+        self.add_dictionary(dictionary)
+        return dictionary
+
+    def add_dictionary(self, dictionary):
+        """
+        Makes given dictionary available for decompression, and uses it to compress its topic.
+        """
+        self._dictionaries[(dictionary.codec, dictionary.dict_id)] = dictionary
+        if dictionary.codec == self.codec:
+            self._topic_dictionaries[dictionary.topic] = dictionary
+
+    def compress(self, data, topic=None, codec_name=JSON):
+        """
+        Returns compressed data, or the data uncompressed if compressing doesn't make it smaller.
+
+        Data is JSON text, or bytes encoded by the named codec, which are
+        returned uncompressed as binary text.
+        """
+        if isinstance(data, bytes):
+            uncompressed = encode_binary_text(codec_name, data)
+            payload = data
+        else:
+            uncompressed = data
+            payload = None
+        if len(uncompressed) < self.min_size:
+            return uncompressed
+        if payload is None:
+            payload = data.encode('utf8')
+        dictionary = self._topic_dictionaries.get(topic)
+        compressed = self._get_compressor(dictionary)(payload)
+        compressed = '{}{}:{}:{}{}'.format(
+            COMPRESSED_PREFIX,
+            self.codec,
+            '' if dictionary is None else dictionary.dict_id,
+            '' if codec_name == JSON else codec_name + ':',
+            base64.b64encode(compressed).decode('ascii'),
+        )
+        return compressed if len(compressed) < len(uncompressed) else uncompressed
+
+    def decompress(self, data):
+        """
+        Returns decompressed JSON text, or given data if it isn't compressed.
+        """
+        if not self.is_compressed(data):
+            return data
+        codec_name, payload = self.decompress_payload(data)
+        if codec_name != JSON:
+            raise CompressionError("Data is encoded by the {} codec, not JSON".format(codec_name))
+        return payload.decode('utf8')
+
+    def decompress_payload(self, data):
+        """
+        Returns the name of the codec that encoded given data, and the encoded bytes.
+        """
+        if not self.is_compressed(data):
+            if is_binary_text(data):
+                return decode_binary_text(data)
+            return JSON, data.encode('utf8')
+        fields = data[len(COMPRESSED_PREFIX):].split(':')
+        if len(fields) == 3:
+            codec, dict_id, compressed = fields
+            codec_name = JSON
+        else:
+            codec, dict_id, codec_name, compressed = fields
+        if dict_id:
+            try:
+                dictionary = self._dictionaries[(codec, int(dict_id))]
+            except KeyError:
+                raise CompressionError("Dictionary {} for {} isn't available".format(dict_id, codec))
+        else:
+            dictionary = None
+        decompressor = self._get_decompressor(codec, dictionary)
+        return codec_name, decompressor(base64.b64decode(compressed))
+
+    @staticmethod
+    def is_compressed(data):
+        return data.startswith(COMPRESSED_PREFIX)
+
+    def _get_compressor(self, dictionary):
+        try:
+            return self._compressors[dictionary]
+        except KeyError:
+            pass
+
+        if self.codec == ZSTD:
+            kwargs = {} if self.level is None else {'level': self.level}
+            if dictionary is not None:
+                kwargs['dict_data'] = zstandard.ZstdCompressionDict(dictionary.data)
+            compressor = zstandard.ZstdCompressor(**kwargs).compress
+        else:
+            level = zlib.Z_DEFAULT_COMPRESSION if self.level is None else self.level
+            if dictionary is None:
+                compressor = lambda data: zlib.compress(data, level)
+            else:
+                # Copies of a primed compressor don't load the dictionary again.
+                primed = zlib.compressobj(level, zdict=dictionary.data)
+
+                def compressor(data):
+                    c = primed.copy()
+                    return c.compress(data) + c.flush()
+
+        self._compressors[dictionary] = compressor
+        return compressor
+
+    def _get_decompressor(self, codec, dictionary):
+        key = (codec, dictionary)
+        try:
+            return self._decompressors[key]
+        except KeyError:
+            pass
+
+        if codec == ZSTD:
+            if zstandard is None:
+                raise CompressionError("The zstandard package is required to decompress zstd data")
+            kwargs = {}
+            if dictionary is not None:
+                kwargs['dict_data'] = zstandard.ZstdCompressionDict(dictionary.data)
+            decompressor = zstandard.ZstdDecompressor(**kwargs).decompress
+        elif codec == ZLIB:
+            if dictionary is None:
+                decompressor = zlib.decompress
+            else:
+                def decompressor(data):
+                    d = zlib.decompressobj(zdict=dictionary.data)
+                    return d.decompress(data) + d.flush()
+        else:
+            raise CompressionError("Unsupported codec: {}".format(codec))
+
+        self._decompressors[key] = decompressor
+        return decompressor
@@ -1,6 +1,8 @@
 from functools import reduce
 
-from eventsource.services.snapshotting import AbstractSnapshotStrategy, entity_from_snapshot
+from eventsource.exceptions import MismatchedOriginatorIDError, MismatchedOriginatorVersionError
+from eventsource.model.entity import trusted_replay
+from eventsource.services.snapshotting import AbstractSnapshotStrategy
 from eventsource.services.eventstore import AbstractEventStore
 
 
@@ -8,9 +10,17 @@ class EventPlayer(object):
     """
     Reconstitutes domain entities from domain events
     retrieved from the event store, optionally with snapshots.
+
+    If trusted_replay is True, the events read from the stream of an
+    entity are checked together for each batch, or page, rather than by
+    the entity as each event is applied. Each event must have the
+    entity's ID and the version after the one before it, continuing from
+    the previous page, or from the snapshot the replay starts from.
+    Events applied by commands are still validated by the entity.
     """
 
-    def __init__(self, event_store, mutator, page_size=None, is_short=False, snapshot_strategy=None):
+    def __init__(self, event_store, mutator, page_size=None, is_short=False, snapshot_strategy=None,
+                 trusted_replay=False):
         assert isinstance(event_store, AbstractEventStore), event_store
         if snapshot_strategy is not None:
             assert isinstance(snapshot_strategy, AbstractSnapshotStrategy), snapshot_strategy
@@ -19,6 +29,7 @@ class EventPlayer(object):
         self.page_size = page_size
         self.is_short = is_short
         self.snapshot_strategy = snapshot_strategy
+        self.trusted_replay = trusted_replay
 
     async def replay_entity(self, entity_id, gt=None, gte=None, lt=None, lte=None, limit=None, initial_state=None,
                       query_descending=False):
@@ -40,6 +51,25 @@ class EventPlayer(object):
         else:
             is_ascending = not query_descending
 
+        # Events replayed onto a snapshot must follow the snapshot's version.
+        last_version = gt if initial_state is not None else None
+
+        # Fold each page into the entity as it arrives, so that long
+        # streams are replayed without holding all their events at once.
+        if self.page_size is not None and is_ascending:
+            state = initial_state
+            async for domain_events in self.event_store.iter_domain_events(entity_id,
+                                                                           gt=gt,
+                                                                           gte=gte,
+                                                                           lt=lt,
+                                                                           lte=lte,
+                                                                           limit=limit,
+                                                                           page_size=self.page_size):
+                state = self.replay_stream_events(entity_id, state, domain_events, last_version)
+                if domain_events:
+                    last_version = getattr(domain_events[-1], 'originator_version', None)
+            return state
+
         # Get the domain events that are to be replayed.
         domain_events = await self.get_domain_events(entity_id,
                                                gt=gt,
@@ -55,7 +85,22 @@ class EventPlayer(object):
             domain_events = reversed(list(domain_events))
 
         # Replay the domain events, starting with the initial state.
-        return self.replay_events(initial_state, domain_events)
+        return self.replay_stream_events(entity_id, initial_state, domain_events, last_version)
+
+    async def replay_entities(self, entity_ids, gt=None, initial_states=None):
+        """
+        Reconstitutes many domain entities, reading all their events together.
+
+        Optionally, gt maps entity IDs to the version after which events
+        are replayed, and initial_states maps them to the state onto which
+        those events are replayed. Returns entities keyed by entity ID.
+        """
+        gt = gt or {}
+        initial_states = initial_states or {}
+        domain_events = await self.event_store.get_domain_events_batch(entity_ids, gt=gt)
+        return {entity_id: self.replay_stream_events(entity_id, initial_states.get(entity_id), events,
+                                                     gt.get(entity_id) if entity_id in initial_states else None)
+                for entity_id, events in domain_events.items()}
 
     def replay_events(self, initial_state, domain_events):
         """
@@ -63,6 +108,41 @@ class EventPlayer(object):
         """
         return reduce(self.mutator, domain_events, initial_state)
 
+    def replay_stream_events(self, entity_id, initial_state, domain_events, last_version=None):
+        """
+        Mutates initial state using domain events read in order from the stream of given entity.
+
+        If the player trusts replays, the events are checked as a batch,
+        and then replayed without the entity validating each of them.
+        Optionally, last_version is the version of the event before them.
+        """
+        if not self.trusted_replay:
+            return self.replay_events(initial_state, domain_events)
+        domain_events = list(domain_events)
+        self.check_stream_events(entity_id, domain_events, last_version)
+        with trusted_replay():
+            return self.replay_events(initial_state, domain_events)
+
+    @staticmethod
+    def check_stream_events(entity_id, domain_events, last_version=None):
+        """
+        Checks domain events in order of position are all from the stream of given entity, without gaps.
+        """
+        entity_id = str(entity_id)
+        for event in domain_events:
+            if str(event.originator_id) != entity_id:
+                raise MismatchedOriginatorIDError(
+                    "'{}' not equal to event originator ID '{}'".format(entity_id, event.originator_id))
+
+            # Events without versions can only be checked for their entity.
+            version = getattr(event, 'originator_version', None)
+            if version is None:
+                continue
+            if last_version is not None and version != last_version + 1:
+                raise MismatchedOriginatorVersionError(
+                    "Event at version {} doesn't follow version {}".format(version, last_version))
+            last_version = version
+
     async def get_domain_events(self, entity_id, gt=None, gte=None, lt=None, lte=None, limit=None, is_ascending=True):
         """
         Returns domain events for given entity ID.
@@ -100,7 +180,7 @@ class EventPlayer(object):
             else:
                 # Otherwise recover entity and take snapshot.
                 if last_snapshot:
-                    initial_state = entity_from_snapshot(last_snapshot)
+                    initial_state = self.snapshot_strategy.entity_from_snapshot(last_snapshot)
                     gt = last_snapshot.originator_version
                 else:
                     initial_state = None
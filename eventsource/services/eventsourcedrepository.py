@@ -1,11 +1,10 @@
 from typing import TypeVar, Generic
 
 from eventsource.model.entity import AbstractEntityRepository, mutate_entity, DomainEntity
-from eventsource.model.events import EventSession
+from eventsource.model.events import EventSession, Discarded, topic_registry as default_topic_registry
 from eventsource.services.eventstore import EventStore
-from eventsource.services.snapshotting import entity_from_snapshot
 from eventsource.services.eventplayer import EventPlayer
-from eventsource.exceptions import RepositoryKeyError
+from eventsource.exceptions import RepositoryKeyError, TopicResolutionError
 from eventsource.services.eventstore import AbstractEventStore
 
 T = TypeVar('T')
@@ -24,6 +23,11 @@ class EventSourcedRepository(AbstractEntityRepository[T], Generic[T]):
     # of queries, rather than with one potentially large query.
     __page_size__ = None
 
+    # If this value is set to True, the events of the entity are checked
+    # once for each batch read from its stream, rather than one by one
+    # as they are replayed. Events applied by commands are still checked.
+    __trusted_replay__ = False
+
     # The mutator function used by this repository. Can either
     # be set as a class attribute, or passed as a constructor arg.
     mutator = mutate_entity
@@ -46,6 +50,10 @@ class EventSourcedRepository(AbstractEntityRepository[T], Generic[T]):
         assert isinstance(event_store, AbstractEventStore), type(event_store)
         self._event_store = event_store
 
+        # Resolve topics with the registry of the event store's mapper.
+        mapper = getattr(event_store, 'sequenced_item_mapper', None)
+        self._topic_registry = getattr(mapper, 'topic_registry', None) or default_topic_registry
+
         # Instantiate an event player for this repo.
         mutator = mutator or type(self).mutator
         self.event_player = EventPlayer(
@@ -54,6 +62,7 @@ class EventSourcedRepository(AbstractEntityRepository[T], Generic[T]):
             page_size=self.__page_size__,
             is_short=self.__is_short__,
             snapshot_strategy=self._snapshot_strategy,
+            trusted_replay=self.__trusted_replay__,
         )
 
     @property
@@ -63,8 +72,20 @@ class EventSourcedRepository(AbstractEntityRepository[T], Generic[T]):
     async def contains(self, entity_id) -> bool:
         """
         Returns a boolean value according to whether entity with given ID exists.
+
+        The head of the entity's stream is checked, without replaying the
+        entity. An entity whose last event discarded it doesn't exist. If
+        the topic of the last event can't be resolved, the entity is
+        replayed instead.
         """
-        return await self.get_entity(entity_id) is not None
+        head = await self.event_store.get_stream_head(entity_id)
+        if head is None:
+            return False
+        try:
+            event_class = self._topic_registry.resolve(head.topic)
+        except TopicResolutionError:
+            return await self.get_entity(entity_id) is not None
+        return not issubclass(event_class, Discarded)
 
     async def get_entity(self, entity_id, lt=None, lte=None) -> T:
         """
@@ -73,7 +94,7 @@ class EventSourcedRepository(AbstractEntityRepository[T], Generic[T]):
 
         # Get a snapshot (None if none exist).
         if self._snapshot_strategy is not None:
-            snapshot = self._snapshot_strategy.get_snapshot(entity_id, lt=lt, lte=lte)
+            snapshot = await self._snapshot_strategy.get_snapshot(entity_id, lt=lt, lte=lte)
         else:
             snapshot = None
 
@@ -83,12 +104,26 @@ class EventSourcedRepository(AbstractEntityRepository[T], Generic[T]):
             initial_state = None
             gt = None
         else:
-            initial_state = entity_from_snapshot(snapshot)
+            initial_state = self._snapshot_strategy.entity_from_snapshot(snapshot)
             gt = snapshot.originator_version
 
         # Replay domain events.
         return await self.event_player.replay_entity(entity_id, gt=gt, lt=lt, lte=lte, initial_state=initial_state)
 
+    async def get_entities(self, entity_ids):
+        """
+        Returns entities with given IDs, keyed by ID, reading their events together.
+        """
+        if self._snapshot_strategy is not None:
+            snapshots = await self._snapshot_strategy.get_snapshots(entity_ids)
+        else:
+            snapshots = {}
+
+        initial_states = {entity_id: self._snapshot_strategy.entity_from_snapshot(s)
+                          for entity_id, s in snapshots.items()}
+        gt = {entity_id: s.originator_version for entity_id, s in snapshots.items()}
+        return await self.event_player.replay_entities(entity_ids, gt=gt, initial_states=initial_states)
+
     def take_snapshot(self, entity_id, lt=None, lte=None):
         return self.event_player.take_snapshot(entity_id, lt=lt, lte=lte)
 
@@ -1,14 +1,23 @@
 # coding=utf-8
+import asyncio
 from abc import ABCMeta, abstractmethod
 
 import six
 
+from eventsource.model.events import topic_from_domain_class
 from eventsource.services.sequenceditemmapper import AbstractSequencedItemMapper
 from eventsource.services.activerecord import AbstractActiveRecordStrategy
+from eventsource.services.sequenceditem import Notification, StreamHead
 from eventsource.exceptions import SequencedItemError, ConcurrencyError
 
 
 class AbstractEventStore(six.with_metaclass(ABCMeta)):
+    """
+    Event stores must implement the abstract methods. The other methods
+    are built on those, and should be overridden by event stores that can
+    do better.
+    """
+
     @abstractmethod
     async def append(self, domain_event_or_events):
         """
@@ -22,6 +31,29 @@ class AbstractEventStore(six.with_metaclass(ABCMeta)):
         Returns domain events for given entity ID.
         """
 
+    async def get_domain_events_batch(self, originator_ids, gt=None, limit=None, is_ascending=True):
+        """
+        Returns domain events for each of given entity IDs, keyed by entity ID.
+
+        By default, the domain events of each entity are read in turn.
+        """
+        gt = gt or {}
+        domain_events = {}
+        for originator_id in originator_ids:
+            domain_events[originator_id] = await self.get_domain_events(
+                originator_id, gt=gt.get(originator_id), limit=limit, is_ascending=is_ascending)
+        return domain_events
+
+    async def iter_domain_events(self, originator_id, gt=None, gte=None, lt=None, lte=None, limit=None,
+                                 is_ascending=True, page_size=None):
+        """
+        Yields pages of domain events for given entity ID.
+
+        By default, all the domain events are yielded as one page.
+        """
+        yield await self.get_domain_events(originator_id, gt=gt, gte=gte, lt=lt, lte=lte, limit=limit,
+                                           is_ascending=is_ascending)
+
     @abstractmethod
     async def get_domain_event(self, originator_id, eq):
         """
@@ -34,24 +66,76 @@ class AbstractEventStore(six.with_metaclass(ABCMeta)):
         Returns most recent domain event for given entity ID.
         """
 
+    async def get_stream_head(self, originator_id):
+        """
+        Returns the version and topic of the most recent domain event for given entity ID, or None.
+
+        By default, the most recent domain event is read.
+        """
+        domain_event = await self.get_most_recent_event(originator_id)
+        if domain_event is not None:
+            return StreamHead(originator_id, getattr(domain_event, 'originator_version', None),
+                              topic_from_domain_class(type(domain_event)), None)
+
+    async def stream_exists(self, originator_id):
+        """
+        Returns True if there are domain events for given entity ID.
+        """
+        return await self.get_stream_head(originator_id) is not None
+
     @abstractmethod
     async def all_domain_events(self):
         """
         Returns all domain events in the event store.
         """
 
+    def scan_domain_events(self, resume=None, page_size=None):
+        """
+        Yields batches of all domain events in the event store, each with a resume token.
+        """
+        raise NotImplementedError()
+
+    async def read_notifications(self, start, limit=None):
+        """
+        Returns notifications of domain events, in the order the events were stored.
+        """
+        raise NotImplementedError()
+
 
 class EventStore(AbstractEventStore):
-    def __init__(self, active_record_strategy, sequenced_item_mapper=None):
+    """
+    Stores domain events as sequenced items, with an active record strategy.
+
+    If an executor is given, such as a ProcessPoolExecutor, sequenced
+    items read in batches of at least executor_batch_size items are
+    decoded in the executor, in chunks of that size, so decoding long
+    streams and whole tables uses all the worker processes and doesn't
+    block the event loop. The domain events are reconstructed in this
+    process, in the order of the sequenced items. The sequenced item
+    mapper is pickled and sent to the workers with each chunk, so it must
+    be a SequencedItemMapper, and everything given to it must be
+    picklable. Lazy mappers don't use the executor.
+
+    If the mapper has a blob store, the values it offloads are put in
+    the blob store, and got from it, in the event loop's default
+    executor, so as not to block the event loop.
+    """
+
+    def __init__(self, active_record_strategy, sequenced_item_mapper=None, executor=None,
+                 executor_batch_size=1000):
         assert isinstance(active_record_strategy, AbstractActiveRecordStrategy), active_record_strategy
         assert isinstance(sequenced_item_mapper, AbstractSequencedItemMapper), sequenced_item_mapper
         self.active_record_strategy = active_record_strategy
         self.sequenced_item_mapper = sequenced_item_mapper
+        self.executor = executor
+        self.executor_batch_size = executor_batch_size
 
     async def append(self, domain_event_or_events):
         # Convert the domain event(s) to sequenced item(s).
-        if isinstance(domain_event_or_events, (list, tuple)):
-            sequenced_item_or_items = [self.to_sequenced_item(e) for e in domain_event_or_events]
+        if getattr(self.sequenced_item_mapper, 'blob_store', None) is not None:
+            sequenced_item_or_items = await self.to_sequenced_items_with_blobs(domain_event_or_events)
+        elif isinstance(domain_event_or_events, (list, tuple)):
+            sequenced_item_or_items = self.sequenced_item_mapper.to_sequenced_items(domain_event_or_events)
         else:
             sequenced_item_or_items = self.to_sequenced_item(domain_event_or_events)
 
@@ -64,8 +148,57 @@ class EventStore(AbstractEventStore):
     def to_sequenced_item(self, domain_event):
         return self.sequenced_item_mapper.to_sequenced_item(domain_event)
 
+    async def to_sequenced_items_with_blobs(self, domain_event_or_events):
+        """
+        Returns sequenced item(s) for given domain event(s), after putting the values they offload in the blob store.
+        """
+        mapper = self.sequenced_item_mapper
+        blobs = {}
+        if isinstance(domain_event_or_events, (list, tuple)):
+            sequenced_item_or_items = mapper.to_sequenced_items(domain_event_or_events, blobs=blobs)
+        else:
+            sequenced_item_or_items = mapper.to_sequenced_items([domain_event_or_events], blobs=blobs)[0]
+        if blobs:
+            await mapper.put_blobs(blobs)
+        return sequenced_item_or_items
+
+    async def from_sequenced_items(self, sequenced_items):
+        """
+        Returns domain events from given sequenced items, in the same order, decoded in the executor if there is one.
+        """
+        mapper = self.sequenced_item_mapper
+        size = self.executor_batch_size
+        # Lazy mappers decode events, and get their blobs, when the events are used.
+        is_lazy = getattr(mapper, 'lazy', False)
+        in_executor = self.executor is not None and not is_lazy and len(sequenced_items) >= size
+        has_blobs = not is_lazy and getattr(mapper, 'blob_store', None) is not None
+        if not in_executor and not has_blobs:
+            return mapper.from_sequenced_items(sequenced_items)
+
+        if not in_executor:
+            chunks = [sequenced_items]
+            decoded = [mapper.decode_sequenced_items(sequenced_items)]
+        else:
+            loop = asyncio.get_event_loop()
+            chunks = [sequenced_items[i:i + size] for i in range(0, len(sequenced_items), size)]
+            decoded = await asyncio.gather(*[loop.run_in_executor(self.executor, mapper.decode_sequenced_items, chunk)
+                                             for chunk in chunks])
+        if has_blobs:
+            await mapper.load_blobs([event_attrs for decoded_attrs in decoded for event_attrs in decoded_attrs])
+        domain_events = []
+        for chunk, decoded_attrs in zip(chunks, decoded):
+            domain_events += mapper.reconstruct_domain_events(chunk, decoded_attrs)
+        return domain_events
+
     async def get_domain_events(self, originator_id, gt=None, gte=None, lt=None, lte=None, limit=None, is_ascending=True,
                           page_size=None):
+        if page_size is not None:
+            domain_events = []
+            async for page in self.iter_domain_events(originator_id, gt=gt, gte=gte, lt=lt, lte=lte, limit=limit,
+                                                      is_ascending=is_ascending, page_size=page_size):
+                domain_events.extend(page)
+            return domain_events
+
         sequenced_items = await self.active_record_strategy.get_items(
             sequence_id=originator_id,
             gt=gt,
@@ -78,17 +211,43 @@ class EventStore(AbstractEventStore):
         )
 
         # Deserialize to domain events.
-        domain_events = six.moves.map(self.sequenced_item_mapper.from_sequenced_item, sequenced_items)
-        domain_events = list(domain_events)
-        return domain_events
+        return await self.from_sequenced_items(sequenced_items)
+
+    async def get_domain_events_batch(self, originator_ids, gt=None, limit=None, is_ascending=True):
+        sequenced_items = await self.active_record_strategy.get_items_batch(originator_ids, gt=gt, limit=limit,
+                                                                            is_ascending=is_ascending)
+
+        # Deserialize the items of all the sequences together.
+        domain_events = await self.from_sequenced_items([i for items in sequenced_items.values() for i in items])
+        domain_events_batch = {}
+        start = 0
+        for originator_id, items in sequenced_items.items():
+            domain_events_batch[originator_id] = domain_events[start:start + len(items)]
+            start += len(items)
+        return domain_events_batch
+
+    async def iter_domain_events(self, originator_id, gt=None, gte=None, lt=None, lte=None, limit=None,
+                                 is_ascending=True, page_size=None):
+        pages = self.active_record_strategy.iter_items(
+            sequence_id=originator_id,
+            gt=gt,
+            gte=gte,
+            lt=lt,
+            lte=lte,
+            limit=limit,
+            page_size=page_size,
+            is_ascending=is_ascending,
+        )
+        async for sequenced_items in pages:
+            yield await self.from_sequenced_items(sequenced_items)
 
     async def get_domain_event(self, originator_id, eq):
         sequenced_item = await self.active_record_strategy.get_item(
             sequence_id=originator_id,
             eq=eq,
         )
-        domain_event = self.sequenced_item_mapper.from_sequenced_item(sequenced_item)
-        return domain_event
+        domain_events = await self.from_sequenced_items([sequenced_item])
+        return domain_events[0]
 
     async def get_most_recent_event(self, originator_id, lt=None, lte=None):
         events = await self.get_domain_events(originator_id=originator_id, lt=lt, lte=lte, limit=1, is_ascending=False)
@@ -98,6 +257,22 @@ class EventStore(AbstractEventStore):
         except IndexError:
             pass
 
+    async def get_stream_head(self, originator_id):
+        return await self.active_record_strategy.get_stream_head(originator_id)
+
+    async def stream_exists(self, originator_id):
+        return await self.active_record_strategy.get_stream_head(originator_id) is not None
+
     async def all_domain_events(self):
         all_items = await self.active_record_strategy.all_items()
-        return map(self.sequenced_item_mapper.from_sequenced_item, all_items)
+        return await self.from_sequenced_items(all_items)
+
+    async def scan_domain_events(self, resume=None, page_size=None):
+        batches = self.active_record_strategy.scan_items(resume=resume, page_size=page_size)
+        async for sequenced_items, resume in batches:
+            yield await self.from_sequenced_items(sequenced_items), resume
+
+    async def read_notifications(self, start, limit=None):
+        notifications = await self.active_record_strategy.read_notifications(start, limit=limit)
+        domain_events = await self.from_sequenced_items([n.item for n in notifications])
+        return [Notification(n.notification_id, domain_event) for n, domain_event in zip(notifications, domain_events)]
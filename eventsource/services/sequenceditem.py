@@ -4,6 +4,10 @@ SequencedItem = namedtuple('SequencedItem', ['sequence_id', 'position', 'topic',
 
 StoredEvent = namedtuple('StoredEvent', ['originator_id', 'originator_version', 'event_type', 'state'])
 
+Notification = namedtuple('Notification', ['notification_id', 'item'])
+
+StreamHead = namedtuple('StreamHead', ['sequence_id', 'position', 'topic', 'updated_at'])
+
 
 class SequencedItemFieldNames(object):
     def __init__(self, sequenced_item_class):
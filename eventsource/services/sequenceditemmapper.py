@@ -1,14 +1,30 @@
 from __future__ import unicode_literals
 
-from eventsource.services.transcoding import ObjectJSONDecoder, ObjectJSONEncoder
+from eventsource.exceptions import CodecError
+from eventsource.services.codecs import JSON, JSONCodec, codec_classes, decode_binary_text, encode_binary_text, \
+    is_binary_text
+from eventsource.services.transcoding import ObjectJSONDecoder, ObjectJSONEncoder, make_json_encode
 from eventsource.services.sequenceditem import SequencedItem, SequencedItemFieldNames
-from eventsource.model.events import reconstruct_object, resolve_domain_topic, topic_from_domain_class
+from eventsource.model.events import reconstruct_lazy_object, reconstruct_object, topic_from_domain_class, \
+    topic_registry as default_topic_registry
 
-import json
+import asyncio
+import numbers
 from abc import ABCMeta, abstractmethod
+from collections import namedtuple
+from functools import partial
+from json.encoder import encode_basestring_ascii
+from operator import attrgetter
+from uuid import UUID
 
 import six
 
+# The key of the event attributes that lists the names of the attributes
+# whose values are kept in a blob store, and replaced by their blob keys.
+BLOB_NAMES_KEY = '__blobs__'
+
+# What the mapper needs to know about a domain event class, worked out once for each class.
+EventClassMapping = namedtuple('EventClassMapping', ['domain_event_class', 'topic', 'is_encrypted'])
 
 
 class AbstractSequencedItemMapper(six.with_metaclass(ABCMeta)):
@@ -24,10 +40,51 @@ class AbstractSequencedItemMapper(six.with_metaclass(ABCMeta)):
         Return domain event from given sequenced item.
         """
 
+    def to_sequenced_items(self, domain_events):
+        """
+        Returns sequenced items for given domain events, in the same order.
+        """
+        return [self.to_sequenced_item(e) for e in domain_events]
+
+    def from_sequenced_items(self, sequenced_items):
+        """
+        Returns domain events from given sequenced items, in the same order.
+        """
+        return [self.from_sequenced_item(i) for i in sequenced_items]
+
 
 class SequencedItemMapper(AbstractSequencedItemMapper):
     """
     Uses JSON to transcode domain events.
+
+    If a blob store is given, attribute values whose JSON is larger than
+    offload_threshold bytes are put in the blob store, and the event data
+    refers to them by key. Values that are the same are stored once. The
+    values are got from the blob store when a domain event read by the
+    mapper is first used. An event store puts and gets them in an
+    executor, with put_blobs and load_blobs, so as not to block its event
+    loop, except that events read lazily still get them when first used.
+
+    If a compressor is given, the data of sequenced items is compressed,
+    with the dictionary of the event's topic if there is one.
+
+    If a binary codec is given, such as MsgpackCodec, events are encoded
+    with it instead of JSON, and the name of the codec is stored with the
+    data. Data encoded by any known codec can be read, so the codec can be
+    changed without migrating stored events. Objects nested in the state
+    of events are resolved with the mapper's topic registry, except by a
+    given codec, which resolves them with its own.
+
+    The topic and other details of each domain event class are worked out
+    the first time the class or its topic is seen, and the JSON encoder
+    and decoder are made once, so mapping each event costs little more
+    than encoding and decoding its state.
+
+    If lazy is True, domain events are read without decoding their data.
+    The class of each event is resolved from its topic, and its ID and
+    position are taken from the sequenced item, but the rest of its state
+    is decoded when it is first used. Events that are only filtered by
+    type, or skipped, are never decoded.
     """
 
     SEQUENCE_ID_FIELD_INDEX = 0
@@ -35,7 +92,9 @@ class SequencedItemMapper(AbstractSequencedItemMapper):
 
     def __init__(self, sequenced_item_class=SequencedItem, sequence_id_attr_name=None, position_attr_name=None,
                  json_encoder_class=ObjectJSONEncoder, json_decoder_class=ObjectJSONDecoder,
-                 always_encrypt=False, cipher=None, other_attr_names=()):
+                 always_encrypt=False, cipher=None, other_attr_names=(), blob_store=None,
+                 offload_threshold=256 * 1024, compressor=None, topic_registry=None, codec=None,
+                 lazy=False):
         self.sequenced_item_class = sequenced_item_class
         self.json_encoder_class = json_encoder_class
         self.json_decoder_class = json_decoder_class
@@ -45,6 +104,17 @@ class SequencedItemMapper(AbstractSequencedItemMapper):
         self.sequence_id_attr_name = sequence_id_attr_name or self.field_names[self.SEQUENCE_ID_FIELD_INDEX]
         self.position_attr_name = position_attr_name or self.field_names[self.POSITION_FIELD_INDEX]
         self.other_attr_names = other_attr_names or self.field_names[4:]
+        self.blob_store = blob_store
+        self.offload_threshold = offload_threshold
+        self.compressor = compressor
+        self.topic_registry = topic_registry or default_topic_registry
+        self.codec = codec or JSONCodec(json_encoder_class, json_decoder_class, topic_registry)
+        self.lazy = lazy
+        self._codecs = {self.codec.name: self.codec}
+        self._json_encode = make_json_encode(json_encoder_class)
+        self._json_decode = json_decoder_class(topic_registry=self.topic_registry).decode
+        self._class_mappings = {}
+        self._topic_mappings = {}
 
     def to_sequenced_item(self, domain_event):
         """
@@ -53,9 +123,11 @@ class SequencedItemMapper(AbstractSequencedItemMapper):
         item_args = self.construct_item_args(domain_event)
         return self.construct_sequenced_item(item_args)
 
-    def construct_item_args(self, domain_event):
+    def construct_item_args(self, domain_event, blobs=None):
         """
         Constructs attributes of a sequenced item from the given domain event.
+
+        If blobs is given, values to be put in the blob store are added to it by key, rather than put.
         """
         # Identify the sequence ID.
         sequence_id = getattr(domain_event, self.sequence_id_attr_name)
@@ -64,11 +136,16 @@ class SequencedItemMapper(AbstractSequencedItemMapper):
         position = getattr(domain_event, self.position_attr_name)
 
         # Construct the topic from the event class.
-        topic = topic_from_domain_class(domain_event.__class__)
+        mapping = self.get_class_mapping(domain_event.__class__)
+        topic = mapping.topic
 
         # Serialise the state of the event.
-        is_encrypted = self.is_encrypted(domain_event.__class__)
-        data = self.serialize_event_attrs(domain_event.__dict__, is_encrypted=is_encrypted)
+        is_encrypted = mapping.is_encrypted
+        event_attrs = domain_event.__dict__
+        encoded = None
+        if self.blob_store is not None:
+            event_attrs, encoded = self.offload_event_attrs(event_attrs, blobs)
+        data = self.encode_event_attrs(event_attrs, topic, is_encrypted=is_encrypted, encoded=encoded)
 
         other_args = tuple((getattr(domain_event, name) for name in self.other_attr_names))
         return (sequence_id, position, topic, data) + other_args
@@ -76,6 +153,37 @@ class SequencedItemMapper(AbstractSequencedItemMapper):
     def construct_sequenced_item(self, item_args):
         return self.sequenced_item_class(*item_args)
 
+    def to_sequenced_items(self, domain_events, blobs=None):
+        """
+        Constructs sequenced items from domain events, in the same order.
+
+        The mapping of each domain event class, and the getters of the
+        event attributes, are looked up once for the batch rather than
+        once for each event. If blobs is given, values to be put in the
+        blob store are added to it by key, rather than put.
+        """
+        get_item_attrs = attrgetter(self.sequence_id_attr_name, self.position_attr_name, *self.other_attr_names)
+        get_class_mapping = self.get_class_mapping
+        offload_event_attrs = self.offload_event_attrs if self.blob_store is not None else None
+        encode_event_attrs = self.encode_event_attrs
+        construct_sequenced_item = self.construct_sequenced_item
+        mappings = {}
+        sequenced_items = []
+        for domain_event in domain_events:
+            domain_event_class = domain_event.__class__
+            try:
+                mapping = mappings[domain_event_class]
+            except KeyError:
+                mapping = mappings[domain_event_class] = get_class_mapping(domain_event_class)
+            event_attrs = domain_event.__dict__
+            encoded = None
+            if offload_event_attrs is not None:
+                event_attrs, encoded = offload_event_attrs(event_attrs, blobs)
+            item_attrs = get_item_attrs(domain_event)
+            data = encode_event_attrs(event_attrs, mapping.topic, is_encrypted=mapping.is_encrypted, encoded=encoded)
+            sequenced_items.append(construct_sequenced_item(item_attrs[:2] + (mapping.topic, data) + item_attrs[2:]))
+        return sequenced_items
+
     def from_sequenced_item(self, sequenced_item):
         """
         Reconstructs domain event from stored event topic and
@@ -84,31 +192,279 @@ class SequencedItemMapper(AbstractSequencedItemMapper):
         assert isinstance(sequenced_item, self.sequenced_item_class), (self.sequenced_item_class, type(sequenced_item))
 
         # Get the domain event class from the topic.
-        topic = getattr(sequenced_item, self.field_names.topic)
-        domain_event_class = resolve_domain_topic(topic)
+        mapping = self.get_topic_mapping(getattr(sequenced_item, self.field_names.topic))
+        return self.construct_domain_event(mapping, sequenced_item, getattr(sequenced_item, self.field_names.data))
+
+    def from_sequenced_items(self, sequenced_items):
+        """
+        Reconstructs domain events from sequenced items, in the same order.
+
+        The mapping of each topic is looked up once for the batch rather
+        than once for each item. Unless events are read lazily, or from a
+        blob store, or compressed, the state of each event is decoded and
+        set without any other work.
+        """
+        get_topic = attrgetter(self.field_names.topic)
+        get_data = attrgetter(self.field_names.data)
+        get_topic_mapping = self.get_topic_mapping
+        if self.lazy or self.blob_store is not None or self.compressor is not None:
+            construct_domain_event = self.construct_domain_event
+        else:
+            decode_event_attrs = self.decode_event_attrs
+
+            def construct_domain_event(mapping, _, data):
+                return reconstruct_object(mapping.domain_event_class, decode_event_attrs(data, mapping.is_encrypted))
+
+        mappings = {}
+        domain_events = []
+        for sequenced_item in sequenced_items:
+            topic = get_topic(sequenced_item)
+            try:
+                mapping = mappings[topic]
+            except KeyError:
+                mapping = mappings[topic] = get_topic_mapping(topic)
+            domain_events.append(construct_domain_event(mapping, sequenced_item, get_data(sequenced_item)))
+        return domain_events
+
+    def construct_domain_event(self, mapping, sequenced_item, data):
+        """
+        Reconstructs a domain event of the mapped class, from the data of a sequenced item.
+        """
+        domain_event_class = mapping.domain_event_class
 
         # Deserialize, optionally with decryption.
-        is_encrypted = self.is_encrypted(domain_event_class)
-        event_attrs = self.deserialize_event_attrs(getattr(sequenced_item, self.field_names.data), is_encrypted)
+        is_encrypted = mapping.is_encrypted
+        if self.lazy:
+            return reconstruct_lazy_object(domain_event_class, partial(self.get_event_attrs, data, is_encrypted), {
+                self.sequence_id_attr_name: sequenced_item[self.SEQUENCE_ID_FIELD_INDEX],
+                self.position_attr_name: sequenced_item[self.POSITION_FIELD_INDEX],
+            })
+        return self.reconstruct_domain_event(mapping, self.decode_event_attrs(data, is_encrypted))
+
+    def reconstruct_domain_event(self, mapping, event_attrs):
+        """
+        Reconstructs a domain event of the mapped class, from its decoded attributes.
+        """
+        domain_event_class = mapping.domain_event_class
+
+        # Leave values in the blob store until the domain event is used.
+        blob_keys = self.get_blob_keys(event_attrs)
+        if blob_keys:
+            for name in blob_keys:
+                del event_attrs[name]
+            return reconstruct_lazy_object(domain_event_class, partial(self.load_event_attrs, blob_keys), event_attrs)
 
         # Reconstruct the domain event object.
         return reconstruct_object(domain_event_class, event_attrs)
 
-    def serialize_event_attrs(self, event_attrs, is_encrypted=False):
-        event_data = json.dumps(
-            event_attrs,
-            separators=(',', ':'),
-            sort_keys=True,
-            cls=self.json_encoder_class,
-        )
+    def decode_sequenced_items(self, sequenced_items):
+        """
+        Returns the decoded attributes of domain events, from given sequenced items.
 
-        return event_data
+        With reconstruct_domain_events, lets the sequenced items be
+        decoded in another process, and the domain events reconstructed
+        in this one.
+        """
+        get_topic = attrgetter(self.field_names.topic)
+        get_data = attrgetter(self.field_names.data)
+        return [self.decode_event_attrs(get_data(i), self.get_topic_mapping(get_topic(i)).is_encrypted)
+                for i in sequenced_items]
+
+    def reconstruct_domain_events(self, sequenced_items, decoded_attrs):
+        """
+        Reconstructs domain events from sequenced items, and their attributes decoded by decode_sequenced_items.
+        """
+        get_topic = attrgetter(self.field_names.topic)
+        return [self.reconstruct_domain_event(self.get_topic_mapping(get_topic(i)), event_attrs)
+                for i, event_attrs in zip(sequenced_items, decoded_attrs)]
+
+    def get_event_attrs(self, data, is_encrypted):
+        """
+        Returns all the attributes of a domain event, decoded from the data of a sequenced item.
+        """
+        event_attrs = self.decode_event_attrs(data, is_encrypted)
+        blob_keys = self.get_blob_keys(event_attrs)
+        if blob_keys:
+            event_attrs.update(self.load_event_attrs(blob_keys))
+        return event_attrs
+
+    def get_class_mapping(self, domain_event_class):
+        try:
+            return self._class_mappings[domain_event_class]
+        except KeyError:
+            mapping = EventClassMapping(domain_event_class, topic_from_domain_class(domain_event_class),
+                                        self.is_encrypted(domain_event_class))
+            self._class_mappings[domain_event_class] = mapping
+            return mapping
+
+    def get_topic_mapping(self, topic):
+        try:
+            return self._topic_mappings[topic]
+        except KeyError:
+            domain_event_class = self.topic_registry.resolve(topic)
+            mapping = EventClassMapping(domain_event_class, topic, self.is_encrypted(domain_event_class))
+            self._topic_mappings[topic] = mapping
+            return mapping
+
+    def offload_event_attrs(self, event_attrs, blobs=None):
+        """
+        Returns event attributes, with values larger than the offload threshold replaced by blob keys.
+
+        The names of the replaced values are listed under BLOB_NAMES_KEY.
+        The JSON of each attribute is also returned, keyed by name, so
+        each value is encoded once, whether it is put in the blob store or
+        kept in the event data. If blobs is given, values to be put in the
+        blob store are added to it by key, rather than put.
+        """
+        serialize = self.serialize_event_attrs
+        encoded = {}
+        offloaded = None
+        for name, value in event_attrs.items():
+            text = encoded[name] = serialize(value)
+            # The JSON is ASCII, so its length is its size in bytes. Numbers
+            # and the like are never large enough.
+            if len(text) <= self.offload_threshold or value is None or isinstance(value, (numbers.Number, UUID)):
+                continue
+            data = text.encode('utf8')
+            if blobs is None:
+                key = self.blob_store.put(data)
+            else:
+                key = self.blob_store.content_key(data)
+                blobs[key] = data
+            if offloaded is None:
+                offloaded = dict(event_attrs)
+                offloaded[BLOB_NAMES_KEY] = []
+            offloaded[name] = key
+            offloaded[BLOB_NAMES_KEY].append(name)
+            encoded[name] = serialize(key)
+        if offloaded is None:
+            return event_attrs, encoded
+        encoded[BLOB_NAMES_KEY] = serialize(offloaded[BLOB_NAMES_KEY])
+        return offloaded, encoded
+
+    async def put_blobs(self, blobs):
+        """
+        Puts given blobs, keyed by key, in the blob store, in an executor.
+        """
+        loop = asyncio.get_event_loop()
+        await asyncio.gather(*[loop.run_in_executor(None, self.blob_store.put, data) for data in blobs.values()])
+
+    def get_blob_keys(self, event_attrs):
+        """
+        Returns the blob keys of event attributes whose values are in the blob store, keyed by name.
+
+        The list of their names is removed from the event attributes.
+        """
+        if self.blob_store is None:
+            return None
+        names = event_attrs.pop(BLOB_NAMES_KEY, None)
+        if not names:
+            return None
+        return {name: event_attrs[name] for name in names}
+
+    def load_event_attrs(self, blob_keys):
+        """
+        Returns event attributes with given blob keys, from the blob store.
+        """
+        return {name: self._json_decode(self.blob_store.get(key).decode('utf8'))
+                for name, key in blob_keys.items()}
+
+    async def load_blobs(self, decoded_attrs):
+        """
+        Replaces the blob keys in decoded event attributes with the values got from the blob store, in an executor.
+
+        Values referred to by more than one event are got once.
+        """
+        if self.blob_store is None:
+            return
+        blob_keys = [(event_attrs, self.get_blob_keys(event_attrs)) for event_attrs in decoded_attrs]
+        keys = list({key for _, keys in blob_keys if keys for key in keys.values()})
+        if not keys:
+            return
+        loop = asyncio.get_event_loop()
+        blobs = await asyncio.gather(*[loop.run_in_executor(None, self.blob_store.get, key) for key in keys])
+        blobs = dict(zip(keys, blobs))
+        for event_attrs, keys in blob_keys:
+            if keys:
+                for name, key in keys.items():
+                    event_attrs[name] = self._json_decode(blobs[key].decode('utf8'))
+
+    def encode_event_attrs(self, event_attrs, topic, is_encrypted=False, encoded=None):
+        """
+        Returns the data of a sequenced item, encoded by the codec and optionally compressed.
+
+        Optionally, encoded is the JSON of each attribute, keyed by name,
+        which is joined rather than encoding the attributes again.
+        """
+        if self.codec.name == JSON:
+            if encoded is not None and not is_encrypted:
+                # As the encoder would, with sorted keys and no spaces.
+                data = '{' + ','.join([encode_basestring_ascii(name) + ':' + text
+                                       for name, text in sorted(encoded.items())]) + '}'
+            else:
+                data = self.serialize_event_attrs(event_attrs, is_encrypted=is_encrypted)
+        else:
+            data = self.codec.encode(event_attrs)
+        if self.compressor is not None:
+            return self.compressor.compress(data, topic, self.codec.name)
+        if isinstance(data, bytes):
+            return encode_binary_text(self.codec.name, data)
+        return data
+
+    def decode_event_attrs(self, data, is_encrypted):
+        """
+        Returns event attributes from the data of a sequenced item, with the codec that encoded it.
+        """
+        if self.compressor is not None and self.compressor.is_compressed(data):
+            codec_name, data = self.compressor.decompress_payload(data)
+        elif is_binary_text(data):
+            codec_name, data = decode_binary_text(data)
+        else:
+            return self.deserialize_event_attrs(data, is_encrypted)
+        if codec_name == JSON:
+            return self.deserialize_event_attrs(data.decode('utf8'), is_encrypted)
+        return self.get_codec(codec_name).decode(data)
+
+    def get_codec(self, name):
+        try:
+            return self._codecs[name]
+        except KeyError:
+            pass
+        try:
+            codec_class = codec_classes[name]
+        except KeyError:
+            raise CodecError("Unknown codec: {}".format(name))
+        codec = self._codecs[name] = codec_class(topic_registry=self.topic_registry)
+        return codec
+
+    def serialize_event_attrs(self, event_attrs, is_encrypted=False):
+        return self._json_encode(event_attrs)
 
     def deserialize_event_attrs(self, event_attrs, is_encrypted):
         """
         Deserialize event attributes from JSON, optionally with decryption.
         """
-        return json.loads(event_attrs, cls=self.json_decoder_class)
+        return self._json_decode(event_attrs)
 
     def is_encrypted(self, domain_event_class):
         return self.always_encrypt or getattr(domain_event_class, '__always_encrypt__', False)
+
+    def __getstate__(self):
+        # The encoder, the decoder and the caches are made again when
+        # the mapper is unpickled, such as in the worker processes of
+        # an event store's executor.
+        state = self.__dict__.copy()
+        for name in ('_codecs', '_json_encode', '_json_decode', '_class_mappings', '_topic_mappings'):
+            del state[name]
+        if self.topic_registry is default_topic_registry:
+            state['topic_registry'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.topic_registry = self.topic_registry or default_topic_registry
+        self._codecs = {self.codec.name: self.codec}
+        self._json_encode = make_json_encode(self.json_encoder_class)
+        self._json_decode = self.json_decoder_class(topic_registry=self.topic_registry).decode
+        self._class_mappings = {}
+        self._topic_mappings = {}
@@ -1,16 +1,23 @@
+import datetime
 from abc import ABCMeta, abstractmethod
+from collections import deque
 from copy import deepcopy
+from decimal import Decimal
+from uuid import UUID
 
 import six
 
 from eventsource.model.entity import DomainEntity
-from eventsource.model.events import resolve_domain_topic, topic_from_domain_class
+from eventsource.model.events import topic_from_domain_class, topic_registry as default_topic_registry
 from eventsource.model.snapshot import AbstractSnapshop, Snapshot
 from eventsource.services.eventstore import EventStore
 from eventsource.model.events import reconstruct_object
 
 
 class AbstractSnapshotStrategy(six.with_metaclass(ABCMeta)):
+    # The registry that resolves the topics of snapshot entities, if not the default.
+    topic_registry = None
+
     @abstractmethod
     async def get_snapshot(self, entity_id: DomainEntity, lt=None, lte=None) -> Snapshot:
         """
@@ -19,6 +26,19 @@ class AbstractSnapshotStrategy(six.with_metaclass(ABCMeta)):
         :rtype: Snapshot
         """
 
+    async def get_snapshots(self, entity_ids):
+        """
+        Gets the last snapshot of each of given entities, keyed by entity ID.
+
+        Entities without a snapshot are left out.
+        """
+        snapshots = {}
+        for entity_id in entity_ids:
+            snapshot = await self.get_snapshot(entity_id)
+            if snapshot is not None:
+                snapshots[entity_id] = snapshot
+        return snapshots
+
     @abstractmethod
     def take_snapshot(self, entity_id,
                       entity: DomainEntity,
@@ -29,14 +49,24 @@ class AbstractSnapshotStrategy(six.with_metaclass(ABCMeta)):
         :rtype: AbstractSnapshop
         """
 
+    def entity_from_snapshot(self, snapshot):
+        """
+        Reconstructs domain entity from given snapshot, resolving its topic with the strategy's registry.
+        """
+        return entity_from_snapshot(snapshot, self.topic_registry)
+
 
 class EventSourcedSnapshotStrategy(AbstractSnapshotStrategy):
     """Snapshot strategy that uses an event sourced snapshot.
+
+    Topics are resolved with given topic registry, or else with the
+    registry of the event store's sequenced item mapper.
     """
 
-    def __init__(self, event_store: EventStore):
+    def __init__(self, event_store: EventStore, topic_registry=None):
         assert isinstance(event_store, EventStore)
         self.event_store = event_store
+        self.topic_registry = topic_registry or getattr(event_store.sequenced_item_mapper, 'topic_registry', None)
 
     async def get_snapshot(self, entity_id, lt=None, lte=None) -> Snapshot:
         """
@@ -52,6 +82,15 @@ class EventSourcedSnapshotStrategy(AbstractSnapshotStrategy):
         if len(snapshots) == 1:
             return snapshots[0]
 
+    async def get_snapshots(self, entity_ids):
+        """
+        Gets the last snapshot of each of given entities, reading only the last snapshot of each.
+
+        The snapshots of all the entities are read with one batch read.
+        """
+        snapshots = await self.event_store.get_domain_events_batch(entity_ids, limit=1, is_ascending=False)
+        return {entity_id: s[0] for entity_id, s in snapshots.items() if s}
+
     def take_snapshot(self, entity_id, entity, last_event_version):
         """
         Takes a snapshot by instantiating and publishing a Snapshot domain event.
@@ -62,7 +101,7 @@ class EventSourcedSnapshotStrategy(AbstractSnapshotStrategy):
         snapshot = Snapshot(originator_id=entity_id,
                             originator_version=last_event_version,
                             topic=topic_from_domain_class(entity.__class__),
-                            state=None if entity is None else deepcopy(entity.__dict__))
+                            state=None if entity is None else copy_state(entity.__dict__))
 
         # Publish the snapshot event.
         entity._apply_and_publish(snapshot)
@@ -71,11 +110,65 @@ class EventSourcedSnapshotStrategy(AbstractSnapshotStrategy):
         return snapshot
 
 
-def entity_from_snapshot(snapshot):
+# Values of exactly these types can't change, so they are shared by copies of entity state.
+IMMUTABLE_TYPES = frozenset([
+    type(None), bool, int, float, complex, str, bytes, Decimal, UUID, frozenset,
+    datetime.datetime, datetime.date, datetime.time, datetime.timedelta,
+])
+
+
+def copy_state(value, memo=None):
+    """
+    Returns a copy of the state of an entity, sharing with it the values that can't change.
+
+    Dicts, lists, tuples, sets and deques are copied, and values of
+    exactly the immutable builtin types are shared with the original, so
+    taking a snapshot costs much less than a deep copy. Values of any
+    other type, including subclasses of the immutable types, are deep
+    copied. As with deepcopy, a memo of the values already copied is
+    kept, so values referred to more than once are copied once, and
+    cycles are copied as cycles.
+    """
+    value_type = type(value)
+    if value_type in IMMUTABLE_TYPES:
+        return value
+    if memo is None:
+        memo = {}
+    try:
+        return memo[id(value)]
+    except KeyError:
+        pass
+
+    if value_type is dict:
+        copied = memo[id(value)] = {}
+        for k, v in value.items():
+            copied[copy_state(k, memo)] = copy_state(v, memo)
+    elif value_type is list:
+        copied = memo[id(value)] = []
+        copied.extend(copy_state(v, memo) for v in value)
+    elif value_type is deque:
+        copied = memo[id(value)] = deque(maxlen=value.maxlen)
+        copied.extend(copy_state(v, memo) for v in value)
+    elif value_type is set:
+        copied = memo[id(value)] = {copy_state(v, memo) for v in value}
+    elif value_type is tuple:
+        copied = tuple(copy_state(v, memo) for v in value)
+        # A tuple in a cycle is copied while its items are copied.
+        if id(value) in memo:
+            return memo[id(value)]
+        if all(c is v for c, v in zip(copied, value)):
+            copied = value
+        memo[id(value)] = copied
+    else:
+        copied = deepcopy(value, memo)
+    return copied
+
+
+def entity_from_snapshot(snapshot, topic_registry=None):
     """
-    Reconstructs domain entity from given snapshot.
+    Reconstructs domain entity from given snapshot, resolving its topic with given registry or the default.
     """
     assert isinstance(snapshot, AbstractSnapshop), type(snapshot)
     if snapshot.state is not None:
-        entity_class = resolve_domain_topic(snapshot.topic)
+        entity_class = (topic_registry or default_topic_registry).resolve(snapshot.topic)
         return reconstruct_object(entity_class, snapshot.state)
@@ -20,6 +20,10 @@ else:
     utc_timezone = UTC()
 
 
+# The number of tenths of microseconds from the start of the Gregorian calendar to the Unix epoch.
+UUID1_EPOCH_OFFSET = 0x01B21DD213814000
+
+
 def timestamp_from_uuid(uuid_arg):
     """
     Return a floating point unix timestamp to 6 decimal places.
@@ -35,16 +39,47 @@ def timestamp_long_from_uuid(uuid_arg):
     """
     Returns an integer value representing a unix timestamp in tenths of microseconds.
 
+    Time-based UUIDs of version 1, and time-ordered UUIDs of version 7, are supported.
+
+    :param uuid_arg:
+    :return: Unix timestamp integer in tenths of microseconds.
+    :rtype: int
+    """
+    uuid_arg = _as_uuid(uuid_arg)
+    if uuid_arg.version == 7:
+        return timestamp_long_from_uuid7(uuid_arg)
+    return uuid_arg.time - UUID1_EPOCH_OFFSET
+
+
+def timestamp_long_from_uuid7(uuid_arg):
+    """
+    Returns an integer value representing the unix timestamp of a time-ordered UUID in tenths of microseconds.
+
+    The 12 bits after the version are read as the fraction of the
+    millisecond, as written by the time-ordered ID generator. UUIDs of
+    version 7 made by other generators may have random bits there, and
+    so have a timestamp up to a millisecond late.
+
     :param uuid_arg:
     :return: Unix timestamp integer in tenths of microseconds.
     :rtype: int
     """
-    return time_from_uuid(uuid_arg) - 0x01B21DD213814000
+    value = _as_uuid(uuid_arg).int
+    return (value >> 80) * 10000 + ((value >> 64) & 0xfff) * 10000 // 4096
 
 
 def time_from_uuid(uuid_arg):
+    """
+    Returns the time of a time-based UUID, in tenths of microseconds from the start of the Gregorian calendar.
+    """
+    uuid_arg = _as_uuid(uuid_arg)
+    if uuid_arg.version == 7:
+        return timestamp_long_from_uuid7(uuid_arg) + UUID1_EPOCH_OFFSET
+    return uuid_arg.time
+
+
+def _as_uuid(uuid_arg):
     if isinstance(uuid_arg, six.string_types):
         uuid_arg = UUID(uuid_arg)
     assert isinstance(uuid_arg, UUID), uuid_arg
-    uuid_time = uuid_arg.time
-    return uuid_time
+    return uuid_arg
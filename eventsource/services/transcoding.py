@@ -1,10 +1,17 @@
 import datetime
 from json import JSONDecoder, JSONEncoder
+from json.encoder import encode_basestring_ascii
 from uuid import UUID
 
+try:
+    from json.encoder import c_make_encoder
+except ImportError:
+    c_make_encoder = None
+
 import dateutil.parser
 
-from eventsource.model.events import resolve_domain_topic, topic_from_domain_class
+from eventsource.model.events import reconstruct_object, topic_from_domain_class, \
+    topic_registry as default_topic_registry
 
 
 class ObjectJSONEncoder(JSONEncoder):
@@ -29,19 +36,26 @@ class ObjectJSONEncoder(JSONEncoder):
 
 
 class ObjectJSONDecoder(JSONDecoder):
-    def __init__(self, object_hook=None, **kwargs):
+    """
+    Decodes JSON encoded by ObjectJSONEncoder.
+
+    The classes of objects are resolved from their topics with given
+    topic registry, or the default registry.
+    """
+
+    def __init__(self, object_hook=None, topic_registry=None, **kwargs):
+        self.topic_registry = topic_registry or default_topic_registry
         super(ObjectJSONDecoder, self).__init__(object_hook=object_hook or self.from_jsonable, **kwargs)
 
-    @classmethod
-    def from_jsonable(cls, d):
+    def from_jsonable(self, d):
         if 'ISO8601_datetime' in d:
-            return cls._decode_datetime(d)
+            return self._decode_datetime(d)
         elif 'ISO8601_date' in d:
-            return cls._decode_date(d)
+            return self._decode_date(d)
         elif 'UUID' in d:
-            return cls._decode_uuid(d)
+            return self._decode_uuid(d)
         elif '__class__' in d:
-            return cls._decode_object(d)
+            return self._decode_object(d)
         return d
 
     @staticmethod
@@ -56,11 +70,37 @@ class ObjectJSONDecoder(JSONDecoder):
     def _decode_uuid(d):
         return UUID(d['UUID'])
 
-    @staticmethod
-    def _decode_object(d):
+    def _decode_object(self, d):
         topic = d['__class__']['topic']
         state = d['__class__']['state']
-        obj_class = resolve_domain_topic(topic)
-        obj = object.__new__(obj_class)
-        obj.__dict__.update(state)
-        return obj
+        return reconstruct_object(self.topic_registry.resolve(topic), state)
+
+
+def make_json_encode(json_encoder_class=ObjectJSONEncoder):
+    """
+    Returns a function that encodes objects as compact JSON with sorted keys, like json.dumps.
+
+    The encoder is made once, rather than for each object. Where the C
+    accelerated encoder is available, it is made once too. Objects are
+    still checked for circular references, with markers that the C
+    encoder removes as it finishes each container, and that are cleared
+    if encoding fails part way, so the returned function must not be
+    called from more than one thread at once.
+    """
+    encoder = json_encoder_class(separators=(',', ':'), sort_keys=True)
+    if c_make_encoder is None or \
+            json_encoder_class.encode is not JSONEncoder.encode or \
+            json_encoder_class.iterencode is not JSONEncoder.iterencode:
+        return encoder.encode
+    markers = {}
+    c_encode = c_make_encoder(markers, encoder.default, encode_basestring_ascii, None,
+                              encoder.key_separator, encoder.item_separator, True, False, True)
+
+    def encode(obj):
+        try:
+            return ''.join(c_encode(obj, 0))
+        except Exception:
+            markers.clear()
+            raise
+
+    return encode
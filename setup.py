@@ -29,6 +29,10 @@ setup(
         'aiopg',
         'asynctest',
     ],
+    extras_require={
+        'zstd': ['zstandard'],
+        'msgpack': ['msgpack'],
+    },
     zip_safe=False,
     long_description=long_description,
     keywords=['event sourcing', 'event store', 'async', 'domain driven design', 'ddd', 'cqrs', 'cqs'],
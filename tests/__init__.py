@@ -1,11 +1,29 @@
+from tests.activerecord_tests import GroupCommitActiveRecordStrategyTest, InPlaceActiveRecordStrategyTest, \
+    LogFileActiveRecordStrategyTest, PeweeActiveRecordStrategyTest, ReplicatedActiveRecordStrategyTest, \
+    ShardedActiveRecordStrategyTest, SQLiteActiveRecordStrategyTest, SQLiteInternedTopicsActiveRecordStrategyTest
 from tests.application_tests import TodoApplicationTest
 from tests.bus_tests import BusTests
 from tests.db_tests import TodoDbTest
 from tests.domain_tests import TodoDomainTest
+from tests.events_tests import CompactDomainEventTest, TimeOrderedIDTest, TopicRegistryTest
+from tests.mapper_tests import EventStoreMappingTest, SequencedItemMapperTest
 
 __all__ = [
+    InPlaceActiveRecordStrategyTest,
+    GroupCommitActiveRecordStrategyTest,
+    SQLiteActiveRecordStrategyTest,
+    SQLiteInternedTopicsActiveRecordStrategyTest,
+    LogFileActiveRecordStrategyTest,
+    ShardedActiveRecordStrategyTest,
+    ReplicatedActiveRecordStrategyTest,
+    PeweeActiveRecordStrategyTest,
     TodoApplicationTest,
     TodoDbTest,
     TodoDomainTest,
     BusTests,
+    SequencedItemMapperTest,
+    EventStoreMappingTest,
+    TopicRegistryTest,
+    CompactDomainEventTest,
+    TimeOrderedIDTest,
 ]
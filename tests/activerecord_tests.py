@@ -0,0 +1,531 @@
+import asyncio
+import os
+import tempfile
+import unittest
+import uuid
+
+import asynctest
+
+from eventsource.exceptions import ProgrammingError, SequencedItemError
+from eventsource.ext.group_commit_active_record_strategy import GroupCommitActiveRecordStrategy
+from eventsource.ext.inplaceactiverecordstrategy import InPlaceActiveRecordStrategy
+from eventsource.ext.log_file_active_record_strategy import LogFileActiveRecordStrategy
+from eventsource.ext.replicated_active_record_strategy import ReplicatedActiveRecordStrategy
+from eventsource.ext.sharded_active_record_strategy import ShardedActiveRecordStrategy
+from eventsource.ext.sqlite_active_record_strategy import SQLiteActiveRecordStrategy
+from eventsource.services.sequenceditem import SequencedItem, SequencedItemFieldNames
+
+try:
+    from peewee import OperationalError
+    from peewee_async import Manager, PooledPostgresqlDatabase
+
+    from eventsource.ext.pewee_active_record_strategy import EventRecord, NotificationRecord, \
+        PeweeActiveRecordStrategy, StreamRecord
+except ImportError:
+    PeweeActiveRecordStrategy = None
+
+
+class ActiveRecordStrategyTestCase(object):
+    """
+    Contract checks shared by the active record strategy tests.
+    """
+
+    def construct_strategy(self, **kwargs):
+        raise NotImplementedError()
+
+    def setUp(self):
+        self.strategy = self.construct_strategy()
+
+    def sequence_id(self, name):
+        """
+        Returns the ID of the sequence the tests call name.
+        """
+        return name
+
+    def item(self, sequence_id, position):
+        return SequencedItem(sequence_id, position, 'topic', '{"position":%d}' % position)
+
+    async def append_positions(self, sequence_id, positions):
+        await self.strategy.append([self.item(sequence_id, p) for p in positions])
+
+    async def test_get_item(self):
+        a, b = map(self.sequence_id, 'ab')
+        await self.append_positions(a, range(5))
+        item = await self.strategy.get_item(a, 3)
+        self.assertEqual(item.position, 3)
+        with self.assertRaises(IndexError):
+            await self.strategy.get_item(a, 10)
+        with self.assertRaises(IndexError):
+            await self.strategy.get_item(b, 0)
+
+    async def test_get_items_ranges(self):
+        a, b, c = map(self.sequence_id, 'abc')
+        await self.append_positions(a, range(10))
+        await self.append_positions(b, range(3))
+
+        def positions(items):
+            return [i.position for i in items]
+
+        self.assertEqual(positions(await self.strategy.get_items(a)), list(range(10)))
+        self.assertEqual(positions(await self.strategy.get_items(a, gt=6)), [7, 8, 9])
+        self.assertEqual(positions(await self.strategy.get_items(a, gte=6, lt=8)), [6, 7])
+        self.assertEqual(positions(await self.strategy.get_items(a, lte=2)), [0, 1, 2])
+        self.assertEqual(positions(await self.strategy.get_items(a, limit=2)), [0, 1])
+        self.assertEqual(positions(await self.strategy.get_items(
+            a, lt=8, limit=2, query_ascending=False, results_ascending=False)), [7, 6])
+        self.assertEqual(positions(await self.strategy.get_items(
+            a, lt=8, limit=2, query_ascending=False, results_ascending=True)), [6, 7])
+        self.assertEqual(await self.strategy.get_items(a, gt=9), [])
+        self.assertEqual(await self.strategy.get_items(c), [])
+
+    async def test_append_rejects_duplicate_position(self):
+        a = self.sequence_id('a')
+        await self.append_positions(a, range(3))
+        with self.assertRaises(SequencedItemError):
+            await self.append_positions(a, [3, 2])
+        # The conflicting batch must not be partially stored.
+        self.assertEqual(len(await self.strategy.get_items(a)), 3)
+
+    async def test_iter_items_pages_on_position(self):
+        a = self.sequence_id('a')
+        await self.append_positions(a, range(10))
+
+        pages = [[i.position for i in page] async for page in self.strategy.iter_items(a, page_size=4)]
+        self.assertEqual(pages, [[0, 1, 2, 3], [4, 5, 6, 7], [8, 9]])
+
+        pages = [[i.position for i in page] async for page in self.strategy.iter_items(
+            a, gt=2, limit=5, page_size=3)]
+        self.assertEqual(pages, [[3, 4, 5], [6, 7]])
+
+        pages = [[i.position for i in page] async for page in self.strategy.iter_items(
+            a, lte=6, page_size=4, is_ascending=False)]
+        self.assertEqual(pages, [[6, 5, 4, 3], [2, 1, 0]])
+
+    async def test_get_stream_head(self):
+        a, b = map(self.sequence_id, 'ab')
+        self.assertIsNone(await self.strategy.get_stream_head(a))
+        await self.append_positions(a, range(3))
+        await self.strategy.append(SequencedItem(a, 3, 'last', '{}'))
+        await self.append_positions(b, [0])
+
+        head = await self.strategy.get_stream_head(a)
+        self.assertEqual((head.sequence_id, head.position, head.topic), (a, 3, 'last'))
+        self.assertEqual((await self.strategy.get_stream_head(b)).position, 0)
+
+    async def test_get_items_batch(self):
+        a, b, c = map(self.sequence_id, 'abc')
+        await self.append_positions(a, range(3))
+        await self.append_positions(b, range(4))
+
+        items = await self.strategy.get_items_batch([a, b, c], gt={b: 1})
+        self.assertEqual({k: [i.position for i in v] for k, v in items.items()},
+                         {a: [0, 1, 2], b: [2, 3], c: []})
+
+        items = await self.strategy.get_items_batch([a, b, c], limit=1, is_ascending=False)
+        self.assertEqual({k: [i.position for i in v] for k, v in items.items()}, {a: [2], b: [3], c: []})
+        items = await self.strategy.get_items_batch([a, b], gt={a: 0}, limit=2)
+        self.assertEqual({k: [i.position for i in v] for k, v in items.items()}, {a: [1, 2], b: [0, 1]})
+
+    async def test_all_items(self):
+        a, b = map(self.sequence_id, 'ab')
+        await self.append_positions(a, range(3))
+        await self.append_positions(b, range(2))
+        self.assertEqual(len(await self.strategy.all_items()), 5)
+
+    async def test_scan_items_resumes_from_token(self):
+        a, b = map(self.sequence_id, 'ab')
+        await self.append_positions(a, range(3))
+        await self.append_positions(b, range(4))
+
+        batches = [(batch, resume) async for batch, resume in self.strategy.scan_items(page_size=3)]
+        self.assertEqual([len(batch) for batch, _ in batches], [3, 3, 1])
+        keys = [(i.sequence_id, i.position) for batch, _ in batches for i in batch]
+        self.assertEqual(keys, [(a, 0), (a, 1), (a, 2), (b, 0), (b, 1), (b, 2), (b, 3)])
+
+        resume = batches[0][1]
+        self.assertEqual(tuple(resume), (a, 2))
+        batches = [batch async for batch, _ in self.strategy.scan_items(resume=resume, page_size=3)]
+        self.assertEqual([[i.position for i in batch] for batch in batches], [[0, 1, 2], [3]])
+
+    async def test_read_notifications(self):
+        a, b = map(self.sequence_id, 'ab')
+        with self.assertRaises(ProgrammingError):
+            await self.strategy.read_notifications(1)
+
+        self.strategy = self.construct_strategy(notification_log=True)
+        await self.append_positions(a, range(2))
+        await self.append_positions(b, range(3))
+        await self.append_positions(a, [2])
+
+        notifications = await self.strategy.read_notifications(1)
+        self.assertEqual([n.notification_id for n in notifications], [1, 2, 3, 4, 5, 6])
+        self.assertEqual([(n.item.sequence_id, n.item.position) for n in notifications],
+                         [(a, 0), (a, 1), (b, 0), (b, 1), (b, 2), (a, 2)])
+
+        notifications = await self.strategy.read_notifications(3, limit=2)
+        self.assertEqual([(n.notification_id, n.item.position) for n in notifications], [(3, 0), (4, 1)])
+        self.assertEqual(await self.strategy.read_notifications(7), [])
+
+    async def check_stream_head_follows_deletes(self):
+        a = self.sequence_id('a')
+        await self.append_positions(a, range(3))
+        await self.strategy.delete_record(self.item(a, 1))
+        self.assertEqual((await self.strategy.get_stream_head(a)).position, 2)
+        await self.strategy.delete_record(self.item(a, 2))
+        head = await self.strategy.get_stream_head(a)
+        self.assertEqual((head.position, head.topic), (0, 'topic'))
+        await self.strategy.delete_record(self.item(a, 0))
+        self.assertIsNone(await self.strategy.get_stream_head(a))
+
+    async def check_deleted_items_are_not_notified(self):
+        a, b = map(self.sequence_id, 'ab')
+        self.strategy = self.construct_strategy(notification_log=True)
+        await self.append_positions(a, range(3))
+        await self.strategy.delete_record(self.item(a, 2))
+        await self.strategy.delete_record(self.item(a, 0))
+        await self.append_positions(b, [0])
+
+        notifications = await self.strategy.read_notifications(1)
+        self.assertEqual([(n.notification_id, n.item.sequence_id, n.item.position) for n in notifications],
+                         [(2, a, 1), (4, b, 0)])
+
+
+class InPlaceActiveRecordStrategyTest(ActiveRecordStrategyTestCase, asynctest.TestCase):
+    def construct_strategy(self, **kwargs):
+        return InPlaceActiveRecordStrategy(active_record_class=SequencedItemFieldNames, **kwargs)
+
+    async def test_deleted_items_are_not_notified(self):
+        await self.check_deleted_items_are_not_notified()
+
+    async def test_stream_head_follows_deletes(self):
+        await self.check_stream_head_follows_deletes()
+
+    async def test_instances_do_not_share_items(self):
+        await self.append_positions('a', range(3))
+        other = self.construct_strategy()
+        self.assertEqual(await other.get_items('a'), [])
+
+    async def test_out_of_order_appends_are_sorted(self):
+        await self.append_positions('a', [5, 1, 3])
+        items = await self.strategy.get_items('a')
+        self.assertEqual([i.position for i in items], [1, 3, 5])
+
+
+class GroupCommitActiveRecordStrategyTest(ActiveRecordStrategyTestCase, asynctest.TestCase):
+    def construct_strategy(self, **kwargs):
+        self.appended_batches = []
+        strategy = InPlaceActiveRecordStrategy(active_record_class=SequencedItemFieldNames, **kwargs)
+        append = strategy.append
+
+        async def counted_append(items):
+            self.appended_batches.append(items)
+            await append(items)
+
+        strategy.append = counted_append
+        return GroupCommitActiveRecordStrategy(strategy)
+
+    async def test_concurrent_appends_are_committed_together(self):
+        await self.append_positions('z', [0])
+        self.appended_batches.clear()
+
+        results = await asyncio.gather(
+            *[self.strategy.append(self.item(sequence_id, 0)) for sequence_id in 'abcd'],
+            self.strategy.append(self.item('z', 0)),
+            self.strategy.append(self.item('a', 0)),
+            return_exceptions=True
+        )
+
+        self.assertEqual(results[:4], [None] * 4)
+        self.assertIsInstance(results[4], SequencedItemError)
+        self.assertIsInstance(results[5], SequencedItemError)
+        # One batch with the stored conflict, then each caller on its own.
+        self.assertEqual([len(b) for b in self.appended_batches], [5, 1, 1, 1, 1, 1])
+        self.assertEqual(len(await self.strategy.all_items()), 5)
+
+    async def test_conflicting_batch_fails_all_callers_without_atomic_appends(self):
+        await self.append_positions('z', [0])
+        self.appended_batches.clear()
+        self.strategy.strategy.atomic_append = False
+
+        results = await asyncio.gather(
+            *[self.strategy.append(self.item(sequence_id, 0)) for sequence_id in 'abz'],
+            return_exceptions=True
+        )
+
+        self.assertEqual(len({id(e) for e in results}), 1)
+        self.assertIsInstance(results[0], SequencedItemError)
+        self.assertEqual([len(b) for b in self.appended_batches], [3])
+
+    async def test_appends_without_conflicts_use_one_batch(self):
+        await asyncio.gather(*[self.strategy.append(self.item(sequence_id, 0)) for sequence_id in 'abcd'])
+        self.assertEqual([len(b) for b in self.appended_batches], [4])
+
+    async def test_rejected_batch_is_not_appended(self):
+        with self.assertRaises(SequencedItemError):
+            await self.strategy.append([self.item('a', 0), self.item('a', 0)])
+        self.assertEqual(self.appended_batches, [])
+
+
+class SQLiteActiveRecordStrategyTest(ActiveRecordStrategyTestCase, asynctest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.strategies = []
+        super(SQLiteActiveRecordStrategyTest, self).setUp()
+
+    def construct_strategy(self, **kwargs):
+        database = os.path.join(self.temp_dir.name, 'events%d.db' % len(self.strategies))
+        strategy = SQLiteActiveRecordStrategy(database, active_record_class=SequencedItemFieldNames, **kwargs)
+        self.strategies.append(strategy)
+        return strategy
+
+    async def test_deleted_items_are_not_notified(self):
+        await self.check_deleted_items_are_not_notified()
+
+    async def test_stream_head_follows_deletes(self):
+        await self.check_stream_head_follows_deletes()
+
+    async def test_uuid_sequence_ids_are_returned_as_uuids(self):
+        sequence_id = uuid.uuid4()
+        await self.append_positions(sequence_id, range(2))
+        items = await self.strategy.get_items(sequence_id)
+        self.assertEqual([i.sequence_id for i in items], [sequence_id, sequence_id])
+        items = await self.strategy.get_items_batch([sequence_id])
+        self.assertEqual(len(items[sequence_id]), 2)
+
+    async def test_items_are_durable(self):
+        await self.append_positions('a', range(2))
+        self.strategy.close()
+        self.strategy = SQLiteActiveRecordStrategy(self.strategy.database, active_record_class=SequencedItemFieldNames)
+        self.strategies.append(self.strategy)
+        self.assertEqual(len(await self.strategy.get_items('a')), 2)
+        self.assertEqual((await self.strategy.get_stream_head('a')).position, 1)
+
+    def tearDown(self):
+        for strategy in self.strategies:
+            strategy.close()
+        self.temp_dir.cleanup()
+
+
+class SQLiteInternedTopicsActiveRecordStrategyTest(SQLiteActiveRecordStrategyTest):
+    def construct_strategy(self, **kwargs):
+        kwargs.setdefault('intern_topics', True)
+        return super(SQLiteInternedTopicsActiveRecordStrategyTest, self).construct_strategy(**kwargs)
+
+    async def test_topics_are_stored_once(self):
+        await self.strategy.append([SequencedItem('a', 0, 'first', '{}'), SequencedItem('a', 1, 'second', '{}'),
+                                    SequencedItem('b', 0, 'first', '{}')])
+        self.strategy.close()
+        self.strategy = SQLiteActiveRecordStrategy(self.strategy.database, intern_topics=True,
+                                                   active_record_class=SequencedItemFieldNames)
+        self.strategies.append(self.strategy)
+
+        items = await self.strategy.all_items()
+        self.assertEqual([i.topic for i in items], ['first', 'second', 'first'])
+        self.assertIs(items[0].topic, items[2].topic)
+        await self.strategy.append(SequencedItem('b', 1, 'second', '{}'))
+        self.assertEqual((await self.strategy.get_item('b', 1)).topic, 'second')
+
+        def read_topic_ids():
+            return self.strategy._connection.execute(
+                'SELECT topic FROM {} ORDER BY topic'.format(self.strategy.table_name)).fetchall()
+
+        self.assertEqual(await self.strategy._run(read_topic_ids), [(1,), (1,), (2,), (2,)])
+
+
+class LogFileActiveRecordStrategyTest(ActiveRecordStrategyTestCase, asynctest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.strategies = []
+        super(LogFileActiveRecordStrategyTest, self).setUp()
+
+    def construct_strategy(self, directory=None, **kwargs):
+        directory = directory or os.path.join(self.temp_dir.name, 'log%d' % len(self.strategies))
+        kwargs.setdefault('segment_size', 256)
+        strategy = LogFileActiveRecordStrategy(directory, fsync=False,
+                                               active_record_class=SequencedItemFieldNames, **kwargs)
+        self.strategies.append(strategy)
+        return strategy
+
+    async def test_segments_rotate_and_reopen(self):
+        sequence_id = uuid.uuid4()
+        for position in range(20):
+            await self.strategy.append([self.item(sequence_id, position), self.item(position, 0.5)])
+        self.assertGreater(len(os.listdir(self.strategy.directory)), 1)
+        self.strategy.close()
+        self.assertTrue(all(segment._mmap is None for segment in self.strategy._segments))
+
+        # Simulate a crash during a write, which leaves half a frame.
+        last_segment = sorted(os.listdir(self.strategy.directory))[-1]
+        with open(os.path.join(self.strategy.directory, last_segment), 'ab') as f:
+            f.write(self.strategy.encode_frame(self.item('x', 0))[:10])
+
+        self.strategy = self.construct_strategy(self.strategy.directory, notification_log=True)
+        items = await self.strategy.get_items(sequence_id, gte=5, limit=3)
+        self.assertEqual([(i.sequence_id, i.position) for i in items], [(sequence_id, 5), (sequence_id, 6), (sequence_id, 7)])
+        self.assertEqual((await self.strategy.get_item(19, 0.5)).position, 0.5)
+        self.assertEqual(len(await self.strategy.all_items()), 40)
+        self.assertEqual((await self.strategy.read_notifications(40))[0].item.sequence_id, 19)
+        self.assertEqual((await self.strategy.get_stream_head(sequence_id)).position, 19)
+
+        await self.append_positions('x', [0])
+        self.assertEqual(len(await self.strategy.get_items('x')), 1)
+
+    async def test_scan_items_resumes_from_token(self):
+        await self.append_positions('b', range(4))
+        await self.append_positions('a', range(3))
+
+        batches = [(batch, resume) async for batch, resume in self.strategy.scan_items(page_size=3)]
+        self.assertEqual([len(batch) for batch, _ in batches], [3, 3, 1])
+        keys = [(i.sequence_id, i.position) for batch, _ in batches for i in batch]
+        self.assertEqual(keys, [('b', 0), ('b', 1), ('b', 2), ('b', 3), ('a', 0), ('a', 1), ('a', 2)])
+
+        batches = [batch async for batch, _ in self.strategy.scan_items(resume=batches[1][1], page_size=3)]
+        self.assertEqual([[(i.sequence_id, i.position) for i in batch] for batch in batches], [[('a', 2)]])
+
+    async def test_grown_segment_is_mapped_again(self):
+        self.strategy = self.construct_strategy(segment_size=1024 * 1024)
+        await self.append_positions('a', [0])
+        self.assertEqual(len(await self.strategy.get_items('a')), 1)
+        segment = self.strategy._segments[-1]
+        buffer = segment._mmap
+
+        await self.append_positions('a', [1])
+        self.assertEqual(len(await self.strategy.get_items('a')), 2)
+        self.assertIsNot(segment._mmap, buffer)
+        self.assertTrue(buffer.closed)
+
+    def tearDown(self):
+        for strategy in self.strategies:
+            strategy.close()
+        self.temp_dir.cleanup()
+
+
+class ShardedActiveRecordStrategyTest(ActiveRecordStrategyTestCase, asynctest.TestCase):
+    def construct_strategy(self, **kwargs):
+        return ShardedActiveRecordStrategy([
+            InPlaceActiveRecordStrategy(active_record_class=SequencedItemFieldNames, **kwargs) for _ in range(3)
+        ])
+
+    async def test_sequences_are_spread_across_shards(self):
+        await self.strategy.append([self.item(sequence_id, 0) for sequence_id in 'abcdefghij'])
+        counts = [len(await shard.all_items()) for shard in self.strategy.strategies]
+        self.assertEqual(sum(counts), 10)
+        self.assertEqual(len([c for c in counts if c]), 3)
+        for sequence_id in 'abcdefghij':
+            shard = self.strategy.shard(sequence_id)
+            self.assertEqual(len(await shard.get_items(sequence_id)), 1)
+
+    async def test_read_notifications(self):
+        with self.assertRaises(ProgrammingError):
+            await self.strategy.read_notifications(1)
+
+    async def test_scan_items_resumes_from_token(self):
+        await self.strategy.append([self.item(sequence_id, p) for sequence_id in 'abcdef' for p in range(3)])
+
+        batches = [(batch, resume) async for batch, resume in self.strategy.scan_items(page_size=4)]
+        self.assertEqual([len(batch) for batch, _ in batches], [4, 4, 4, 4, 2])
+        keys = [(i.sequence_id, i.position) for batch, _ in batches for i in batch]
+        self.assertEqual(keys, [(sequence_id, p) for sequence_id in 'abcdef' for p in range(3)])
+
+        resumed = [batch async for batch, _ in self.strategy.scan_items(resume=batches[0][1], page_size=4)]
+        self.assertEqual([(i.sequence_id, i.position) for batch in resumed for i in batch], keys[4:])
+        self.assertEqual([(r.record.sequence_id, r.record.position) for r in await self.strategy.all_records(
+            resume=batches[1][1], limit=3)], keys[8:11])
+        self.assertEqual([(i.sequence_id, i.position) for i in await self.strategy.all_items()], keys)
+
+
+class ReplicatedActiveRecordStrategyTest(ActiveRecordStrategyTestCase, asynctest.TestCase):
+    def construct_strategy(self, **kwargs):
+        # The primary is its own replica, as if replication had no lag.
+        primary = InPlaceActiveRecordStrategy(active_record_class=SequencedItemFieldNames, **kwargs)
+        return ReplicatedActiveRecordStrategy(primary, [primary])
+
+    async def test_reads_own_writes_from_primary_until_replica_catches_up(self):
+        primary = InPlaceActiveRecordStrategy(active_record_class=SequencedItemFieldNames)
+        replica = InPlaceActiveRecordStrategy(active_record_class=SequencedItemFieldNames)
+        self.strategy = ReplicatedActiveRecordStrategy(primary, [replica])
+
+        await self.append_positions('a', range(3))
+        await replica.append([self.item('a', 0)])
+        self.assertEqual(len(await self.strategy.get_items('a')), 3)
+        self.assertEqual((await self.strategy.get_item('a', 2)).position, 2)
+        self.assertEqual(len((await self.strategy.get_items_batch(['a']))['a']), 3)
+
+        # Sequences not written by this strategy are read from the replica.
+        await replica.append([self.item('b', 0)])
+        self.assertEqual(len(await self.strategy.get_items('b')), 1)
+        self.assertEqual(await primary.get_items('b'), [])
+
+        # Once the replica is assumed to have caught up, reads go to it.
+        self.strategy.max_replica_lag = 0
+        await asyncio.sleep(0.01)
+        self.assertEqual(len(await self.strategy.get_items('a')), 1)
+
+    async def test_reads_check_only_the_callers_writes(self):
+        primary = InPlaceActiveRecordStrategy(active_record_class=SequencedItemFieldNames)
+        replica = InPlaceActiveRecordStrategy(active_record_class=SequencedItemFieldNames)
+        self.strategy = ReplicatedActiveRecordStrategy(primary, [replica])
+
+        # Another task's writes don't send this task's reads to the primary.
+        await asyncio.ensure_future(self.append_positions('a', range(2)))
+        self.assertEqual(await self.strategy.get_items('a'), [])
+
+        with self.strategy.session():
+            await self.append_positions('b', range(2))
+            self.assertEqual(len(await self.strategy.get_items('b')), 2)
+        self.assertEqual(await self.strategy.get_items('b'), [])
+
+        # Within a session, writes made in child tasks are seen by the caller.
+        with self.strategy.session():
+            await asyncio.gather(self.append_positions('c', range(2)), self.append_positions('d', [0]))
+            self.assertEqual(len(await self.strategy.get_items('c')), 2)
+            self.assertEqual(len((await self.strategy.get_items_batch(['d']))['d']), 1)
+
+
+@unittest.skipIf(PeweeActiveRecordStrategy is None, "peewee_async is not installed")
+class PeweeActiveRecordStrategyTest(ActiveRecordStrategyTestCase, asynctest.TestCase):
+    def setUp(self):
+        self.db = PooledPostgresqlDatabase(
+            database=os.environ.get('PGDB', 'postgres'),
+            user=os.environ.get('PGUSER', 'admin'),
+            password=os.environ.get('PGPASS', 'admin'))
+        try:
+            self.db.connect()
+        except OperationalError:
+            raise unittest.SkipTest("PostgreSQL is not available")
+        self.manager = Manager(database=self.db)
+        self.drop_tables()
+        super(PeweeActiveRecordStrategyTest, self).setUp()
+
+    def construct_strategy(self, **kwargs):
+        return PeweeActiveRecordStrategy(manager=self.manager, active_record_class=EventRecord, **kwargs)
+
+    def sequence_id(self, name):
+        # The tables only store UUIDs, which are given in the order of the names.
+        return uuid.UUID(int=ord(name))
+
+    def drop_tables(self):
+        for record_class in (EventRecord, StreamRecord, NotificationRecord):
+            record_class._meta.database = self.db
+            record_class.drop_table(fail_silently=True)
+
+    def tearDown(self):
+        self.drop_tables()
+        self.db.close()
+
+    async def test_deleted_items_are_not_notified(self):
+        await self.check_deleted_items_are_not_notified()
+
+    async def test_stream_head_follows_deletes(self):
+        await self.check_stream_head_follows_deletes()
+
+    async def test_get_items_batch_accepts_ids_of_other_types(self):
+        a, b = uuid.uuid4(), uuid.uuid4()
+        await self.strategy.append([SequencedItem(a, p, 'topic', '{}') for p in range(3)] +
+                                   [SequencedItem(b, 0, 'topic', '{}')])
+
+        # The IDs are given as strings, and the rows have UUIDs.
+        items = await self.strategy.get_items_batch([str(a), str(b)], gt={str(a): 0})
+        self.assertEqual({k: [i.position for i in v] for k, v in items.items()}, {str(a): [1, 2], str(b): [0]})
+        items = await self.strategy.get_items_batch([str(a), str(b)], limit=1, is_ascending=False)
+        self.assertEqual({k: [i.position for i in v] for k, v in items.items()}, {str(a): [2], str(b): [0]})
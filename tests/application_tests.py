@@ -1,9 +1,17 @@
+from concurrent.futures import ProcessPoolExecutor
+
 import asynctest
 
 from eventsource.ext.inplaceactiverecordstrategy import InPlaceActiveRecordStrategy
+from eventsource.exceptions import MismatchedOriginatorIDError, MismatchedOriginatorVersionError
 from eventsource.model.decorators import subscribe_to
+from eventsource.model.events import EventSession, TopicRegistry, topic_from_domain_class
+from eventsource.model.snapshot import Snapshot
+from eventsource.services.eventstore import AbstractEventStore, EventStore
 from eventsource.services.sequenceditem import SequencedItemFieldNames
-from tests.application import ToDoAggregate, ToDoApplication
+from eventsource.services.sequenceditemmapper import SequencedItemMapper
+from eventsource.services.snapshotting import EventSourcedSnapshotStrategy
+from tests.application import ToDoAggregate, ToDoApplication, ToDoRepository
 
 
 class TodoApplicationTest(asynctest.TestCase):
@@ -57,5 +65,151 @@ class TodoApplicationTest(asynctest.TestCase):
         events = await self.app.todos.event_store.get_domain_events(3)
         self.assertEqual(len(events), 2)
 
+    async def test_todo_should_replay_in_pages(self):
+        todo_item = ToDoAggregate.create_todos(5)
+        for i in range(7):
+            todo_item.add_item('item %d' % i)
+        await self.app.todos.save(todo_item)
+
+        repository = ToDoRepository(event_store=self.app.entity_event_store, event_session=EventSession())
+        repository.event_player.page_size = 3
+        todo_item = await repository.get_entity(5)
+        self.assertEqual(len(todo_item.items), 7)
+
+        pages = [len(page) async for page in repository.event_store.iter_domain_events(5, page_size=3)]
+        self.assertEqual(pages, [3, 3, 2])
+
+    async def test_todo_should_replay_trusted_events(self):
+        todo_item = ToDoAggregate.create_todos(12)
+        for i in range(7):
+            todo_item.add_item('item %d' % i)
+        await self.app.todos.save(todo_item)
+
+        repository = ToDoRepository(event_store=self.app.entity_event_store, event_session=EventSession())
+        player = repository.event_player
+        player.trusted_replay = True
+        self.assertEqual(len((await repository.get_entity(12)).items), 7)
+        player.page_size = 3
+        self.assertEqual(len((await repository.get_entity(12)).items), 7)
+
+        events = await repository.event_store.get_domain_events(12)
+        with self.assertRaises(MismatchedOriginatorVersionError):
+            player.replay_stream_events(12, None, events[:3] + events[4:])
+        with self.assertRaises(MismatchedOriginatorVersionError):
+            player.replay_stream_events(12, None, events[4:], last_version=2)
+        with self.assertRaises(MismatchedOriginatorVersionError):
+            player.replay_stream_events(12, None, [events[0], events[2], events[1], events[3]])
+        with self.assertRaises(MismatchedOriginatorIDError):
+            player.replay_stream_events(13, None, events)
+
+        # Events replayed onto a snapshot must follow on from its version.
+        state = await player.replay_entity(12, lte=2)
+        strategy = repository.event_store.active_record_strategy
+        await strategy.delete_record(await strategy.get_item(12, 3))
+        for page_size in (None, 2):
+            player.page_size = page_size
+            with self.assertRaises(MismatchedOriginatorVersionError):
+                await player.replay_entity(12, gt=2, initial_state=state)
+            with self.assertRaises(MismatchedOriginatorVersionError):
+                await player.replay_entities([12], gt={12: 2}, initial_states={12: state})
+
+    async def test_todos_should_load_together(self):
+        for todo_id in (6, 7):
+            todo_item = ToDoAggregate.create_todos(todo_id)
+            todo_item.add_item('item %d' % todo_id)
+            await self.app.todos.save(todo_item)
+
+        todos = await self.app.todos.get_entities([6, 7, 8])
+        self.assertEqual(todos[6].items[0].name, 'item 6')
+        self.assertEqual(todos[7].items[0].name, 'item 7')
+        self.assertIsNone(todos[8])
+
+    async def test_last_snapshots_are_read_together(self):
+        snapshot_store = EventStore(InPlaceActiveRecordStrategy(active_record_class=SequencedItemFieldNames),
+                                    SequencedItemMapper(sequence_id_attr_name='originator_id',
+                                                        position_attr_name='originator_version'))
+        topic = topic_from_domain_class(ToDoAggregate)
+        for version in range(3):
+            await snapshot_store.append(Snapshot(originator_id=14, originator_version=version, topic=topic,
+                                                 state={'_version': version}))
+
+        snapshots = await EventSourcedSnapshotStrategy(snapshot_store).get_snapshots([14, 15])
+        self.assertEqual(list(snapshots), [14])
+        self.assertEqual(snapshots[14].originator_version, 2)
+
+    async def test_contains_checks_stream_head(self):
+        self.assertFalse(await self.app.todos.contains(9))
+        todo_item = ToDoAggregate.create_todos(9)
+        await self.app.todos.save(todo_item)
+        self.assertTrue(await self.app.todos.contains(9))
+
+        todo_item.discard()
+        await self.app.todos.save(todo_item)
+        self.assertFalse(await self.app.todos.contains(9))
+
+    async def test_contains_replays_entity_when_topic_is_not_registered(self):
+        await self.app.todos.save(ToDoAggregate.create_todos(16))
+        self.app.todos._topic_registry = TopicRegistry(strict=True)
+        self.assertTrue(await self.app.todos.contains(16))
+        self.assertFalse(await self.app.todos.contains(17))
+
+    async def test_event_store_defaults_use_abstract_methods(self):
+        todo_item = ToDoAggregate.create_todos(18)
+        todo_item.add_item('item')
+        await self.app.todos.save(todo_item)
+        event_store = DelegatingEventStore(self.app.entity_event_store)
+
+        head = await event_store.get_stream_head(18)
+        self.assertEqual((head.position, head.topic), (1, topic_from_domain_class(ToDoAggregate.ToDoAdded)))
+        self.assertTrue(await event_store.stream_exists(18))
+        self.assertFalse(await event_store.stream_exists(19))
+        batch = await event_store.get_domain_events_batch([18, 19], limit=1, is_ascending=False)
+        self.assertEqual({k: [e.originator_version for e in v] for k, v in batch.items()}, {18: [1], 19: []})
+        pages = [len(page) async for page in event_store.iter_domain_events(18, page_size=1)]
+        self.assertEqual(pages, [2])
+
+    async def test_todos_should_decode_in_executor(self):
+        for todo_id in (10, 11):
+            todo_item = ToDoAggregate.create_todos(todo_id)
+            for i in range(7):
+                todo_item.add_item('item %d' % i)
+            await self.app.todos.save(todo_item)
+        event_store = self.app.entity_event_store
+        events = await event_store.get_domain_events(10)
+
+        with ProcessPoolExecutor(2) as executor:
+            event_store = EventStore(self.ar_strategy, event_store.sequenced_item_mapper, executor=executor,
+                                     executor_batch_size=3)
+            self.assertEqual(await event_store.get_domain_events(10), events)
+            batch = await event_store.get_domain_events_batch([10, 11])
+            self.assertEqual(batch[10], events)
+            self.assertEqual([e.originator_id for e in batch[11]], [11] * 8)
+
     def tearDown(self):
         self.app.close()
+
+
+class DelegatingEventStore(AbstractEventStore):
+    """
+    Implements only the abstract methods of an event store.
+    """
+
+    def __init__(self, event_store):
+        self.event_store = event_store
+
+    async def append(self, domain_event_or_events):
+        await self.event_store.append(domain_event_or_events)
+
+    async def get_domain_events(self, originator_id, gt=None, gte=None, lt=None, lte=None, limit=None,
+                                is_ascending=True, page_size=None):
+        return await self.event_store.get_domain_events(originator_id, gt=gt, gte=gte, lt=lt, lte=lte, limit=limit,
+                                                        is_ascending=is_ascending)
+
+    async def get_domain_event(self, originator_id, eq):
+        return await self.event_store.get_domain_event(originator_id, eq)
+
+    async def get_most_recent_event(self, originator_id, lt=None, lte=None):
+        return await self.event_store.get_most_recent_event(originator_id, lt=lt, lte=lte)
+
+    async def all_domain_events(self):
+        return await self.event_store.all_domain_events()
@@ -1,5 +1,9 @@
 import unittest
 
+from eventsource.model.decorators import mutator
+from eventsource.model.entity import TimestampedVersionedEntity, VersionedEntity
+from eventsource.model.events import DomainEvent
+from eventsource.services.snapshotting import copy_state
 from tests.application import ToDoAggregate
 
 
@@ -54,3 +58,74 @@ class TodoDomainTest(unittest.TestCase):
 
         events = todo_app.flush()
         self.assertEqual(len(events), 4)
+
+    def test_entity_attribute_changes_replay(self):
+        for entity_class in (VersionedEntity, TimestampedVersionedEntity):
+            entity = entity_class._mutate(None, entity_class.Created(originator_id=1, originator_version=0))
+            entity.change_attribute('_name', 'first')
+            entity.change_attribute('_name', 'second')
+            self.assertEqual(entity._name, 'second')
+            self.assertEqual(entity.version, 3)
+
+    def test_mutator_handlers_are_cached_until_registered(self):
+        class Started(DomainEvent):
+            pass
+
+        class Restarted(Started):
+            pass
+
+        made = []
+
+        @mutator
+        def mutate(initial, event):
+            return 'default'
+
+        @mutate.register_factory(Started)
+        def _(event_class):
+            made.append(event_class)
+            return lambda initial, event: event_class.__name__
+
+        self.assertEqual(mutate(None, Started()), 'Started')
+        self.assertEqual(mutate(None, Restarted()), 'Restarted')
+        self.assertEqual(mutate(None, Started()), 'Started')
+        self.assertEqual(made, [Started, Restarted])
+
+        mutate.register(Restarted, lambda initial, event: 'registered')
+        self.assertEqual(mutate(None, Restarted()), 'registered')
+        self.assertEqual(mutate(None, Started()), 'Started')
+        self.assertEqual(made, [Started, Restarted, Started])
+
+    def test_snapshot_state_shares_immutable_values(self):
+        todo_app = ToDoAggregate.create_todos(originator_id=1)
+        todo_app.add_item('test todo')
+        state = copy_state(todo_app.__dict__)
+        items = state['_ToDoAggregate__items']
+        self.assertIsNot(items, todo_app.items)
+        self.assertIsNot(items[0], todo_app.items[0])
+        self.assertIs(items[0].name, todo_app.items[0].name)
+        self.assertEqual(list(state['_pending_events']), list(todo_app._pending_events))
+
+        todo_app.complete_item(item_id=1)
+        self.assertTrue(todo_app.items[0].is_completed)
+        self.assertFalse(items[0].is_completed)
+
+    def test_snapshot_state_copies_subclasses_of_immutable_types(self):
+        class Name(str):
+            pass
+
+        name = Name('test todo')
+        name.language = 'en'
+        state = copy_state({'name': name})
+        self.assertIsInstance(state['name'], Name)
+        self.assertEqual(state['name'], 'test todo')
+        self.assertEqual(state['name'].language, 'en')
+
+    def test_snapshot_state_preserves_shared_and_cyclic_references(self):
+        shared = ['test todo']
+        cyclic = {'items': shared}
+        cyclic['self'] = cyclic
+        state = copy_state({'a': shared, 'b': shared, 'cyclic': cyclic})
+        self.assertIsNot(state['a'], shared)
+        self.assertIs(state['a'], state['b'])
+        self.assertIs(state['cyclic']['self'], state['cyclic'])
+        self.assertIs(state['cyclic']['items'], state['a'])
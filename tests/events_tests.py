@@ -0,0 +1,119 @@
+import pickle
+import time
+import unittest
+import uuid
+
+from eventsource.exceptions import TopicResolutionError
+from eventsource.model.events import CompactDomainEvent, DomainEvent, EventWithTimeuuid, TopicRegistry, \
+    create_time_ordered_id, create_timesequenced_event_id, topic_from_domain_class
+from eventsource.services.sequenceditemmapper import SequencedItemMapper
+from eventsource.services.time import timestamp_from_uuid
+from tests.application import ToDoAggregate
+
+
+class Measured(CompactDomainEvent):
+    originator_id: uuid.UUID
+    originator_version: int
+    value: float
+    unit: str = 'm'
+
+
+class Corrected(Measured):
+    reason: str
+
+
+class TopicRegistryTest(unittest.TestCase):
+    def test_resolves_registered_classes_and_aliases(self):
+        registry = TopicRegistry(strict=True)
+        registry.register(ToDoAggregate.Created, aliases=['old.todos#Created'])
+
+        topic = topic_from_domain_class(ToDoAggregate.Created)
+        self.assertIs(registry.resolve(topic), ToDoAggregate.Created)
+        self.assertIs(registry.resolve('old.todos#Created'), ToDoAggregate.Created)
+
+    def test_strict_registry_does_not_import(self):
+        registry = TopicRegistry(strict=True)
+        with self.assertRaises(TopicResolutionError):
+            registry.resolve(topic_from_domain_class(ToDoAggregate.ToDoAdded))
+
+    def test_imports_and_caches_other_topics(self):
+        registry = TopicRegistry(cache_size=1)
+        topic = topic_from_domain_class(ToDoAggregate.ToDoAdded)
+        self.assertIs(registry.resolve(topic), ToDoAggregate.ToDoAdded)
+        self.assertIs(registry.resolve(topic), ToDoAggregate.ToDoAdded)
+        with self.assertRaises(TopicResolutionError):
+            registry.resolve('tests.application#Missing')
+
+        registry.register_alias('moved#ToDoAdded', topic)
+        self.assertIs(registry.resolve('moved#ToDoAdded'), ToDoAggregate.ToDoAdded)
+
+
+class CompactDomainEventTest(unittest.TestCase):
+    def test_fields_are_slots(self):
+        event = Corrected(originator_id=uuid.uuid4(), originator_version=1, value=2.5, reason='typo')
+        self.assertEqual(Corrected.__fields__, ('originator_id', 'originator_version', 'value', 'unit', 'reason'))
+        self.assertEqual(Corrected.__dictoffset__, 0)
+        self.assertEqual(event.unit, 'm')
+        self.assertEqual(event.__dict__, {'originator_id': event.originator_id, 'originator_version': 1,
+                                          'value': 2.5, 'unit': 'm', 'reason': 'typo'})
+        self.assertIsInstance(event, DomainEvent)
+
+        with self.assertRaises(AttributeError):
+            event.value = 3
+        with self.assertRaises(TypeError):
+            Measured(originator_id=1, originator_version=0)
+        with self.assertRaises(TypeError):
+            Measured(originator_id=1, originator_version=0, value=1, colour='red')
+
+    def test_subclass_overrides_default(self):
+        class Remeasured(Corrected):
+            unit: str = 'cm'
+
+        class Rounded(Remeasured):
+            reason = 'rounding'
+
+        event = Rounded(originator_id=1, originator_version=0, value=2.5)
+        self.assertEqual((event.unit, event.reason), ('cm', 'rounding'))
+        self.assertEqual(Rounded.__fields__, Corrected.__fields__)
+        self.assertEqual(Corrected(originator_id=1, originator_version=0, value=2.5, reason='').unit, 'm')
+
+    def test_equality_and_hash(self):
+        originator_id = uuid.uuid4()
+        event = Measured(originator_id=originator_id, originator_version=0, value=1.0)
+        same = Measured(originator_id=originator_id, originator_version=0, value=1.0)
+        self.assertEqual(event, same)
+        self.assertEqual(hash(event), hash(same))
+        self.assertNotEqual(event, Measured(originator_id=originator_id, originator_version=0, value=2.0))
+        self.assertNotEqual(event, Corrected(originator_id=originator_id, originator_version=0, value=1.0,
+                                             reason=''))
+        self.assertEqual(pickle.loads(pickle.dumps(event)), event)
+
+    def test_mapping(self):
+        event = Corrected(originator_id=uuid.uuid4(), originator_version=1, value=2.5, reason='typo')
+        for lazy in (False, True):
+            mapper = SequencedItemMapper(sequence_id_attr_name='originator_id',
+                                         position_attr_name='originator_version', lazy=lazy)
+            read = mapper.from_sequenced_item(mapper.to_sequenced_item(event))
+            self.assertIsInstance(read, Corrected)
+            self.assertEqual(read.originator_version, 1)
+            self.assertEqual(read, event)
+            self.assertIs(type(read), Corrected)
+
+
+class TimeOrderedIDTest(unittest.TestCase):
+    def test_ids_are_increasing_uuid7(self):
+        ids = [create_time_ordered_id() for _ in range(10000)]
+        self.assertEqual(ids, sorted(set(ids)))
+        self.assertEqual({i.version for i in ids}, {7})
+        self.assertEqual({i.variant for i in ids}, {uuid.RFC_4122})
+        self.assertLess(uuid.UUID(create_timesequenced_event_id()), create_time_ordered_id())
+        self.assertEqual(EventWithTimeuuid().event_id.version, 7)
+
+    def test_timestamp_from_uuid(self):
+        before = time.time()
+        event_id = create_time_ordered_id()
+        after = time.time()
+        self.assertLessEqual(before - 1e-6, timestamp_from_uuid(event_id))
+        self.assertLessEqual(timestamp_from_uuid(event_id), after)
+        self.assertEqual(timestamp_from_uuid(event_id.hex), timestamp_from_uuid(event_id))
+        self.assertAlmostEqual(timestamp_from_uuid(uuid.uuid1()), time.time(), delta=1)
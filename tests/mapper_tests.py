@@ -0,0 +1,319 @@
+import datetime
+import json
+import os
+import pickle
+import tempfile
+import threading
+import unittest
+import uuid
+
+import asynctest
+
+from eventsource.ext.inplaceactiverecordstrategy import InPlaceActiveRecordStrategy
+from eventsource.exceptions import TopicResolutionError
+from eventsource.model.events import EventWithOriginatorID, EventWithOriginatorVersion, TopicRegistry, \
+    topic_from_domain_class
+from eventsource.services.blobstore import FileSystemBlobStore
+from eventsource.services.codecs import MsgpackCodec, msgpack
+from eventsource.services.eventplayer import EventPlayer
+from eventsource.services.eventstore import EventStore
+from eventsource.services.compression import PayloadCompressor, ZLIB, ZSTD, zstandard
+from eventsource.services.sequenceditem import SequencedItem, SequencedItemFieldNames
+from eventsource.services.sequenceditemmapper import AbstractSequencedItemMapper, SequencedItemMapper
+from eventsource.services.transcoding import ObjectJSONEncoder, make_json_encode
+from tests.application import ToDoAggregate, ToDoItem
+
+
+class Uploaded(EventWithOriginatorVersion, EventWithOriginatorID):
+    pass
+
+
+class CountingBlobStore(FileSystemBlobStore):
+    def __init__(self, directory):
+        super(CountingBlobStore, self).__init__(directory)
+        self.gets = 0
+        self.threads = set()
+
+    def put(self, data):
+        self.threads.add(threading.get_ident())
+        return super(CountingBlobStore, self).put(data)
+
+    def get(self, key):
+        self.gets += 1
+        self.threads.add(threading.get_ident())
+        return super(CountingBlobStore, self).get(key)
+
+
+class SequencedItemMapperTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.blob_store = CountingBlobStore(self.temp_dir.name)
+        self.mapper = SequencedItemMapper(sequence_id_attr_name='originator_id',
+                                          position_attr_name='originator_version',
+                                          blob_store=self.blob_store, offload_threshold=100)
+
+    def test_large_values_are_offloaded(self):
+        payload = {'rows': list(range(100))}
+        event = Uploaded(originator_id=uuid.uuid4(), originator_version=0, name='small', payload=payload)
+        item = self.mapper.to_sequenced_item(event)
+        self.assertLess(len(item.data), 250)
+        self.assertIn('small', item.data)
+
+        read = self.mapper.from_sequenced_item(item)
+        self.assertEqual(self.blob_store.gets, 0)
+        self.assertEqual(read.payload, payload)
+        self.assertEqual(self.blob_store.gets, 1)
+        self.assertIs(type(read), Uploaded)
+        self.assertEqual(read, event)
+
+    def test_lazy_events_compare_equal(self):
+        event = Uploaded(originator_id=uuid.uuid4(), originator_version=0, payload='x' * 1000)
+        read = self.mapper.from_sequenced_item(self.mapper.to_sequenced_item(event))
+        self.assertEqual(event, read)
+        self.assertEqual(hash(event), hash(read))
+
+    def test_offloaded_values_are_encoded_once(self):
+        event = Uploaded(originator_id=uuid.uuid4(), originator_version=0, name='caf\xe9', payload='x' * 1000)
+        key = self.blob_store.content_key(json.dumps('x' * 1000).encode('utf8'))
+        item = self.mapper.to_sequenced_item(event)
+        attrs = dict(event.__dict__, payload=key, __blobs__=['payload'])
+        self.assertEqual(item.data, json.dumps(attrs, separators=(',', ':'), sort_keys=True, cls=ObjectJSONEncoder))
+
+    def test_values_like_blob_references_are_kept(self):
+        event = Uploaded(originator_id=uuid.uuid4(), originator_version=0, ref={'__blob__': 'abc'},
+                         payload='x' * 1000)
+        read = self.mapper.from_sequenced_item(self.mapper.to_sequenced_item(event))
+        self.assertEqual(read.ref, {'__blob__': 'abc'})
+        self.assertEqual(read, event)
+
+    def test_repeated_values_are_stored_once(self):
+        for version in range(3):
+            self.mapper.to_sequenced_item(Uploaded(originator_id=1, originator_version=version, payload='x' * 1000))
+        blobs = [name for _, _, names in os.walk(self.temp_dir.name) for name in names]
+        self.assertEqual(len(blobs), 1)
+
+    def test_stored_json_is_unchanged_by_cached_encoders(self):
+        mapper = SequencedItemMapper(sequence_id_attr_name='originator_id', position_attr_name='originator_version')
+        for i in range(3):
+            event = Uploaded(originator_id=uuid.uuid4(), originator_version=i, name='caf\xe9 %d' % i,
+                             day=datetime.date(2017, 5, i + 1), sizes={'b': 2.5, 'a': [1, None]})
+            item = mapper.to_sequenced_item(event)
+            self.assertEqual(item.data, json.dumps(event.__dict__, separators=(',', ':'), sort_keys=True,
+                                                   cls=ObjectJSONEncoder))
+            self.assertEqual(mapper.from_sequenced_item(item), event)
+
+    def test_cached_encoders_check_circular_references(self):
+        encode = make_json_encode()
+        value = {'a': [1]}
+        value['a'].append(value)
+        with self.assertRaises(ValueError):
+            encode(value)
+        # A failed encoding doesn't leave objects marked as being encoded.
+        value['a'].pop()
+        self.assertEqual(encode(value), '{"a":[1]}')
+        self.assertEqual(encode([value, value]), '[{"a":[1]},{"a":[1]}]')
+
+    def test_data_is_compressed_with_topic_dictionary(self):
+        self.check_compression(PayloadCompressor(codec=ZLIB, min_size=0))
+
+    @unittest.skipIf(zstandard is None, "zstandard is not installed")
+    def test_data_is_compressed_with_zstd_dictionary(self):
+        self.check_compression(PayloadCompressor(codec=ZSTD, min_size=0))
+
+    def check_compression(self, compressor):
+        mapper = SequencedItemMapper(sequence_id_attr_name='originator_id',
+                                     position_attr_name='originator_version', compressor=compressor)
+        events = [Uploaded(originator_id=uuid.uuid4(), originator_version=i, name='upload %d' % i,
+                           content_type='application/json', status='complete') for i in range(200)]
+        items = [mapper.to_sequenced_item(e) for e in events]
+        plain = SequencedItemMapper(sequence_id_attr_name='originator_id', position_attr_name='originator_version')
+        self.assertEqual([plain.from_sequenced_item(i) for i in items], events)
+
+        dictionary = compressor.train_dictionary(items[0].topic, [i.data for i in items], size=1024)
+        compressed = [mapper.to_sequenced_item(e) for e in events]
+        self.assertTrue(all(compressor.is_compressed(i.data) for i in compressed))
+        self.assertLess(sum(len(i.data) for i in compressed), sum(len(i.data) for i in items) * 2 / 3)
+        self.assertEqual([mapper.from_sequenced_item(i) for i in compressed], events)
+
+        # Another compressor needs the dictionary to read the items.
+        reader = SequencedItemMapper(compressor=PayloadCompressor(codec=ZLIB, dictionaries=[dictionary]))
+        self.assertEqual(reader.from_sequenced_item(compressed[0]), events[0])
+
+    @unittest.skipIf(msgpack is None, "msgpack is not installed")
+    def test_msgpack_codec(self):
+        mapper = SequencedItemMapper(sequence_id_attr_name='originator_id',
+                                     position_attr_name='originator_version', codec=MsgpackCodec())
+        event = Uploaded(originator_id=uuid.uuid4(), originator_version=0,
+                         uploaded_at=datetime.datetime(2017, 5, 1, 12, 30, tzinfo=datetime.timezone.utc),
+                         local_time=datetime.datetime(2017, 5, 1, 12, 30, 15, 123), day=datetime.date(2017, 5, 1),
+                         item=ToDoItem(1, 'item', False), tags=['a', 'b'], sizes={'small': 1})
+        item = mapper.to_sequenced_item(event)
+        self.assertTrue(item.data.startswith('%msgpack:'))
+
+        read = mapper.from_sequenced_item(item)
+        self.assertEqual(read.__dict__.keys(), event.__dict__.keys())
+        for name in ('originator_id', 'uploaded_at', 'local_time', 'day', 'tags', 'sizes'):
+            self.assertEqual(getattr(read, name), getattr(event, name))
+        self.assertIsInstance(read.item, ToDoItem)
+        self.assertEqual(read.item.__dict__, event.item.__dict__)
+
+        # Items written with either codec can be read by both mappers.
+        json_mapper = SequencedItemMapper(sequence_id_attr_name='originator_id',
+                                          position_attr_name='originator_version')
+        self.assertEqual(json_mapper.from_sequenced_item(item).originator_id, event.originator_id)
+        event = Uploaded(originator_id=uuid.uuid4(), originator_version=0)
+        self.assertEqual(mapper.from_sequenced_item(json_mapper.to_sequenced_item(event)), event)
+
+        # Compressed items record the codec too.
+        mapper.compressor = PayloadCompressor(codec=ZLIB, min_size=0)
+        event = Uploaded(originator_id=uuid.uuid4(), originator_version=0, name='x' * 100)
+        item = mapper.to_sequenced_item(event)
+        self.assertTrue(item.data.startswith('~zlib::msgpack:'))
+        self.assertEqual(mapper.from_sequenced_item(item), event)
+
+    def test_strict_registry_resolves_nested_objects(self):
+        event = Uploaded(originator_id=uuid.uuid4(), originator_version=0, item=ToDoItem(1, 'item', False))
+        codec_classes = [None, MsgpackCodec] if msgpack is not None else [None]
+        for codec_class in codec_classes:
+            registry = TopicRegistry(strict=True)
+            registry.register(Uploaded)
+            mapper = SequencedItemMapper(sequence_id_attr_name='originator_id',
+                                         position_attr_name='originator_version', topic_registry=registry,
+                                         codec=codec_class and codec_class(topic_registry=registry))
+            item = mapper.to_sequenced_item(event)
+            with self.assertRaises(TopicResolutionError):
+                mapper.from_sequenced_item(item)
+
+            registry.register(ToDoItem)
+            self.assertIsInstance(mapper.from_sequenced_item(item).item, ToDoItem)
+
+    def test_batch_mapping(self):
+        plain = SequencedItemMapper(sequence_id_attr_name='originator_id', position_attr_name='originator_version')
+        lazy = SequencedItemMapper(sequence_id_attr_name='originator_id', position_attr_name='originator_version',
+                                   lazy=True)
+        originator_id = uuid.uuid4()
+        events = [Uploaded(originator_id=originator_id, originator_version=0, payload='x' * 1000)]
+        events += [ToDoAggregate.ToDoAdded(originator_id=originator_id, originator_version=i, item_id=i,
+                                           name='item %d' % i) if i % 2 else
+                   Uploaded(originator_id=originator_id, originator_version=i, name='upload %d' % i)
+                   for i in range(1, 10)]
+        for mapper in (plain, lazy, self.mapper):
+            items = mapper.to_sequenced_items(events)
+            self.assertEqual(items, [mapper.to_sequenced_item(e) for e in events])
+            self.assertEqual(mapper.from_sequenced_items(items), events)
+            self.assertEqual([type(e) for e in mapper.from_sequenced_items(items)],
+                             [type(mapper.from_sequenced_item(i)) for i in items])
+
+    def test_mapper_can_be_pickled(self):
+        mapper = SequencedItemMapper(sequence_id_attr_name='originator_id', position_attr_name='originator_version',
+                                     blob_store=self.blob_store, offload_threshold=100,
+                                     compressor=PayloadCompressor(codec=ZLIB, min_size=0))
+        events = [Uploaded(originator_id=uuid.uuid4(), originator_version=i, payload='x' * 1000 + str(i))
+                  for i in range(3)]
+        items = mapper.to_sequenced_items(events)
+        mapper.compressor.train_dictionary(items[0].topic, [i.data for i in items])
+        items = mapper.to_sequenced_items(events)
+
+        unpickled = pickle.loads(pickle.dumps(mapper))
+        self.assertEqual(unpickled.to_sequenced_items(events), items)
+        decoded_attrs = unpickled.decode_sequenced_items(items)
+        self.assertEqual(mapper.reconstruct_domain_events(items, decoded_attrs), events)
+
+    def test_lazy_events_are_decoded_when_used(self):
+        mapper = SequencedItemMapper(sequence_id_attr_name='originator_id',
+                                     position_attr_name='originator_version', lazy=True)
+        decoded = []
+        deserialize_event_attrs = mapper.deserialize_event_attrs
+        mapper.deserialize_event_attrs = lambda *args: decoded.append(args) or deserialize_event_attrs(*args)
+        event = Uploaded(originator_id=uuid.uuid4(), originator_version=3, name='report')
+        read = mapper.from_sequenced_item(mapper.to_sequenced_item(event))
+
+        # Filtering by type, topic or ID doesn't decode the event.
+        self.assertIsInstance(read, Uploaded)
+        self.assertNotIsInstance(read, ToDoAggregate.Event)
+        self.assertEqual(topic_from_domain_class(read.__class__), topic_from_domain_class(Uploaded))
+        self.assertEqual(read.originator_id, event.originator_id)
+        self.assertEqual(read.originator_version, 3)
+        self.assertEqual(decoded, [])
+
+        self.assertEqual(read.name, 'report')
+        self.assertEqual(len(decoded), 1)
+        self.assertIs(type(read), Uploaded)
+        self.assertEqual(read, event)
+        self.assertEqual(len(decoded), 1)
+
+    def test_lazy_events_are_replayed(self):
+        mapper = SequencedItemMapper(sequence_id_attr_name='originator_id',
+                                     position_attr_name='originator_version', lazy=True)
+        strategy = InPlaceActiveRecordStrategy(active_record_class=SequencedItemFieldNames)
+        player = EventPlayer(EventStore(strategy, mapper), ToDoAggregate._mutate)
+        todos = ToDoAggregate.create_todos(uuid.uuid4(), todo_name='chores')
+        todos.add_item('dishes')
+        todos.add_item('laundry')
+        todos.complete_item(item_id=1)
+        events = todos.flush()
+
+        read = [mapper.from_sequenced_item(mapper.to_sequenced_item(e)) for e in events]
+        self.assertEqual(read, events)
+        replayed = player.replay_events(None, read)
+        self.assertEqual(replayed.id, todos.id)
+        self.assertEqual([(i.name, i.is_completed) for i in replayed.items],
+                         [('dishes', True), ('laundry', False)])
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+
+class NameMapper(AbstractSequencedItemMapper):
+    """
+    A mapper with only the methods every mapper has.
+    """
+
+    def to_sequenced_item(self, domain_event):
+        return SequencedItem(domain_event.originator_id, domain_event.originator_version,
+                             topic_from_domain_class(Uploaded), json.dumps({'name': domain_event.name}))
+
+    def from_sequenced_item(self, sequenced_item):
+        return Uploaded(originator_id=sequenced_item.sequence_id, originator_version=sequenced_item.position,
+                        **json.loads(sequenced_item.data))
+
+
+class EventStoreMappingTest(asynctest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.blob_store = CountingBlobStore(self.temp_dir.name)
+        mapper = SequencedItemMapper(sequence_id_attr_name='originator_id', position_attr_name='originator_version',
+                                     blob_store=self.blob_store, offload_threshold=100)
+        strategy = InPlaceActiveRecordStrategy(active_record_class=SequencedItemFieldNames, notification_log=True)
+        self.event_store = EventStore(strategy, mapper)
+
+    async def test_blobs_are_put_and_got_without_blocking_the_event_loop(self):
+        originator_id = uuid.uuid4()
+        events = [Uploaded(originator_id=originator_id, originator_version=i, payload='x' * 1000) for i in range(3)]
+        await self.event_store.append(events[0])
+        await self.event_store.append(events[1:])
+
+        read = await self.event_store.get_domain_events(originator_id)
+        self.assertEqual(read, events)
+        # The same value is got once for all the events.
+        self.assertEqual(self.blob_store.gets, 1)
+
+        self.assertEqual(await self.event_store.get_domain_event(originator_id, 1), events[1])
+        notifications = await self.event_store.read_notifications(1)
+        self.assertEqual([n.item for n in notifications], events)
+        self.assertEqual(self.blob_store.gets, 3)
+        self.assertNotIn(threading.get_ident(), self.blob_store.threads)
+
+    async def test_custom_mapper(self):
+        strategy = InPlaceActiveRecordStrategy(active_record_class=SequencedItemFieldNames, notification_log=True)
+        event_store = EventStore(strategy, NameMapper())
+        originator_id = uuid.uuid4()
+        events = [Uploaded(originator_id=originator_id, originator_version=i, name='upload %d' % i) for i in range(2)]
+        await event_store.append(events)
+
+        self.assertEqual(await event_store.get_domain_events(originator_id), events)
+        self.assertEqual(await event_store.get_domain_event(originator_id, 1), events[1])
+        self.assertEqual([n.item for n in await event_store.read_notifications(1)], events)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()